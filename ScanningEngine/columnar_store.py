@@ -0,0 +1,245 @@
+import hashlib
+from datetime import datetime
+
+import numpy as np
+
+from compact_results import iter_vulnerabilities
+from config import COLUMNAR_DIR
+from logger import ScanLogger
+from report_reader import SEVERITY_LEVELS, SEVERITY_EDGES
+
+PROTOCOLS = ('', 'tcp', 'udp')
+
+
+def severity_codes(severity):
+    # Vectorized severity_code(): 0 for info, then the buckets above 0
+    severity = np.asarray(severity)
+    return np.where(severity > 0, np.digitize(severity, SEVERITY_EDGES) + 1, 0)
+
+
+def split_port(port):
+    # '443/tcp' -> (443, 'tcp'); 'general/tcp' and friends get port -1
+    number, _, proto = port.partition('/')
+    return (int(number) if number.isdigit() else -1), proto
+
+
+class FindingColumns:
+    def __init__(self, severity, host, port, proto, nvt, report,
+                 hosts, nvts, reports):
+        self.severity = severity
+        self.host = host
+        self.port = port
+        self.proto = proto
+        self.nvt = nvt
+        self.report = report
+        self.hosts = hosts
+        self.nvts = nvts
+        self.reports = reports
+
+    def __len__(self):
+        return len(self.severity)
+
+    @classmethod
+    def from_records(cls, records, report_id, timestamp):
+        host_index = {}
+        nvt_index = {}
+        severity, host, port, proto, nvt = [], [], [], [], []
+
+        for record in records:
+            number, protocol = split_port(record['port'])
+            severity.append(record['severity'])
+            host.append(host_index.setdefault(record['host'], len(host_index)))
+            port.append(number)
+            proto.append(PROTOCOLS.index(protocol) if protocol in PROTOCOLS else 0)
+            oid = record.get('nvt_oid') or record['name']
+            nvt.append(nvt_index.setdefault(oid, len(nvt_index)))
+
+        return cls(
+            np.array(severity, dtype=np.float32),
+            np.array(host, dtype=np.int32),
+            np.array(port, dtype=np.int32),
+            np.array(proto, dtype=np.int8),
+            np.array(nvt, dtype=np.int32),
+            np.zeros(len(severity), dtype=np.int32),
+            np.array(list(host_index), dtype=str),
+            np.array(list(nvt_index), dtype=str),
+            np.array([(report_id, timestamp)], dtype=str).reshape(1, 2),
+        )
+
+    @classmethod
+    def concat(cls, parts):
+        parts = [p for p in parts if p is not None]
+        if not parts:
+            return cls.empty()
+
+        # Each report has its own host/NVT dictionaries; remap them onto one
+        hosts, host_inverse = np.unique(
+            np.concatenate([p.hosts[p.host] for p in parts]), return_inverse=True
+        )
+        nvts, nvt_inverse = np.unique(
+            np.concatenate([p.nvts[p.nvt] for p in parts]), return_inverse=True
+        )
+        offsets = np.cumsum([0] + [len(p.reports) for p in parts[:-1]])
+        return cls(
+            np.concatenate([p.severity for p in parts]),
+            host_inverse.astype(np.int32),
+            np.concatenate([p.port for p in parts]),
+            np.concatenate([p.proto for p in parts]),
+            nvt_inverse.astype(np.int32),
+            np.concatenate([p.report + o for p, o in zip(parts, offsets)]),
+            hosts,
+            nvts,
+            np.concatenate([p.reports for p in parts]),
+        )
+
+    @classmethod
+    def empty(cls):
+        ints = np.zeros(0, dtype=np.int32)
+        return cls(
+            np.zeros(0, dtype=np.float32), ints, ints, np.zeros(0, dtype=np.int8),
+            ints, ints, np.zeros(0, dtype=str), np.zeros(0, dtype=str),
+            np.zeros((0, 2), dtype=str)
+        )
+
+    def save(self, path):
+        np.savez_compressed(
+            path,
+            severity=self.severity, host=self.host, port=self.port,
+            proto=self.proto, nvt=self.nvt, report=self.report,
+            hosts=self.hosts, nvts=self.nvts, reports=self.reports
+        )
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(
+                data['severity'], data['host'], data['port'], data['proto'],
+                data['nvt'], data['report'], data['hosts'], data['nvts'],
+                data['reports']
+            )
+
+    def select(self, mask):
+        return FindingColumns(
+            self.severity[mask], self.host[mask], self.port[mask],
+            self.proto[mask], self.nvt[mask], self.report[mask],
+            self.hosts, self.nvts, self.reports
+        )
+
+
+def severity_distribution(columns):
+    counts = np.bincount(
+        severity_codes(columns.severity), minlength=len(SEVERITY_LEVELS)
+    )
+    return {
+        level: int(counts[code])
+        for code, level in reversed(list(enumerate(SEVERITY_LEVELS)))
+    }
+
+
+def severity_trend(columns):
+    # One distribution per report, in the order the reports were loaded
+    levels = len(SEVERITY_LEVELS)
+    counts = np.bincount(
+        columns.report * levels + severity_codes(columns.severity),
+        minlength=len(columns.reports) * levels
+    ).reshape(-1, levels)
+    return [
+        {
+            'report_id': str(report_id),
+            'timestamp': str(timestamp),
+            'severity_distribution': {
+                level: int(row[code])
+                for code, level in reversed(list(enumerate(SEVERITY_LEVELS)))
+            },
+        }
+        for (report_id, timestamp), row in zip(columns.reports, counts)
+    ]
+
+
+def top_hosts(columns, n=10, min_severity=None):
+    if min_severity is not None:
+        columns = columns.select(columns.severity >= min_severity)
+    counts = np.bincount(columns.host, minlength=len(columns.hosts))
+    worst = np.full(len(columns.hosts), -1.0, dtype=np.float32)
+    np.maximum.at(worst, columns.host, columns.severity)
+
+    # Most findings first, ties broken by the worst severity seen
+    order = np.lexsort((-worst, -counts))[:n]
+    return [
+        {
+            'host': str(columns.hosts[i]),
+            'findings': int(counts[i]),
+            'max_severity': float(worst[i]),
+        }
+        for i in order if counts[i]
+    ]
+
+
+def port_histogram(columns, min_severity=None):
+    if min_severity is not None:
+        columns = columns.select(columns.severity >= min_severity)
+    keyed = columns.port.astype(np.int64) * len(PROTOCOLS) + columns.proto
+    keys, counts = np.unique(keyed, return_counts=True)
+    order = np.argsort(-counts, kind='stable')
+    histogram = {}
+    for key, count in zip(keys[order], counts[order]):
+        port, proto = divmod(int(key), len(PROTOCOLS))
+        label = f'{port}/{PROTOCOLS[proto]}' if port >= 0 else 'general'
+        histogram[label] = histogram.get(label, 0) + int(count)
+    return histogram
+
+
+class ColumnarStore:
+    def __init__(self, directory=COLUMNAR_DIR):
+        self.directory = directory
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.log = ScanLogger('columnar-store')
+
+    def path_for(self, report_ids):
+        # Merged batches carry many report ids; those go inside the file and
+        # the name is a short digest of them
+        if len(report_ids) == 1:
+            name = report_ids[0]
+        else:
+            name = hashlib.blake2b(
+                ','.join(sorted(report_ids)).encode(), digest_size=16
+            ).hexdigest()
+        return self.directory / f'findings_{name}.npz'
+
+    def add(self, results, findings=None):
+        if findings is None:
+            findings = iter_vulnerabilities(results)
+        try:
+            report_ids = results.get('report_ids') or [results['report_id']]
+            timestamp = results.get('timestamp') or datetime.now().isoformat()
+            columns = FindingColumns.from_records(
+                findings, ','.join(report_ids), timestamp
+            )
+            path = self.path_for(report_ids)
+            columns.save(path)
+            self.log.info(f'Stored {len(columns)} findings in {path}')
+            return path
+        except Exception as e:
+            self.log.error(f'Columnar store failed: {str(e)}')
+            return None
+
+    def reports(self, since=None):
+        # Ordered and filtered by the scan timestamp stored in each file;
+        # only the small reports array is decompressed
+        dated = []
+        for path in self.directory.glob('findings_*.npz'):
+            try:
+                with np.load(path) as data:
+                    stamp = str(data['reports'][0][1])
+                timestamp = datetime.fromisoformat(stamp)
+            except Exception as e:
+                self.log.warning(f'Skipping unreadable {path}: {str(e)}')
+                continue
+            if since is None or timestamp >= since:
+                dated.append((timestamp, path))
+        return [path for _, path in sorted(dated)]
+
+    def load(self, paths=None, since=None):
+        if paths is None:
+            paths = self.reports(since)
+        return FindingColumns.concat(FindingColumns.load(p) for p in paths)
@@ -0,0 +1,133 @@
+from report_reader import severity_level, empty_distribution
+
+
+class Finding:
+    __slots__ = (
+        'id', 'host', 'port', 'severity', 'nvt', 'created', 'description'
+    )
+
+    def __init__(self, id, host, port, severity, nvt, created=None,
+                 description=None):
+        self.id = id
+        self.host = host
+        self.port = port
+        self.severity = severity
+        self.nvt = nvt
+        self.created = created
+        self.description = description
+
+    def to_row(self):
+        return [
+            self.id, self.host, self.port, self.severity, self.nvt,
+            self.created, self.description
+        ]
+
+
+class NvtTable:
+    def __init__(self):
+        self.index = {}
+        self.entries = []
+
+    def add(self, oid, name, cves):
+        idx = self.index.get(oid)
+        if idx is None:
+            idx = len(self.entries)
+            self.index[oid] = idx
+            self.entries.append((oid, name, tuple(cves)))
+        return idx
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class TextTable:
+    # Result descriptions repeat across hosts; each distinct text is kept once
+    def __init__(self):
+        self.index = {}
+        self.entries = []
+
+    def add(self, text):
+        idx = self.index.get(text)
+        if idx is None:
+            idx = len(self.entries)
+            self.index[text] = idx
+            self.entries.append(text)
+        return idx
+
+
+class CompactResults:
+    def __init__(self):
+        self.nvts = NvtTable()
+        self.descriptions = TextTable()
+        self.findings = []
+
+    def add(self, record):
+        oid = record.get('nvt_oid') or record['name']
+        nvt = self.nvts.add(oid, record['name'], record.get('cves', ()))
+        self.findings.append(Finding(
+            record.get('id'),
+            record['host'],
+            record['port'],
+            record['severity'],
+            nvt,
+            record.get('created'),
+            self.descriptions.add(record['description'])
+        ))
+
+    def extend(self, records):
+        for record in records:
+            self.add(record)
+        return self
+
+    def __len__(self):
+        return len(self.findings)
+
+    def severity_distribution(self):
+        counts = empty_distribution()
+        for finding in self.findings:
+            counts[severity_level(finding.severity)] += 1
+        return counts
+
+    def expand(self):
+        for finding in self.findings:
+            oid, name, cves = self.nvts.entries[finding.nvt]
+            yield {
+                'id': finding.id,
+                'name': name,
+                'severity': finding.severity,
+                'severity_level': severity_level(finding.severity),
+                'host': finding.host,
+                'port': finding.port,
+                'nvt_oid': oid,
+                'cves': list(cves),
+                'created': finding.created,
+                'description': self.descriptions.entries[finding.description],
+            }
+
+    def to_dict(self):
+        return {
+            'nvts': [
+                {'oid': oid, 'name': name, 'cves': list(cves)}
+                for oid, name, cves in self.nvts.entries
+            ],
+            'descriptions': self.descriptions.entries,
+            'findings': [finding.to_row() for finding in self.findings],
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        compact = cls()
+        for nvt in data['nvts']:
+            compact.nvts.add(nvt['oid'], nvt['name'], nvt['cves'])
+        for text in data['descriptions']:
+            compact.descriptions.add(text)
+        compact.findings = [Finding(*row) for row in data['findings']]
+        return compact
+
+
+def iter_vulnerabilities(results):
+    # Flat records from either a classic or a compact get_results() dict
+    if 'compact' in results:
+        yield from CompactResults.from_dict(results['compact']).expand()
+    else:
+        yield from results['vulnerabilities']
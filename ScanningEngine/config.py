@@ -1,3 +1,4 @@
+import os
 from pathlib import Path
 
 OPENVAS_HOST = '127.0.0.1'
@@ -5,12 +6,76 @@ OPENVAS_PORT = 9390
 OPENVAS_USERNAME = 'admin'
 OPENVAS_PASSWORD = 'Admin@1234'
 SCAN_STATUS_CHECK_INTERVAL = 15
+TASK_POLL_MIN_INTERVAL = 2
+TASK_POLL_MAX_INTERVAL = 60
+# Tracked tasks fail after this many get_tasks errors in a row
+TASK_POLL_MAX_FAILURES = 5
+OPENVAS_HARVEST_INTERVAL = 60
+GMP_POOL_SIZE = 4
+GMP_HEALTHCHECK_INTERVAL = 30
+GMP_CATALOG_TTL = 24 * 60 * 60
+# Hash-keyed target and port list IDs; an expired entry costs one
+# name-filtered lookup, which also notices objects deleted in gvmd
+GMP_TARGET_INDEX_TTL = 24 * 60 * 60
+OPENVAS_BATCH_SIZE = 64
+OPENVAS_REPORT_PAGE_SIZE = 500
+OPENVAS_MIN_QOD = 70
+OPENVAS_COMPACT_RESULTS = False
+# Restrict OpenVAS targets to the ports Nmap found open
+OPENVAS_NMAP_PORT_LIST = True
+OPENVAS_MAX_CONCURRENT_TASKS = 4
+# Pipelined runs: hosts are batched for OpenVAS by count or after the window
+PIPELINE_BATCH_WINDOW = 30
+PIPELINE_QUEUE_SIZE = 4096
+PIPELINE_NMAP_HOSTGROUP = 16
+DAEMON_NMAP_WORKERS = 2
+DAEMON_OPENVAS_WORKERS = OPENVAS_MAX_CONCURRENT_TASKS
+DAEMON_POLL_INTERVAL = 5
+DIST_HOST = '127.0.0.1'
+DIST_PORT = 8765
+DIST_TOKEN = os.environ.get('SCAN_DIST_TOKEN')
+DIST_SHARD_SIZE = 256
+DIST_LEASE_TTL = 120
+DIST_HEARTBEAT_INTERVAL = 30
+DIST_MAX_ATTEMPTS = 3
+DIST_REPORT_ATTEMPTS = 5
 NMAP_PROFILE = '-sV -sC'
+# SYN scans need raw sockets; unprivileged runs fall back to connect scans
+NMAP_DISCOVERY_PROFILE = (
+    '-sS -T4' if getattr(os, 'geteuid', lambda: -1)() == 0 else '-sT -T4'
+)
+# The only nmap arguments remote clients of the coordinator can pick
+DIST_NMAP_PROFILES = {
+    'default': NMAP_PROFILE,
+    'quick': '-sV -T4 -F',
+    'full': '-sV -sC -p-',
+}
+NMAP_SHARD_WORKERS = os.cpu_count() or 4
+NMAP_CACHE_TTL = 24 * 60 * 60
+# Grace period for nmap to exit after its XML output breaks off
+NMAP_EXIT_TIMEOUT = 10
+DNS_CACHE_TTL = 5 * 60
+DNS_WORKERS = 16
+# Loggers enqueue records and a listener thread writes them
+LOG_ASYNC = True
+LOG_JSON = False
+LOG_MAX_BYTES = 10 * 1024 * 1024
+LOG_BACKUP_COUNT = 5
+LOG_PROGRESS_INTERVAL = 60
+NMAP_TUNING_SAMPLE = 8
+NMAP_TUNING_PROBES = 3
+NMAP_TUNING_TIMEOUT = 1.5
 
 BASE_DIR = Path(__file__).parent
 RESULTS_DIR = BASE_DIR / 'scan_results'
 LOGS_DIR = BASE_DIR / 'logs'
+CACHE_DIR = BASE_DIR / 'cache'
+COLUMNAR_DIR = RESULTS_DIR / 'columnar'
+RESULTS_DB = RESULTS_DIR / 'results.db'
+JOB_QUEUE_DB = BASE_DIR / 'jobs.db'
+# 'json', or 'ndjson' / 'ndjson.gz' for streamed one-record-per-line files
+RESULTS_FORMAT = 'json'
 
-for d in (RESULTS_DIR, LOGS_DIR):
+for d in (RESULTS_DIR, LOGS_DIR, CACHE_DIR):
     d.mkdir(exist_ok=True)
 
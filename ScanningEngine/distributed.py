@@ -0,0 +1,659 @@
+import argparse
+import hmac
+import ipaddress
+import itertools
+import json
+import socket
+import threading
+import time
+import uuid
+import urllib.error
+import urllib.request
+from collections import deque
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from config import (
+    DIST_HOST,
+    DIST_PORT,
+    DIST_TOKEN,
+    DIST_SHARD_SIZE,
+    DIST_LEASE_TTL,
+    DIST_HEARTBEAT_INTERVAL,
+    DIST_MAX_ATTEMPTS,
+    DIST_REPORT_ATTEMPTS,
+    DIST_NMAP_PROFILES,
+    RESULTS_DIR,
+    RESULTS_FORMAT,
+)
+from logger import ScanLogger
+from ndjson_io import is_ndjson, write_results
+from nmap_scanner import run_nmap
+from openvas_batch import OpenVASBatchRunner
+from openvas_scanner import OpenVASScanner, merge_results
+from results_store import results_store
+from targets import TargetSet, nmap_family
+
+
+def valid_results(kind, results):
+    if not isinstance(results, dict):
+        return False
+    if kind == 'openvas':
+        return (
+            isinstance(results.get('severity_distribution'), dict)
+            and ('task_ids' in results or 'task_id' in results)
+        )
+    return isinstance(results.get('hosts'), dict)
+
+
+class Shard:
+    def __init__(self, job_id, index, hosts, size):
+        self.job_id = job_id
+        self.index = index
+        self.hosts = hosts
+        self.size = size
+        self.state = 'pending'
+        self.attempts = 0
+        self.lease_id = None
+        self.worker = None
+        self.deadline = 0.0
+        self.result = None
+        self.error = None
+
+
+class DistributedJob:
+    def __init__(self, job_id, target, kind, profile, shards):
+        self.id = job_id
+        self.target = target
+        self.kind = kind
+        self.profile = profile
+        self.shards = shards
+        self.created = datetime.now().isoformat()
+        self.results = None
+        self.saved_to = None
+        self.error = None
+        self.finishing = False
+
+    def finished(self):
+        return all(s.state in ('done', 'failed') for s in self.shards)
+
+    def summary(self):
+        counts = {}
+        for shard in self.shards:
+            counts[shard.state] = counts.get(shard.state, 0) + 1
+        return {
+            'id': self.id,
+            'target': self.target,
+            'kind': self.kind,
+            'created': self.created,
+            'shards': counts,
+            # Only once the merged results are in place
+            'finished': self.results is not None,
+            'saved_to': self.saved_to,
+            'error': self.error,
+        }
+
+
+class Coordinator:
+    def __init__(self, lease_ttl=DIST_LEASE_TTL, max_attempts=DIST_MAX_ATTEMPTS,
+                 save=True):
+        self.lease_ttl = lease_ttl
+        self.max_attempts = max_attempts
+        self.save = save
+        self.log = ScanLogger('coordinator', 'coordinator.log')
+        self.jobs = {}
+        self._job_ids = itertools.count(1)
+        self._pending = deque()
+        self._leases = {}
+        self._to_finish = []
+        self._lock = threading.Lock()
+
+    def submit(self, target, kind='nmap', profile='default',
+               shard_size=DIST_SHARD_SIZE):
+        # Clients name a profile; raw nmap arguments never cross the wire
+        if kind not in ('nmap', 'openvas'):
+            raise ValueError(f'Unknown kind {kind}')
+        if profile not in DIST_NMAP_PROFILES:
+            raise ValueError(f'Unknown profile {profile}')
+        if not isinstance(shard_size, int) or shard_size < 1:
+            raise ValueError(f'Bad shard size {shard_size}')
+        targets = TargetSet(target)
+        if not targets:
+            raise ValueError(f'No hosts in {target}')
+        with self._lock:
+            job_id = next(self._job_ids)
+            shards = [
+                Shard(job_id, index, piece.networks(), piece.size)
+                for index, piece in enumerate(targets.split(shard_size))
+            ]
+            self.jobs[job_id] = DistributedJob(
+                job_id, target, kind, profile, shards
+            )
+            self._pending.extend(shards)
+        self.log.info(
+            f'Job {job_id}: {kind} on {target}, {targets.size} hosts '
+            f'in {len(shards)} shards'
+        )
+        return job_id
+
+    def _expire(self, now):
+        for lease_id, shard in list(self._leases.items()):
+            if shard.deadline < now:
+                del self._leases[lease_id]
+                self.log.warning(
+                    f'Lease on job {shard.job_id} shard {shard.index} held by '
+                    f'{shard.worker} expired, requeueing'
+                )
+                self._retry(shard, 'lease expired')
+
+    def _retry(self, shard, error):
+        shard.lease_id = None
+        shard.error = error
+        if shard.attempts >= self.max_attempts:
+            shard.state = 'failed'
+            self._maybe_finish(self.jobs[shard.job_id])
+        else:
+            # Back to the front: it has already waited its turn once
+            shard.state = 'pending'
+            self._pending.appendleft(shard)
+
+    def lease(self, worker):
+        try:
+            with self._lock:
+                self._expire(time.time())
+                while self._pending:
+                    shard = self._pending.popleft()
+                    if shard.state != 'pending':
+                        continue
+                    job = self.jobs[shard.job_id]
+                    shard.state = 'leased'
+                    shard.attempts += 1
+                    shard.worker = worker
+                    shard.lease_id = uuid.uuid4().hex
+                    shard.deadline = time.time() + self.lease_ttl
+                    self._leases[shard.lease_id] = shard
+                    return {
+                        'lease_id': shard.lease_id,
+                        'job_id': job.id,
+                        'shard': shard.index,
+                        'kind': job.kind,
+                        'profile': job.profile,
+                        'hosts': shard.hosts,
+                        'size': shard.size,
+                        'lease_ttl': self.lease_ttl,
+                    }
+            return None
+        finally:
+            self._finish_jobs()
+
+    def heartbeat(self, lease_id):
+        try:
+            with self._lock:
+                self._expire(time.time())
+                shard = self._leases.get(lease_id)
+                if shard is None:
+                    return False
+                shard.deadline = time.time() + self.lease_ttl
+                return True
+        finally:
+            self._finish_jobs()
+
+    def complete(self, lease_id, results):
+        try:
+            with self._lock:
+                shard = self._leases.pop(lease_id, None)
+                if shard is None:
+                    return False
+                job = self.jobs[shard.job_id]
+                if not valid_results(job.kind, results):
+                    # A malformed payload counts as a failed attempt; merging
+                    # it later would break the whole job
+                    self.log.error(
+                        f'Job {job.id} shard {shard.index} returned invalid '
+                        f'results from {shard.worker}'
+                    )
+                    self._retry(shard, 'invalid results')
+                    raise ValueError('invalid results')
+                shard.state = 'done'
+                shard.lease_id = None
+                shard.result = results
+                self.log.info(
+                    f'Job {job.id} shard {shard.index} done by {shard.worker}'
+                )
+                self._maybe_finish(job)
+                return True
+        finally:
+            self._finish_jobs()
+
+    def fail(self, lease_id, error):
+        try:
+            with self._lock:
+                shard = self._leases.pop(lease_id, None)
+                if shard is None:
+                    return False
+                self.log.error(
+                    f'Job {shard.job_id} shard {shard.index} failed on '
+                    f'{shard.worker}: {error}'
+                )
+                self._retry(shard, error)
+                return True
+        finally:
+            self._finish_jobs()
+
+    def _maybe_finish(self, job):
+        # Runs under the lock, so it only queues the job; the merge and the
+        # file writes happen in _finish_jobs once the lock is released
+        if job.finishing or not job.finished():
+            return
+        job.finishing = True
+        self._to_finish.append(job)
+
+    def _finish_jobs(self):
+        with self._lock:
+            jobs, self._to_finish = self._to_finish, []
+            # Shards of a finished job never change again; the snapshot
+            # keeps the merge independent of the job's later state
+            snapshots = [(job, self._snapshot(job)) for job in jobs]
+        for job, (done, failed) in snapshots:
+            self._finish(job, done, failed)
+
+    def _snapshot(self, job):
+        done = [s.result for s in job.shards if s.state == 'done']
+        failed = [
+            {'shard': s.index, 'hosts': s.hosts, 'error': s.error}
+            for s in job.shards if s.state == 'failed'
+        ]
+        return done, failed
+
+    def _finish(self, job, done, failed):
+        try:
+            results = self.merge(job, done, failed)
+            saved_to = str(self._save(job, results)) if self.save else None
+        except Exception as e:
+            with self._lock:
+                job.error = str(e)
+                job.results = {}
+            self.log.error(f'Job {job.id} merge failed: {str(e)}')
+            return
+        with self._lock:
+            job.results = results
+            job.saved_to = saved_to
+            counts = job.summary()['shards']
+        self.log.info(f'Job {job.id} finished: {counts}')
+
+    def merge(self, job, done, failed):
+        if job.kind == 'openvas':
+            results = merge_results(done)
+            results['failed_batches'] = failed
+            return results
+
+        results = {
+            'timestamp': datetime.now().isoformat(),
+            'target': job.target,
+            'command': f'nmap {DIST_NMAP_PROFILES[job.profile]} <shard>',
+            'hosts': {},
+            'failed_shards': failed,
+        }
+        for result in done:
+            results['hosts'].update(result['hosts'])
+        return results
+
+    def _save(self, job, results):
+        stamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        filepath = RESULTS_DIR / f'{job.kind}_{stamp}_dist{job.id}.{RESULTS_FORMAT}'
+        if is_ndjson(filepath):
+            write_results(filepath, job.kind, results)
+        else:
+            with open(filepath, 'w') as f:
+                json.dump(results, f, indent=2)
+        if job.kind == 'nmap':
+            results_store().save_nmap(results, filepath)
+        else:
+            results_store().save_openvas(results, filepath)
+        return filepath
+
+    def summaries(self):
+        with self._lock:
+            return [job.summary() for job in self.jobs.values()]
+
+    def status(self, job_id, include_results=False):
+        with self._lock:
+            self._expire(time.time())
+            job = self.jobs.get(job_id)
+            status = job.summary() if job is not None else None
+            if status and include_results and job.results is not None:
+                status['results'] = job.results
+        self._finish_jobs()
+        return status
+
+
+def make_handler(coordinator, token=DIST_TOKEN):
+    class Handler(BaseHTTPRequestHandler):
+        def _reply(self, code, body=None):
+            data = json.dumps(body).encode() if body is not None else b''
+            self.send_response(code)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _authorized(self):
+            sent = self.headers.get('X-Scan-Token', '').encode()
+            if token and not hmac.compare_digest(sent, token.encode()):
+                self._reply(403, {'error': 'bad token'})
+                return False
+            return True
+
+        def do_GET(self):
+            if not self._authorized():
+                return
+            parts = self.path.strip('/').split('/')
+            if len(parts) == 2 and parts[0] == 'jobs' and parts[1].isdigit():
+                status = coordinator.status(int(parts[1]), include_results=True)
+                self._reply(200 if status else 404, status or {'error': 'no job'})
+            elif self.path == '/jobs':
+                self._reply(200, coordinator.summaries())
+            else:
+                self._reply(404, {'error': 'not found'})
+
+        def do_POST(self):
+            if not self._authorized():
+                return
+            length = int(self.headers.get('Content-Length') or 0)
+            try:
+                body = json.loads(self.rfile.read(length) or b'{}')
+            except ValueError:
+                self._reply(400, {'error': 'invalid JSON'})
+                return
+
+            if self.path == '/jobs':
+                try:
+                    job_id = coordinator.submit(
+                        body['target'], body.get('kind', 'nmap'),
+                        body.get('profile', 'default'),
+                        body.get('shard_size', DIST_SHARD_SIZE)
+                    )
+                except (KeyError, ValueError) as e:
+                    self._reply(400, {'error': str(e)})
+                    return
+                self._reply(201, {'job_id': job_id})
+            elif self.path == '/lease':
+                shard = coordinator.lease(body.get('worker', 'unknown'))
+                self._reply(200 if shard else 204, shard)
+            elif self.path == '/heartbeat':
+                ok = coordinator.heartbeat(body.get('lease_id'))
+                self._reply(200 if ok else 410, {'ok': ok})
+            elif self.path == '/complete':
+                try:
+                    ok = coordinator.complete(
+                        body.get('lease_id'), body.get('results')
+                    )
+                except ValueError as e:
+                    self._reply(400, {'error': str(e)})
+                    return
+                self._reply(200 if ok else 410, {'ok': ok})
+            elif self.path == '/fail':
+                ok = coordinator.fail(body.get('lease_id'), body.get('error'))
+                self._reply(200 if ok else 410, {'ok': ok})
+            else:
+                self._reply(404, {'error': 'not found'})
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def is_loopback(host):
+    if host == 'localhost':
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+def serve(host=DIST_HOST, port=DIST_PORT, coordinator=None, token=DIST_TOKEN):
+    # Anyone who can reach the coordinator can queue scans
+    if not token and not is_loopback(host):
+        raise ValueError(
+            f'Refusing to listen on {host} without SCAN_DIST_TOKEN set'
+        )
+    coordinator = coordinator or Coordinator()
+    server = ThreadingHTTPServer(
+        (host, port), make_handler(coordinator, token)
+    )
+    bound_host, bound_port = server.server_address[:2]
+    coordinator.log.info(f'Coordinator listening on {bound_host}:{bound_port}')
+    return server, coordinator
+
+
+class CoordinatorClient:
+    def __init__(self, url, token=DIST_TOKEN, timeout=30):
+        self.url = url.rstrip('/')
+        self.token = token
+        self.timeout = timeout
+
+    def request(self, method, path, body=None):
+        data = json.dumps(body).encode() if body is not None else None
+        request = urllib.request.Request(
+            self.url + path, data=data, method=method,
+            headers={'Content-Type': 'application/json'}
+        )
+        if self.token:
+            request.add_header('X-Scan-Token', self.token)
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as resp:
+                payload = resp.read()
+                return resp.status, json.loads(payload) if payload else None
+        except urllib.error.HTTPError as e:
+            payload = e.read()
+            return e.code, json.loads(payload) if payload else None
+
+    def submit(self, target, kind='nmap', profile='default',
+               shard_size=DIST_SHARD_SIZE):
+        status, body = self.request('POST', '/jobs', {
+            'target': target, 'kind': kind,
+            'profile': profile, 'shard_size': shard_size,
+        })
+        if status != 201:
+            raise RuntimeError(body.get('error') if body else f'HTTP {status}')
+        return body['job_id']
+
+    def status(self, job_id):
+        status, body = self.request('GET', f'/jobs/{job_id}')
+        return body if status == 200 else None
+
+
+class Worker:
+    def __init__(self, url, name=None, token=DIST_TOKEN,
+                 heartbeat_interval=DIST_HEARTBEAT_INTERVAL, idle_wait=5):
+        self.client = CoordinatorClient(url, token)
+        self.name = name or f'{socket.gethostname()}-{uuid.uuid4().hex[:6]}'
+        self.heartbeat_interval = heartbeat_interval
+        self.idle_wait = idle_wait
+        self.log = ScanLogger('worker')
+        self._stop = threading.Event()
+        self._openvas = None
+
+    def stop(self):
+        self._stop.set()
+
+    def run(self, once=False):
+        self.log.info(f'Worker {self.name} polling {self.client.url}')
+        while not self._stop.is_set():
+            try:
+                status, shard = self.client.request(
+                    'POST', '/lease', {'worker': self.name}
+                )
+            except OSError as e:
+                self.log.error(f'Coordinator unreachable: {str(e)}')
+                self._stop.wait(self.idle_wait)
+                continue
+
+            if status != 200 or not shard:
+                if once:
+                    return
+                self._stop.wait(self.idle_wait)
+                continue
+            self.process(shard)
+
+    def process(self, shard):
+        lease_id = shard['lease_id']
+        label = f'job {shard["job_id"]} shard {shard["shard"]}'
+        self.log.info(f'Leased {label}: {shard["size"]} hosts')
+
+        lost = threading.Event()
+        finished = threading.Event()
+        beat = threading.Thread(
+            target=self._heartbeat, args=(lease_id, lost, finished),
+            daemon=True
+        )
+        beat.start()
+        try:
+            results = self.scan(shard)
+        except Exception as e:
+            finished.set()
+            self.log.error(f'{label} failed: {str(e)}')
+            self._report(
+                '/fail', {'lease_id': lease_id, 'error': str(e)}, label
+            )
+            return
+        finished.set()
+
+        if lost.is_set():
+            self.log.warning(f'Lease on {label} was lost; result dropped')
+            return
+        status = self._report(
+            '/complete', {'lease_id': lease_id, 'results': results}, label
+        )
+        if status is None:
+            return
+        if status == 200:
+            self.log.info(f'Returned {label}')
+        else:
+            self.log.warning(f'Coordinator rejected {label} (HTTP {status})')
+
+    def _report(self, path, body, label, attempts=DIST_REPORT_ATTEMPTS):
+        # A coordinator restart or timeout must not take the worker down;
+        # if no report lands the lease expires and the shard is requeued
+        for attempt in range(1, attempts + 1):
+            try:
+                status, _ = self.client.request('POST', path, body)
+                return status
+            except OSError as e:
+                self.log.error(
+                    f'Reporting {label} to {path} failed '
+                    f'(attempt {attempt}/{attempts}): {str(e)}'
+                )
+            if self._stop.wait(self.idle_wait):
+                break
+        return None
+
+    def _heartbeat(self, lease_id, lost, finished):
+        while not finished.wait(self.heartbeat_interval):
+            try:
+                status, _ = self.client.request(
+                    'POST', '/heartbeat', {'lease_id': lease_id}
+                )
+            except OSError as e:
+                self.log.error(f'Heartbeat failed: {str(e)}')
+                continue
+            if status == 410:
+                lost.set()
+                return
+
+    def scan(self, shard):
+        if shard['kind'] == 'openvas':
+            return self.scan_openvas(shard)
+        # The worker maps the profile name with its own config
+        arguments = DIST_NMAP_PROFILES.get(shard['profile'])
+        if arguments is None:
+            raise ValueError(f'Unknown profile {shard["profile"]}')
+        return {'hosts': dict(run_nmap(
+            shard['hosts'], nmap_family(arguments, shard['hosts'])
+        ))}
+
+    def scan_openvas(self, shard):
+        if self._openvas is None:
+            self._openvas = OpenVASScanner()
+        openvas = self._openvas
+        if not openvas.connect():
+            raise RuntimeError('OpenVAS connection failed')
+        try:
+            results = OpenVASBatchRunner(openvas).run(
+                shard['hosts'], f'dist{shard["job_id"]}_s{shard["shard"]}'
+            )
+        finally:
+            openvas.disconnect()
+        if not results:
+            raise RuntimeError('OpenVAS scan failed')
+        return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Distributed scan shards')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    coordinator = commands.add_parser('coordinator')
+    coordinator.add_argument('--host', default=DIST_HOST)
+    coordinator.add_argument('--port', type=int, default=DIST_PORT)
+    coordinator.add_argument('--lease-ttl', type=int, default=DIST_LEASE_TTL)
+
+    url = f'http://{DIST_HOST}:{DIST_PORT}'
+    worker = commands.add_parser('worker')
+    worker.add_argument('--coordinator', default=url)
+    worker.add_argument('--name')
+
+    submit = commands.add_parser('submit')
+    submit.add_argument('target')
+    submit.add_argument('--kind', choices=('nmap', 'openvas'), default='nmap')
+    submit.add_argument(
+        '--profile', choices=sorted(DIST_NMAP_PROFILES), default='default'
+    )
+    submit.add_argument('--shard-size', type=int, default=DIST_SHARD_SIZE)
+    submit.add_argument('--coordinator', default=url)
+
+    status = commands.add_parser('status')
+    status.add_argument('job_id', type=int)
+    status.add_argument('--coordinator', default=url)
+
+    args = parser.parse_args()
+
+    if args.command == 'coordinator':
+        try:
+            server, _ = serve(
+                args.host, args.port, Coordinator(lease_ttl=args.lease_ttl)
+            )
+        except ValueError as e:
+            parser.error(str(e))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+
+    elif args.command == 'worker':
+        try:
+            Worker(args.coordinator, args.name).run()
+        except KeyboardInterrupt:
+            pass
+
+    elif args.command == 'submit':
+        job_id = CoordinatorClient(args.coordinator).submit(
+            args.target, args.kind, args.profile, args.shard_size
+        )
+        print(f'Submitted job {job_id}')
+
+    elif args.command == 'status':
+        job = CoordinatorClient(args.coordinator).status(args.job_id)
+        if job is None:
+            print(f'Job {args.job_id} not found')
+            return
+        job.pop('results', None)
+        print(json.dumps(job, indent=2))
+
+
+if __name__ == '__main__':
+    main()
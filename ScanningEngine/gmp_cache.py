@@ -0,0 +1,67 @@
+import json
+import os
+import threading
+import time
+
+from gvm.errors import GvmResponseError
+
+from config import CACHE_DIR, GMP_CATALOG_TTL
+
+
+def is_not_found(error):
+    if isinstance(error, GvmResponseError):
+        return str(error.status) == '404' or 'failed to find' in str(error).lower()
+    return False
+
+
+class CatalogCache:
+    def __init__(self, path, ttl=GMP_CATALOG_TTL):
+        self.path = path
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        try:
+            with open(path) as f:
+                self._entries = json.load(f)
+        except (OSError, ValueError):
+            self._entries = {}
+
+    def get(self, key, loader):
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry and time.time() - entry['fetched'] < self.ttl:
+            return entry['value']
+
+        value = loader()
+        if value is not None:
+            with self._lock:
+                self._entries[key] = {'value': value, 'fetched': time.time()}
+                self._save()
+        return value
+
+    def invalidate(self, prefix='', value=None):
+        with self._lock:
+            for key in [
+                k for k, entry in self._entries.items()
+                if k.startswith(prefix)
+                and (value is None or entry['value'] == value)
+            ]:
+                del self._entries[key]
+            self._save()
+
+    def _save(self):
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self._entries, f, indent=2)
+        os.replace(tmp_path, self.path)
+
+
+_catalog = None
+_catalog_lock = threading.Lock()
+
+
+def catalog_cache():
+    global _catalog
+    with _catalog_lock:
+        if _catalog is None:
+            _catalog = CatalogCache(CACHE_DIR / 'gmp_catalog.json')
+        return _catalog
@@ -0,0 +1,135 @@
+import queue
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+
+from gvm.errors import GvmError
+from gvm.protocols.gmp import Gmp
+from lxml import etree
+
+from config import GMP_POOL_SIZE, GMP_HEALTHCHECK_INTERVAL
+from logger import ScanLogger
+
+
+def as_tree(response):
+    # Sessions without a transform get python-gvm's default, which
+    # returns the raw XML as a string
+    if isinstance(response, (str, bytes)):
+        return etree.fromstring(
+            response.encode() if isinstance(response, str) else response
+        )
+    return response
+
+
+def connection_lost(error):
+    # Plain GvmError is what python-gvm raises for socket-level failures;
+    # its subclasses are command/response errors on a healthy connection
+    return isinstance(error, OSError) or type(error) is GvmError
+
+
+class GmpSession:
+    def __init__(self, connect, username, password, transform=None):
+        self._stack = ExitStack()
+        # python-gvm calls whatever transform it is given, None included,
+        # so only pass one when the caller asked for it
+        options = {} if transform is None else {'transform': transform}
+        try:
+            self.gmp = self._stack.enter_context(
+                Gmp(connection=connect(), **options)
+            )
+            self.gmp.authenticate(username, password)
+        except Exception:
+            self._stack.close()
+            raise
+        self.last_used = time.monotonic()
+
+    def alive(self):
+        try:
+            self.gmp.get_version()
+            return True
+        except Exception:
+            return False
+
+    def close(self):
+        try:
+            self._stack.close()
+        except Exception:
+            pass
+
+
+class GmpSessionPool:
+    def __init__(self, connect, username, password, size=GMP_POOL_SIZE,
+                 transform=None, healthcheck_interval=GMP_HEALTHCHECK_INTERVAL,
+                 name='gmp'):
+        self.name = name
+        self.connect = connect
+        self.username = username
+        self.password = password
+        self.transform = transform
+        self.healthcheck_interval = healthcheck_interval
+        self.log = ScanLogger('gmp-pool')
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+
+    def checkout(self, timeout=None):
+        if not self._slots.acquire(timeout=timeout):
+            raise TimeoutError('No GMP session available')
+
+        try:
+            while True:
+                try:
+                    session = self._idle.get_nowait()
+                except queue.Empty:
+                    return GmpSession(
+                        self.connect, self.username, self.password,
+                        self.transform
+                    )
+
+                idle = time.monotonic() - session.last_used
+                if idle < self.healthcheck_interval or session.alive():
+                    return session
+
+                self.log.warning('Dropping dead GMP session, reconnecting')
+                session.close()
+        except Exception:
+            self._slots.release()
+            raise
+
+    def checkin(self, session, broken=False):
+        if broken:
+            session.close()
+        else:
+            session.last_used = time.monotonic()
+            self._idle.put(session)
+        self._slots.release()
+
+    @contextmanager
+    def session(self, timeout=None):
+        session = self.checkout(timeout)
+        try:
+            yield session.gmp
+        except Exception as e:
+            self.checkin(session, broken=connection_lost(e))
+            raise
+        else:
+            self.checkin(session)
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(name, connect, username, password, **kwargs):
+    with _pools_lock:
+        if name not in _pools:
+            _pools[name] = GmpSessionPool(
+                connect, username, password, name=name, **kwargs
+            )
+        return _pools[name]
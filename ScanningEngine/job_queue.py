@@ -0,0 +1,205 @@
+import json
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+from config import JOB_QUEUE_DB
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY,
+    target TEXT NOT NULL,
+    stage TEXT NOT NULL,
+    status TEXT NOT NULL,
+    priority INTEGER NOT NULL DEFAULT 0,
+    options TEXT NOT NULL DEFAULT '{}',
+    result TEXT NOT NULL DEFAULT '{}',
+    error TEXT,
+    worker TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    cancel_requested INTEGER NOT NULL DEFAULT 0,
+    created REAL NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_claim ON jobs (stage, status, priority, id);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, id);
+'''
+
+FINAL_STATUSES = ('done', 'failed', 'cancelled')
+
+
+def job_record(row):
+    job = dict(row)
+    job['options'] = json.loads(job['options'])
+    job['result'] = json.loads(job['result'])
+    job['cancel_requested'] = bool(job['cancel_requested'])
+    return job
+
+
+class JobQueue:
+    def __init__(self, path=JOB_QUEUE_DB):
+        self.path = path
+        self._local = threading.local()
+        self.connection().executescript(SCHEMA)
+
+    def connection(self):
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            # Autocommit; claims take an explicit write lock below
+            db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            db.row_factory = sqlite3.Row
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            self._local.db = db
+        return db
+
+    @contextmanager
+    def transaction(self):
+        db = self.connection()
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            yield db
+        except Exception:
+            db.execute('ROLLBACK')
+            raise
+        db.execute('COMMIT')
+
+    def submit(self, target, priority=0, **options):
+        now = time.time()
+        with self.transaction() as db:
+            return db.execute(
+                'INSERT INTO jobs (target, stage, status, priority, options, '
+                "created, updated) VALUES (?, 'nmap', 'queued', ?, ?, ?, ?)",
+                (target, priority, json.dumps(options), now, now)
+            ).lastrowid
+
+    def claim(self, stage, worker):
+        # Highest priority first, then oldest; the write lock makes the
+        # select-then-update atomic across processes
+        with self.transaction() as db:
+            row = db.execute(
+                "SELECT * FROM jobs WHERE stage = ? AND status = 'queued' "
+                'ORDER BY priority DESC, id LIMIT 1',
+                (stage,)
+            ).fetchone()
+            if row is None:
+                return None
+            db.execute(
+                "UPDATE jobs SET status = 'running', worker = ?, "
+                'attempts = attempts + 1, updated = ? WHERE id = ?',
+                (worker, time.time(), row['id'])
+            )
+        job = job_record(row)
+        job['status'] = 'running'
+        job['worker'] = worker
+        return job
+
+    def _merge_result(self, db, job_id, result):
+        row = db.execute(
+            'SELECT result FROM jobs WHERE id = ?', (job_id,)
+        ).fetchone()
+        merged = json.loads(row['result']) if row else {}
+        merged.update(result)
+        return json.dumps(merged)
+
+    def update(self, job_id, **result):
+        with self.transaction() as db:
+            db.execute(
+                'UPDATE jobs SET result = ?, updated = ? WHERE id = ?',
+                (self._merge_result(db, job_id, result), time.time(), job_id)
+            )
+
+    def advance(self, job_id, stage, **result):
+        # Hand the job to the next stage's workers unless it was cancelled
+        with self.transaction() as db:
+            db.execute(
+                'UPDATE jobs SET stage = ?, worker = NULL, result = ?, '
+                "status = CASE WHEN cancel_requested THEN 'cancelled' "
+                "ELSE 'queued' END, updated = ? WHERE id = ?",
+                (stage, self._merge_result(db, job_id, result), time.time(),
+                 job_id)
+            )
+
+    def _finish(self, job_id, status, error=None, result=None):
+        with self.transaction() as db:
+            db.execute(
+                'UPDATE jobs SET status = ?, error = ?, result = ?, '
+                'updated = ? WHERE id = ?',
+                (status, error, self._merge_result(db, job_id, result or {}),
+                 time.time(), job_id)
+            )
+
+    def complete(self, job_id, **result):
+        self._finish(job_id, 'done', result=result)
+
+    def fail(self, job_id, error):
+        self._finish(job_id, 'failed', error=error)
+
+    def mark_cancelled(self, job_id):
+        self._finish(job_id, 'cancelled')
+
+    def cancel(self, job_id):
+        # Queued jobs stop at once; running ones are flagged for their worker
+        with self.transaction() as db:
+            row = db.execute(
+                'SELECT status FROM jobs WHERE id = ?', (job_id,)
+            ).fetchone()
+            if row is None or row['status'] in FINAL_STATUSES:
+                return False
+            if row['status'] == 'queued':
+                db.execute(
+                    "UPDATE jobs SET status = 'cancelled', updated = ? "
+                    'WHERE id = ?',
+                    (time.time(), job_id)
+                )
+            else:
+                db.execute(
+                    'UPDATE jobs SET cancel_requested = 1, updated = ? '
+                    'WHERE id = ?',
+                    (time.time(), job_id)
+                )
+            return True
+
+    def cancel_requested(self, job_id):
+        row = self.connection().execute(
+            'SELECT cancel_requested FROM jobs WHERE id = ?', (job_id,)
+        ).fetchone()
+        return bool(row and row['cancel_requested'])
+
+    def requeue_running(self):
+        # Jobs a crashed daemon left behind restart from their current stage
+        with self.transaction() as db:
+            return db.execute(
+                "UPDATE jobs SET status = CASE WHEN cancel_requested "
+                "THEN 'cancelled' ELSE 'queued' END, worker = NULL, "
+                "updated = ? WHERE status = 'running'",
+                (time.time(),)
+            ).rowcount
+
+    def get(self, job_id):
+        row = self.connection().execute(
+            'SELECT * FROM jobs WHERE id = ?', (job_id,)
+        ).fetchone()
+        return job_record(row) if row else None
+
+    def jobs(self, status=None, limit=50):
+        if status is None:
+            rows = self.connection().execute(
+                'SELECT * FROM jobs ORDER BY id DESC LIMIT ?', (limit,)
+            )
+        else:
+            rows = self.connection().execute(
+                'SELECT * FROM jobs WHERE status = ? ORDER BY id DESC LIMIT ?',
+                (status, limit)
+            )
+        return [job_record(row) for row in rows]
+
+    def counts(self):
+        return {
+            f'{row["stage"]}:{row["status"]}': row['count']
+            for row in self.connection().execute(
+                'SELECT stage, status, COUNT(*) AS count FROM jobs '
+                'GROUP BY stage, status'
+            )
+        }
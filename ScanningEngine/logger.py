@@ -1,34 +1,171 @@
+import atexit
+import copy
+import json
 import logging
+import queue
 import sys
-from config import LOGS_DIR
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+from config import (
+    LOGS_DIR,
+    LOG_ASYNC,
+    LOG_JSON,
+    LOG_MAX_BYTES,
+    LOG_BACKUP_COUNT,
+    LOG_PROGRESS_INTERVAL,
+)
+
+CONTEXT_FIELDS = ('scan', 'task', 'target')
+
+
+def _context(record):
+    return {
+        field: getattr(record, field)
+        for field in CONTEXT_FIELDS
+        if getattr(record, field, None) is not None
+    }
+
+
+class TextFormatter(logging.Formatter):
+    def format(self, record):
+        line = super().format(record)
+        context = _context(record)
+        if context:
+            line += ' [' + ' '.join(f'{k}={v}' for k, v in context.items()) + ']'
+        return line
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record, '%Y-%m-%dT%H:%M:%S'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            **_context(record),
+        }
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class _Dispatcher(logging.Handler):
+    # The listener thread hands each record to the handlers of the
+    # ScanLogger that produced it
+    def __init__(self):
+        super().__init__()
+        self.routes = {}
+
+    def handle(self, record):
+        for handler in self.routes.get(record.name, ()):
+            if record.levelno >= handler.level:
+                handler.handle(record)
+        return True
+
+
+_dispatcher = _Dispatcher()
+_listener = None
+_listener_lock = threading.Lock()
+_queue = queue.SimpleQueue()
+
+
+def _start_listener():
+    global _listener
+    with _listener_lock:
+        if _listener is None:
+            _listener = QueueListener(_queue, _dispatcher)
+            _listener.start()
+            atexit.register(stop_logging)
+
+
+def stop_logging():
+    # Flushes queued records; ScanLogger restarts the listener if needed
+    global _listener
+    with _listener_lock:
+        if _listener is not None:
+            _listener.stop()
+            _listener = None
 
 
 class ScanLogger:
-    def __init__(self, name, log_file=None):
+    def __init__(self, name, log_file=None, async_mode=LOG_ASYNC,
+                 json_format=LOG_JSON):
         self.logger = logging.getLogger(name)
         self.logger.setLevel(logging.INFO)
+        self.context = {}
+        self._progress = {}
+        self._progress_lock = threading.Lock()
 
         if not self.logger.handlers:
-            formatter = logging.Formatter(
+            formatter = TextFormatter(
                 '%(asctime)s [%(levelname)s] %(name)s: %(message)s',
                 '%Y-%m-%d %H:%M:%S'
             )
 
             console = logging.StreamHandler(sys.stdout)
             console.setFormatter(formatter)
-            self.logger.addHandler(console)
+            handlers = [console]
 
             if log_file:
-                file_handler = logging.FileHandler(LOGS_DIR / log_file)
-                file_handler.setFormatter(formatter)
-                self.logger.addHandler(file_handler)
+                file_handler = RotatingFileHandler(
+                    LOGS_DIR / log_file,
+                    maxBytes=LOG_MAX_BYTES,
+                    backupCount=LOG_BACKUP_COUNT,
+                    encoding='utf-8'
+                )
+                # The console stays readable; files can feed log shippers
+                file_handler.setFormatter(
+                    JsonFormatter() if json_format else formatter
+                )
+                handlers.append(file_handler)
+
+            if async_mode:
+                # Callers only enqueue; one listener thread does the I/O
+                _dispatcher.routes[name] = handlers
+                self.logger.addHandler(QueueHandler(_queue))
+                _start_listener()
+            else:
+                for handler in handlers:
+                    self.logger.addHandler(handler)
+        elif async_mode:
+            _start_listener()
+
+    def bind(self, **context):
+        bound = copy.copy(self)
+        bound.context = {**self.context, **context}
+        bound._progress = {}
+        bound._progress_lock = threading.Lock()
+        return bound
+
+    def _log(self, level, msg, context):
+        self.logger.log(level, msg, extra={**self.context, **context})
+
+    def info(self, msg, **context):
+        self._log(logging.INFO, msg, context)
 
-    def info(self, msg):
-        self.logger.info(msg)
+    def warning(self, msg, **context):
+        self._log(logging.WARNING, msg, context)
 
-    def warning(self, msg):
-        self.logger.warning(msg)
+    def error(self, msg, **context):
+        self._log(logging.ERROR, msg, context)
 
-    def error(self, msg):
-        self.logger.error(msg)
+    def progress(self, key, msg, force=False, interval=LOG_PROGRESS_INTERVAL,
+                 **context):
+        # At most one line per key and interval; skipped updates are counted
+        # into the next line that does get written
+        now = time.monotonic()
+        with self._progress_lock:
+            last, skipped = self._progress.get(key, (None, 0))
+            if not force and last is not None and now - last < interval:
+                self._progress[key] = (last, skipped + 1)
+                return
+            self._progress[key] = (now, 0)
+        if skipped:
+            msg += f' ({skipped} updates coalesced)'
+        self._log(logging.INFO, msg, context)
 
+    def forget(self, key):
+        with self._progress_lock:
+            self._progress.pop(key, None)
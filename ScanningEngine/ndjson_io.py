@@ -0,0 +1,158 @@
+import gzip
+import json
+
+from compact_results import iter_vulnerabilities
+
+FORMAT_VERSION = 1
+RESULT_SUFFIXES = ('.json', '.ndjson', '.ndjson.gz')
+
+# Keys that are streamed one line per record instead of kept in the header
+RECORD_KEYS = ('hosts', 'vulnerabilities', 'compact')
+# Only known once every record has been written
+FOOTER_KEYS = ('total_vulnerabilities', 'severity_distribution')
+
+
+class TruncatedResults(ValueError):
+    pass
+
+
+def is_ndjson(path):
+    return str(path).endswith(('.ndjson', '.ndjson.gz'))
+
+
+def is_result_file(path):
+    return str(path).endswith(RESULT_SUFFIXES)
+
+
+def open_text(path, mode='r'):
+    if str(path).endswith('.gz'):
+        return gzip.open(path, mode + 't', encoding='utf-8')
+    return open(path, mode, encoding='utf-8')
+
+
+class NdjsonWriter:
+    def __init__(self, path, kind, **meta):
+        self.path = path
+        self.count = 0
+        self._file = open_text(path, 'w')
+        self._line({
+            'type': 'header', 'kind': kind, 'version': FORMAT_VERSION, **meta
+        })
+
+    def _line(self, record):
+        self._file.write(json.dumps(record, separators=(',', ':')))
+        self._file.write('\n')
+
+    def write_host(self, ip, host_data):
+        self._line({'type': 'host', 'ip': ip, **host_data})
+        self.count += 1
+
+    def write_finding(self, record):
+        self._line({'type': 'finding', **record})
+        self.count += 1
+
+    def close(self, **summary):
+        if self._file.closed:
+            return
+        self._line({'type': 'footer', 'count': self.count, **summary})
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        # No footer on failure, so a truncated file is recognisable
+        if exc_type is None:
+            self.close()
+        else:
+            self._file.close()
+
+
+def write_results(path, kind, results):
+    meta = {
+        k: v for k, v in results.items()
+        if k not in RECORD_KEYS and k not in FOOTER_KEYS
+    }
+    summary = {k: results[k] for k in FOOTER_KEYS if k in results}
+    with NdjsonWriter(path, kind, **meta) as writer:
+        if kind == 'nmap':
+            for ip, host_data in results['hosts'].items():
+                writer.write_host(ip, host_data)
+        else:
+            for record in iter_vulnerabilities(results):
+                writer.write_finding(record)
+        writer.close(**summary)
+
+
+def iter_records(path):
+    # Raises once the records run out if the writer never got to the
+    # footer; readers pop 'type', so it is noted before each yield
+    last_type = None
+    with open_text(path) as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                last_type = record.get('type')
+                yield record
+    if last_type != 'footer':
+        raise TruncatedResults(f'{path} has no footer; the scan did not finish')
+
+
+def read_header(path):
+    # Cheap for NDJSON; a legacy JSON file has to be read whole
+    if is_ndjson(path):
+        for record in iter_records(path):
+            header = dict(record)
+            for key in ('type', 'version'):
+                header.pop(key, None)
+            return header
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def iter_hosts(path):
+    if not is_ndjson(path):
+        with open(path) as f:
+            yield from json.load(f).get('hosts', {}).items()
+        return
+    for record in iter_records(path):
+        if record.pop('type') == 'host':
+            yield record.pop('ip'), record
+
+
+def iter_findings(path):
+    if not is_ndjson(path):
+        with open(path) as f:
+            yield from iter_vulnerabilities(json.load(f))
+        return
+    for record in iter_records(path):
+        if record.pop('type') == 'finding':
+            yield record
+
+
+def load_results(path):
+    # Rebuild the classic results dict from either format
+    if not is_ndjson(path):
+        with open(path) as f:
+            return json.load(f)
+
+    results = {}
+    for record in iter_records(path):
+        record_type = record.pop('type')
+        if record_type == 'header':
+            kind = record.pop('kind', None)
+            record.pop('version', None)
+            results.update(record)
+            if kind == 'nmap':
+                results['hosts'] = {}
+            else:
+                results['vulnerabilities'] = []
+        elif record_type == 'host':
+            results['hosts'][record.pop('ip')] = record
+        elif record_type == 'finding':
+            results['vulnerabilities'].append(record)
+        elif record_type == 'footer':
+            record.pop('count', None)
+            results.update(record)
+    return results
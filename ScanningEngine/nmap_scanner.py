@@ -1,9 +1,198 @@
+import hashlib
 import json
+import shlex
+import subprocess
+import tempfile
+import time
+from concurrent.futures import (
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    as_completed,
+)
 from datetime import datetime
+from pathlib import Path
 
 import nmap
-from config import RESULTS_DIR, NMAP_PROFILE
+from lxml import etree
+from config import (
+    RESULTS_DIR,
+    NMAP_PROFILE,
+    NMAP_DISCOVERY_PROFILE,
+    NMAP_SHARD_WORKERS,
+    NMAP_CACHE_TTL,
+    NMAP_EXIT_TIMEOUT,
+    NMAP_TUNING_SAMPLE,
+)
 from logger import ScanLogger
+from ndjson_io import (
+    NdjsonWriter,
+    is_ndjson,
+    is_result_file,
+    read_header,
+    load_results,
+    write_results,
+)
+from nmap_tuning import measure_network, choose_parameters, build_arguments
+from results_store import results_store
+from targets import TargetSet, nmap_family
+
+
+def build_host_data(scan_host):
+    host_data = {
+        'hostname': scan_host.hostname(),
+        'state': scan_host.state(),
+        'services': []
+    }
+
+    for proto in scan_host.all_protocols():
+        for port in scan_host[proto].keys():
+            svc = scan_host[proto][port]
+            host_data['services'].append({
+                'port': port,
+                'protocol': proto,
+                'state': svc.get('state'),
+                'service': svc.get('name'),
+                'product': svc.get('product', ''),
+                'version': svc.get('version', '')
+            })
+
+    return host_data
+
+
+def parse_host_element(elem):
+    host = None
+    for address in elem.iterfind('address'):
+        if address.get('addrtype') == 'ipv4':
+            host = address.get('addr')
+            break
+    if host is None:
+        host = elem.find('address').get('addr')
+
+    hostnames = elem.findall('hostnames/hostname')
+    hostname = next(
+        (h.get('name') for h in hostnames if h.get('type') == 'user'),
+        hostnames[0].get('name', '') if hostnames else ''
+    )
+
+    status = elem.find('status')
+    host_data = {
+        'hostname': hostname,
+        'state': status.get('state') if status is not None else '',
+        'services': []
+    }
+
+    for port in elem.iterfind('ports/port'):
+        state = port.find('state')
+        svc = port.find('service')
+        host_data['services'].append({
+            'port': int(port.get('portid')),
+            'protocol': port.get('protocol'),
+            'state': state.get('state') if state is not None else None,
+            'service': svc.get('name', '') if svc is not None else '',
+            'product': svc.get('product', '') if svc is not None else '',
+            'version': svc.get('version', '') if svc is not None else ''
+        })
+
+    return host, host_data
+
+
+def iter_nmap_xml(source):
+    # Yields each <host> as soon as its end tag is parsed, then drops it
+    for _, elem in etree.iterparse(source, events=('end',), tag='host'):
+        yield parse_host_element(elem)
+        elem.clear()
+        while elem.getprevious() is not None:
+            del elem.getparent()[0]
+
+
+def run_nmap(targets, arguments):
+    with tempfile.TemporaryFile() as stderr:
+        proc = subprocess.Popen(
+            ['nmap', *shlex.split(arguments), '-oX', '-', *targets],
+            stdout=subprocess.PIPE,
+            stderr=stderr
+        )
+        parse_error = None
+        try:
+            yield from iter_nmap_xml(proc.stdout)
+        except etree.XMLSyntaxError as e:
+            # Usually nmap quitting before it wrote any XML; let it exit so
+            # its status and stderr explain why
+            parse_error = e
+            try:
+                proc.wait(timeout=NMAP_EXIT_TIMEOUT)
+            except subprocess.TimeoutExpired:
+                pass
+        finally:
+            if proc.poll() is None:
+                proc.kill()
+            proc.stdout.close()
+            proc.wait()
+
+        if proc.returncode != 0:
+            stderr.seek(0)
+            raise RuntimeError(
+                stderr.read().decode(errors='replace').strip()
+                or f'nmap exited {proc.returncode}'
+            )
+        if parse_error is not None:
+            raise RuntimeError(f'Unreadable nmap output: {parse_error}')
+
+
+def port_spec(services):
+    tcp = sorted({s['port'] for s in services if s['protocol'] == 'tcp'})
+    udp = sorted({s['port'] for s in services if s['protocol'] == 'udp'})
+    parts = []
+    if tcp:
+        parts.append('T:' + ','.join(map(str, tcp)))
+    if udp:
+        parts.append('U:' + ','.join(map(str, udp)))
+    return ','.join(parts)
+
+
+def open_services(results, hosts=None):
+    selected = results['hosts'] if hosts is None else {
+        ip: results['hosts'][ip] for ip in hosts if ip in results['hosts']
+    }
+    return [
+        service
+        for host in selected.values()
+        for service in host.get('services', [])
+        if service['state'] == 'open'
+    ]
+
+
+def service_fingerprint(services):
+    ports = sorted(
+        (s['protocol'], s['port']) for s in services if s['state'] == 'open'
+    )
+    return hashlib.sha1(repr(ports).encode()).hexdigest()
+
+
+def detect_services(host, services, arguments=NMAP_PROFILE):
+    # Phase two of a phased scan: -sV -sC limited to the ports found open
+    # Discovery is a TCP scan, so only TCP ports ever reach this phase
+    args = f'{arguments} -Pn -p {port_spec(services)}'
+    return dict(run_nmap([host], args))
+
+
+def scan_shard(hosts, arguments, workdir, index):
+    # Runs in a worker process: one nmap per shard, each with its own -oX file
+    list_path = Path(workdir) / f'shard_{index}.txt'
+    xml_path = Path(workdir) / f'shard_{index}.xml'
+    list_path.write_text('\n'.join(hosts))
+
+    proc = subprocess.run(
+        ['nmap', *shlex.split(arguments),
+         '-iL', str(list_path), '-oX', str(xml_path)],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        text=True
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr.strip() or f'nmap exited {proc.returncode}')
+
+    return dict(iter_nmap_xml(str(xml_path)))
 
 
 class NmapScanner:
@@ -11,12 +200,12 @@ class NmapScanner:
         self.scanner = nmap.PortScanner()
         self.log = ScanLogger('nmap')
 
-    def scan(self, target):
+    def scan(self, target, arguments=NMAP_PROFILE):
         self.log.info(f'Starting NMAP scan on {target}')
         try:
             self.scanner.scan(
                 hosts=target,
-                arguments=NMAP_PROFILE
+                arguments=arguments
             )
 
             results = {
@@ -27,25 +216,7 @@ class NmapScanner:
             }
 
             for host in self.scanner.all_hosts():
-                host_data = {
-                    'hostname': self.scanner[host].hostname(),
-                    'state': self.scanner[host].state(),
-                    'services': []
-                }
-
-                for proto in self.scanner[host].all_protocols():
-                    for port in self.scanner[host][proto].keys():
-                        svc = self.scanner[host][proto][port]
-                        host_data['services'].append({
-                            'port': port,
-                            'protocol': proto,
-                            'state': svc.get('state'),
-                            'service': svc.get('name'),
-                            'product': svc.get('product', ''),
-                            'version': svc.get('version', '')
-                        })
-
-                results['hosts'][host] = host_data
+                results['hosts'][host] = build_host_data(self.scanner[host])
 
             self.log.info(
                 f'NMAP scan completed. Found {len(results["hosts"])} hosts'
@@ -56,10 +227,301 @@ class NmapScanner:
             self.log.error(f'NMAP scan failed: {str(e)}')
             return None
 
+    def scan_adaptive(self, target):
+        targets = TargetSet(target)
+        if not targets:
+            self.log.error(f'No hosts to scan in {target}')
+            return None
+
+        measured = measure_network(targets.sample(NMAP_TUNING_SAMPLE))
+        params = choose_parameters(measured, targets.size)
+        self.log.info(
+            f'Measured RTT p90 {measured["rtt_ms_p90"]}ms, '
+            f'loss {measured["loss"]} on {measured["sampled_hosts"]} hosts; '
+            f'using -T{params["timing_template"]} '
+            f'--min-rate {params["min_rate"]} '
+            f'--max-retries {params["max_retries"]}'
+        )
+
+        results = self.scan(target, nmap_family(
+            build_arguments(NMAP_PROFILE, params), targets.networks()
+        ))
+        if results:
+            results['tuning'] = {
+                'measured': measured,
+                'parameters': params
+            }
+        return results
+
+    def scan_stream(self, target, arguments=NMAP_PROFILE):
+        self.log.info(f'Starting streaming NMAP scan on {target}')
+        count = 0
+        try:
+            for host, host_data in run_nmap(target.split(), arguments):
+                count += 1
+                yield host, host_data
+        except RuntimeError as e:
+            # Callers must not mistake the hosts seen so far for a full scan
+            self.log.error(f'NMAP scan failed after {count} hosts: {str(e)}')
+            raise
+
+        self.log.info(f'Streaming NMAP scan completed. Found {count} hosts')
+
+    def scan_phased(self, target, workers=NMAP_SHARD_WORKERS):
+        self.log.info(f'Starting phased NMAP scan on {target}')
+        results = {
+            'timestamp': datetime.now().isoformat(),
+            'target': target,
+            'command': (
+                f'nmap {NMAP_DISCOVERY_PROFILE} {target} ; '
+                f'nmap {NMAP_PROFILE} -Pn -p <open ports> <host>'
+            ),
+            'hosts': {},
+            'phase_timings': {}
+        }
+        timings = results['phase_timings']
+        started = time.monotonic()
+
+        try:
+            discovered = dict(run_nmap(target.split(), NMAP_DISCOVERY_PROFILE))
+        except Exception as e:
+            self.log.error(f'NMAP discovery failed: {str(e)}')
+            return None
+
+        timings['discovery'] = round(time.monotonic() - started, 3)
+        pending = {}
+        for host, host_data in discovered.items():
+            open_services = [
+                s for s in host_data['services'] if s['state'] == 'open'
+            ]
+            if host_data['state'] == 'up' and open_services:
+                pending[host] = open_services
+            else:
+                results['hosts'][host] = host_data
+
+        self.log.info(
+            f'Discovery found {len(discovered)} hosts, {len(pending)} with '
+            f'open ports in {timings["discovery"]}s'
+        )
+
+        detect_started = time.monotonic()
+        results['hosts'].update(
+            self._detect_open_services(pending, discovered, workers)
+        )
+        timings['detection'] = round(time.monotonic() - detect_started, 3)
+        timings['total'] = round(time.monotonic() - started, 3)
+
+        self.log.info(
+            f'Phased NMAP scan completed. Found {len(results["hosts"])} hosts '
+            f'(discovery {timings["discovery"]}s, '
+            f'detection {timings["detection"]}s)'
+        )
+        return results
+
+    def scan_incremental(self, target, previous=None, ttl=NMAP_CACHE_TTL,
+                         workers=NMAP_SHARD_WORKERS):
+        self.log.info(f'Starting incremental NMAP scan on {target}')
+        now = datetime.now()
+        previous_hosts = previous['hosts'] if previous else {}
+        previous_time = previous['timestamp'] if previous else None
+
+        try:
+            discovered = dict(run_nmap(target.split(), NMAP_DISCOVERY_PROFILE))
+        except Exception as e:
+            self.log.error(f'NMAP discovery failed: {str(e)}')
+            return None
+
+        results = {
+            'timestamp': now.isoformat(),
+            'target': target,
+            'command': (
+                f'nmap {NMAP_DISCOVERY_PROFILE} {target} ; '
+                f'nmap {NMAP_PROFILE} -Pn -p <open ports> <changed host>'
+            ),
+            'hosts': {},
+            'incremental': {
+                'previous': previous_time,
+                'ttl': ttl,
+                'cached': 0,
+                'rescanned': 0
+            }
+        }
+
+        pending = {}
+        for host, host_data in discovered.items():
+            if host_data['state'] != 'up':
+                results['hosts'][host] = host_data
+                continue
+
+            open_services = [
+                s for s in host_data['services'] if s['state'] == 'open'
+            ]
+            cached = previous_hosts.get(host)
+            if cached and cached.get('state') == 'up':
+                scanned_at = datetime.fromisoformat(
+                    cached.get('scanned_at') or previous_time
+                )
+                unchanged = (
+                    service_fingerprint(cached['services'])
+                    == service_fingerprint(open_services)
+                )
+                if unchanged and (now - scanned_at).total_seconds() < ttl:
+                    results['hosts'][host] = {
+                        **cached,
+                        'scanned_at': scanned_at.isoformat(),
+                        'cached': True
+                    }
+                    continue
+
+            if open_services:
+                pending[host] = open_services
+            else:
+                results['hosts'][host] = {
+                    **host_data,
+                    'scanned_at': now.isoformat(),
+                    'cached': False
+                }
+
+        for host, host_data in self._detect_open_services(
+                pending, discovered, workers).items():
+            results['hosts'][host] = {
+                **host_data,
+                'scanned_at': now.isoformat(),
+                'cached': False
+            }
+
+        stats = results['incremental']
+        stats['cached'] = sum(
+            1 for h in results['hosts'].values() if h.get('cached')
+        )
+        stats['rescanned'] = len(pending)
+        self.log.info(
+            f'Incremental NMAP scan completed. Found {len(results["hosts"])} '
+            f'hosts, {stats["cached"]} unchanged, {stats["rescanned"]} rescanned'
+        )
+        return results
+
+    def _detect_open_services(self, pending, discovered, workers):
+        detected = {}
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = {
+                pool.submit(detect_services, host, services): host
+                for host, services in pending.items()
+            }
+            for future in as_completed(futures):
+                host = futures[future]
+                try:
+                    host_data = future.result().get(host)
+                except Exception as e:
+                    self.log.error(f'Service detection on {host} failed: {str(e)}')
+                    host_data = None
+
+                if host_data is None:
+                    host_data = discovered[host]
+                elif discovered[host]['hostname']:
+                    host_data['hostname'] = discovered[host]['hostname']
+                detected[host] = host_data
+        return detected
+
+    def latest_results(self, target):
+        results = results_store().latest_nmap(target)
+        if results:
+            return results
+
+        # Scans saved before the store existed only live in the result files
+        for filepath in sorted(RESULTS_DIR.glob('nmap_*'), reverse=True):
+            if not is_result_file(filepath):
+                continue
+            try:
+                if read_header(filepath).get('target') == target:
+                    return load_results(filepath)
+            except (OSError, ValueError) as e:
+                self.log.warning(f'Skipping unreadable {filepath}: {str(e)}')
+        return None
+
+    def scan_sharded(self, target, workers=NMAP_SHARD_WORKERS, shards=None):
+        targets = TargetSet(target)
+        if not targets:
+            self.log.error(f'No hosts to scan in {target}')
+            return None
+
+        # Shards are CIDR blocks, so large ranges are never listed host by host
+        chunks = [
+            shard.networks() for shard in targets.shards(shards or workers)
+        ]
+        self.log.info(
+            f'Starting sharded NMAP scan on {target}: {targets.size} hosts '
+            f'in {len(chunks)} shards across {workers} workers'
+        )
+
+        results = {
+            'timestamp': datetime.now().isoformat(),
+            'target': target,
+            'command': f'nmap {NMAP_PROFILE} -iL <shard> -oX <shard>.xml',
+            'hosts': {},
+            'failed_shards': []
+        }
+
+        with tempfile.TemporaryDirectory(prefix='nmap_shards_') as workdir, \
+                ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {
+                pool.submit(
+                    scan_shard, chunk, nmap_family(NMAP_PROFILE, chunk),
+                    workdir, index
+                ): index
+                for index, chunk in enumerate(chunks)
+            }
+
+            for future in as_completed(futures):
+                index = futures[future]
+                try:
+                    shard_hosts = future.result()
+                except Exception as e:
+                    self.log.error(f'Shard {index} failed: {str(e)}')
+                    results['failed_shards'].append({
+                        'shard': index,
+                        'hosts': chunks[index],
+                        'error': str(e)
+                    })
+                    continue
+
+                results['hosts'].update(shard_hosts)
+                self.log.info(
+                    f'Shard {index} completed with {len(shard_hosts)} hosts'
+                )
+
+        self.log.info(
+            f'Sharded NMAP scan completed. Found {len(results["hosts"])} hosts, '
+            f'{len(results["failed_shards"])} of {len(chunks)} shards failed'
+        )
+        return results
+
     def save(self, results, filename):
         filepath = RESULTS_DIR / filename
-        with open(filepath, 'w') as f:
-            json.dump(results, f, indent=2)
+        if is_ndjson(filepath):
+            write_results(filepath, 'nmap', results)
+        else:
+            with open(filepath, 'w') as f:
+                json.dump(results, f, indent=2)
         self.log.info(f'Results saved to {filepath}')
+        results_store().save_nmap(results, filepath)
         return filepath
 
+    def save_stream(self, target, filename, arguments=NMAP_PROFILE):
+        # Hosts are written as nmap reports them; nothing is held in memory
+        filepath = RESULTS_DIR / filename
+        try:
+            with NdjsonWriter(
+                    filepath, 'nmap',
+                    timestamp=datetime.now().isoformat(),
+                    target=target,
+                    command=f'nmap {arguments}') as writer:
+                for host, host_data in self.scan_stream(target, arguments):
+                    writer.write_host(host, host_data)
+        except RuntimeError:
+            # A truncated scan is neither kept nor imported
+            filepath.unlink(missing_ok=True)
+            return None
+        self.log.info(f'Results streamed to {filepath} ({writer.count} hosts)')
+        results_store().import_file(filepath)
+        return filepath
@@ -0,0 +1,94 @@
+import random
+import socket
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from config import (
+    NMAP_TUNING_SAMPLE,
+    NMAP_TUNING_PROBES,
+    NMAP_TUNING_TIMEOUT,
+)
+
+PROBE_PORTS = (80, 443, 22)
+
+
+def probe_rtt(host, port, timeout):
+    started = time.monotonic()
+    try:
+        with socket.create_connection((host, port), timeout=timeout):
+            pass
+    except ConnectionRefusedError:
+        # A RST still completes a round trip
+        pass
+    except OSError:
+        return None
+    return time.monotonic() - started
+
+
+def measure_network(hosts, sample=NMAP_TUNING_SAMPLE,
+                    probes=NMAP_TUNING_PROBES, timeout=NMAP_TUNING_TIMEOUT):
+    sample_hosts = random.sample(hosts, min(sample, len(hosts)))
+    jobs = [
+        (host, PROBE_PORTS[i % len(PROBE_PORTS)])
+        for host in sample_hosts
+        for i in range(probes)
+    ]
+
+    with ThreadPoolExecutor(max_workers=min(32, len(jobs) or 1)) as pool:
+        samples = list(pool.map(
+            lambda job: probe_rtt(job[0], job[1], timeout), jobs
+        ))
+
+    rtts = sorted(s * 1000 for s in samples if s is not None)
+    return {
+        'sampled_hosts': len(sample_hosts),
+        'probes': len(jobs),
+        'rtt_ms_median': round(statistics.median(rtts), 2) if rtts else None,
+        'rtt_ms_p90': (
+            round(rtts[int(0.9 * (len(rtts) - 1))], 2) if rtts else None
+        ),
+        'loss': round(1 - len(rtts) / len(jobs), 3) if jobs else None,
+    }
+
+
+def choose_parameters(measured, host_count):
+    rtt = measured['rtt_ms_p90']
+    loss = measured['loss'] or 0.0
+
+    if rtt is None:
+        template, min_rate, retries, hostgroup = 3, 100, 3, 32
+        rtt = NMAP_TUNING_TIMEOUT * 1000
+    elif rtt < 10:
+        template, min_rate, retries, hostgroup = 4, 1000, 1, 256
+    elif rtt < 100:
+        template, min_rate, retries, hostgroup = 4, 300, 2, 128
+    else:
+        template, min_rate, retries, hostgroup = 3, 100, 3, 64
+
+    if loss > 0.1:
+        retries += 2
+        min_rate = max(50, min_rate // 2)
+    if loss > 0.3:
+        template = min(template, 3)
+
+    min_hostgroup = max(1, min(host_count, hostgroup))
+    return {
+        'timing_template': template,
+        'min_rate': min_rate,
+        'max_retries': retries,
+        'max_rtt_timeout_ms': max(100, int(rtt * 4)),
+        'min_hostgroup': min_hostgroup,
+        'max_hostgroup': max(min_hostgroup, min(host_count, hostgroup * 4)),
+    }
+
+
+def build_arguments(base, params):
+    return (
+        f'{base} -T{params["timing_template"]} '
+        f'--min-rate {params["min_rate"]} '
+        f'--max-retries {params["max_retries"]} '
+        f'--max-rtt-timeout {params["max_rtt_timeout_ms"]}ms '
+        f'--min-hostgroup {params["min_hostgroup"]} '
+        f'--max-hostgroup {params["max_hostgroup"]}'
+    )
@@ -1,38 +1,54 @@
-import json
 import os
+import sys
+from pathlib import Path
 
+# Shared modules (config, results_store) live one level up
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from ndjson_io import is_result_file, iter_hosts  # noqa: E402
+from result_index import alive_hosts  # noqa: E402
+from results_store import results_store  # noqa: E402
 
-def extract_alive_hosts(nmap_json_path):
-    with open(nmap_json_path, "r") as file:
-        data = json.load(file)
 
-    hosts_data = data.get("hosts", {})
+def extract_alive_hosts(nmap_json_path):
+    # An existing sidecar index answers this without decoding any host
+    # record; a read never writes one
+    if not str(nmap_json_path).endswith(".gz"):
+        return alive_hosts(nmap_json_path, persist=False)
 
-    alive_hosts = [
+    # Compressed files cannot be indexed; stream them instead
+    hosts = [
         ip
-        for ip, details in hosts_data.items()
+        for ip, details in iter_hosts(nmap_json_path)
         if details.get("state") == "up"
     ]
 
-    return alive_hosts
+    return hosts
+
+
+def latest_alive_hosts(target=None):
+    """Alive hosts of the newest stored Nmap scan, via an indexed query."""
+    return results_store().latest_alive_hosts(target)
 
 
 def get_latest_nmap_file(scan_results_dir):
     files = [
         f for f in os.listdir(scan_results_dir)
-        if f.startswith("nmap_") and f.endswith(".json")
+        if f.startswith("nmap_") and is_result_file(f)
     ]
     files.sort()
     return os.path.join(scan_results_dir, files[-1]) if files else None
 
 
 if __name__ == "__main__":
-    scan_results_dir = os.path.join("..", "scan_results")
-    latest_nmap_file = get_latest_nmap_file(scan_results_dir)
+    hosts = latest_alive_hosts()
+    if not hosts:
+        scan_results_dir = os.path.join("..", "scan_results")
+        latest_nmap_file = get_latest_nmap_file(scan_results_dir)
 
-    if not latest_nmap_file:
-        print("No Nmap scan files found.")
-        exit(1)
+        if not latest_nmap_file:
+            print("No Nmap scan files found.")
+            exit(1)
 
-    hosts = extract_alive_hosts(latest_nmap_file)
+        hosts = extract_alive_hosts(latest_nmap_file)
     print("Alive hosts:", hosts)
@@ -1,29 +1,26 @@
-from gvm.connections import UnixSocketConnection
-from gvm.protocols.gmp import Gmp
 from gvm.protocols.gmpv208.entities.targets import AliveTest
 from lxml import etree
-import ipaddress
 import time
 
-# GVM Credentials
-USERNAME = "admin"
-PASSWORD = "StrongPassword123"
+from session import (
+    gmp_session,
+    gvm_pool,
+    task_poller,
+    cached_id,
+    invalidate_ids,
+    nmap_port_list_id,
+)
+from target_index import find_or_create_target
+from targets import TargetSet
+from report_reader import iter_report_results, empty_distribution
 
-# GVMD Unix Socket (WSL / Ubuntu)
-GVM_SOCKET = "/run/gvmd/gvmd.sock"
 
-
-def validate_ip(ip):
-    """Validate IP address format"""
-    try:
-        ipaddress.ip_address(ip)
-        return True
-    except ValueError:
-        return False
+def get_any_port_list_id(gmp):
+    """Fetch any available port list ID from GVM (cached)."""
+    return cached_id("port_list", lambda: _fetch_any_port_list_id(gmp))
 
 
-def get_any_port_list_id(gmp):
-    """Fetch any available port list ID from GVM."""
+def _fetch_any_port_list_id(gmp):
     response = gmp.get_port_lists()
     tree = etree.fromstring(response.encode("utf-8"))
     port_lists = tree.xpath("//port_list/@id")
@@ -33,7 +30,11 @@ def get_any_port_list_id(gmp):
 
 
 def get_scan_config_id(gmp):
-    """Get a scan configuration ID, prioritizing Discovery for speed."""
+    """Get a scan configuration ID, prioritizing Discovery for speed (cached)."""
+    return cached_id("config_discovery", lambda: _fetch_scan_config_id(gmp))
+
+
+def _fetch_scan_config_id(gmp):
     print("Fetching scan configurations...")
     response = gmp.get_scan_configs()
     tree = etree.fromstring(response.encode("utf-8"))
@@ -57,7 +58,11 @@ def get_scan_config_id(gmp):
 
 
 def get_scanner_id(gmp):
-    """Get the OpenVAS scanner ID."""
+    """Get the OpenVAS scanner ID (cached)."""
+    return cached_id("scanner", lambda: _fetch_scanner_id(gmp))
+
+
+def _fetch_scanner_id(gmp):
     response = gmp.get_scanners()
     tree = etree.fromstring(response.encode("utf-8"))
     scanners = tree.xpath("//scanner")
@@ -85,32 +90,34 @@ def get_or_create_target(gmp, alive_hosts):
     if not alive_hosts:
         raise ValueError("No alive hosts provided")
     
-    # Validate hosts
-    valid_hosts = [host for host in alive_hosts if validate_ip(host)]
-    if not valid_hosts:
+    # Hostnames are resolved rather than dropped; duplicates collapse and
+    # neighbouring addresses merge into CIDR blocks for gvmd
+    targets = TargetSet(alive_hosts)
+    if not targets:
         raise ValueError("No valid hosts to scan")
+    networks = targets.networks()
     
-    target_name = f"Target-{valid_hosts[0].replace('.', '-')}"
-    
-    # Check if target already exists
-    print(f"Checking for existing target '{target_name}'...")
-    response = gmp.get_targets()
-    tree = etree.fromstring(response.encode("utf-8"))
-    
-    for target in tree.xpath("//target"):
-        name = target.find("name").text
-        if name == target_name:
-            target_id = target.get("id")
-            print(f"✓ Using existing target: {target_id}")
-            return target_id
-    
-    # Create new target
-    print(f"Creating new target with {len(valid_hosts)} host(s)...")
-    port_list_id = get_any_port_list_id(gmp)
+    # Only the ports Nmap found open; any gvmd list if none are known
+    port_list_id = (
+        nmap_port_list_id(gmp, list(targets)) or get_any_port_list_id(gmp)
+    )
     
+    # Targets are keyed by a hash of the host set and port list, so lookup
+    # is an index hit or a single name-filtered get_targets call
+    target_id = find_or_create_target(
+        gmp, gvm_pool().name, networks, port_list_id,
+        lambda name: create_target(gmp, name, networks, port_list_id)
+    )
+    print(f"✓ Using target: {target_id}")
+    return target_id
+
+
+def create_target(gmp, target_name, hosts, port_list_id):
+    """Create a new target for the given hosts."""
+    print(f"Creating new target with {len(hosts)} address block(s)...")
     response = gmp.create_target(
         name=target_name,
-        hosts=valid_hosts,
+        hosts=hosts,
         port_list_id=port_list_id,
         alive_test=AliveTest.CONSIDER_ALIVE
     )
@@ -123,6 +130,8 @@ def get_or_create_target(gmp, alive_hosts):
         print(f"✓ Target created: {target_id}")
         return target_id
     else:
+        if status == "404":
+            invalidate_ids()
         raise RuntimeError(f"Target creation failed: {tree.get('status_text')}")
 
 
@@ -147,6 +156,8 @@ def create_and_start_scan(gmp, target_id):
     status = tree.get("status")
     
     if status not in ["201", "200"]:
+        if status == "404":
+            invalidate_ids()
         raise RuntimeError(f"Task creation failed: {tree.get('status_text')}")
     
     task_id = tree.get("id")
@@ -167,18 +178,6 @@ def create_and_start_scan(gmp, target_id):
         raise RuntimeError(f"Failed to start scan: {tree.get('status_text')}")
 
 
-def check_scan_status(gmp, task_id):
-    """Check the status of a running scan."""
-    response = gmp.get_task(task_id)
-    tree = etree.fromstring(response.encode("utf-8"))
-    
-    task = tree.find(".//task")
-    status = task.find("status").text
-    progress = task.find("progress").text
-    
-    return status, int(progress) if progress != "-1" else 0
-
-
 def main():
     print("=" * 70)
     print("OpenVAS Complete Scanning Workflow")
@@ -188,15 +187,8 @@ def main():
     alive_hosts = ["45.33.32.156"]
     print(f"\nTarget hosts: {alive_hosts}\n")
     
-    connection = UnixSocketConnection(path=GVM_SOCKET)
-    
     try:
-        with Gmp(connection=connection) as gmp:
-            # Authenticate
-            print("Authenticating with GVM...")
-            gmp.authenticate(USERNAME, PASSWORD)
-            print("✓ Authentication successful\n")
-            
+        with gmp_session() as gmp:
             # Get or create target
             target_id = get_or_create_target(gmp, alive_hosts)
             
@@ -208,19 +200,16 @@ def main():
             print("Monitoring scan progress...")
             print("=" * 70)
             
-            last_progress = -1
-            while True:
-                status, progress = check_scan_status(gmp, task_id)
-                
-                if progress != last_progress:
+            last_progress = [-1]
+            
+            def show_progress(task_id, status, progress):
+                if progress != last_progress[0]:
                     print(f"\rStatus: {status:15} | Progress: {progress:3}%", end="", flush=True)
-                    last_progress = progress
-                
-                if status in ["Done", "Stopped", "Interrupted"]:
-                    print()
-                    break
-                
-                time.sleep(5)
+                    last_progress[0] = progress
+            
+            # The shared poller adapts its interval to the scan's progress rate
+            status = task_poller().track(task_id, show_progress).result()
+            print()
             
             print("\n" + "=" * 70)
             print(f"✓ Scan completed with status: {status}")
@@ -230,20 +219,18 @@ def main():
             
             # Get results summary
             print("\nFetching scan results...")
-            response = gmp.get_report(report_id)
-            tree = etree.fromstring(response.encode("utf-8"))
-            
-            # Count vulnerabilities by severity
-            results = tree.xpath("//result")
-            high = len([r for r in results if r.find("threat").text == "High"])
-            medium = len([r for r in results if r.find("threat").text == "Medium"])
-            low = len([r for r in results if r.find("threat").text == "Low"])
-            
+            counts = empty_distribution()
+
+            # Count vulnerabilities by severity, one page at a time
+            for r in iter_report_results(gmp, report_id):
+                counts[r["severity_level"]] += 1
+
             print(f"\n📊 Results Summary:")
-            print(f"  🔴 High:   {high}")
-            print(f"  🟡 Medium: {medium}")
-            print(f"  🔵 Low:    {low}")
-            print(f"  📝 Total:  {len(results)}")
+            print(f"  🟣 Critical: {counts['critical']}")
+            print(f"  🔴 High:     {counts['high']}")
+            print(f"  🟡 Medium:   {counts['medium']}")
+            print(f"  🔵 Low:      {counts['low']}")
+            print(f"  📝 Total:    {sum(counts.values())}")
             
     except Exception as e:
         print(f"\n✗ Error: {e}")
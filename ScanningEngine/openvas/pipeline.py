@@ -0,0 +1,145 @@
+import sys
+from concurrent.futures import wait
+
+from lxml import etree
+
+from session import gmp_session, task_poller
+from state import load_state, save_state
+from config import RESULTS_DIR, OPENVAS_HARVEST_INTERVAL
+from extract_hosts import (
+    extract_alive_hosts,
+    get_latest_nmap_file,
+    latest_alive_hosts,
+)
+from report_reader import ResultHarvester
+from step3_create_target import get_or_create_target
+from step4_select_scan_config import get_scan_config_id
+from step5_create_task import create_task
+from step6_start_scan import start_scan
+from step7_monitor_scan import last_report_id, show_progress
+from step9_build_json import build_json
+
+STAGES = ("target", "config", "task", "start", "monitor", "results")
+
+
+def task_status(gmp, task_id):
+    """Current gvmd status of a task, or None if it no longer exists."""
+    tree = etree.fromstring(gmp.get_task(task_id).encode())
+    task = tree.find(".//task")
+    return task.findtext("status") if task is not None else None
+
+
+def monitor(state):
+    """Wait for the task, checkpointing harvested results as they arrive."""
+    with gmp_session() as gmp:
+        status = task_status(gmp, state["task_id"])
+        if status in ("Stopped", "Interrupted"):
+            print(f"Task was {status}, resuming...")
+            gmp.resume_task(state["task_id"])
+
+        harvester = ResultHarvester(gmp, state["task_id"])
+        harvester.records = state.setdefault("results", [])
+        harvester.seen = {r["id"] for r in harvester.records}
+        harvester.watermark = state.get("watermark")
+
+        future = task_poller().track(state["task_id"], show_progress)
+        while True:
+            finished, _ = wait([future], timeout=OPENVAS_HARVEST_INTERVAL)
+            if harvester.pull():
+                state["watermark"] = harvester.watermark
+                save_state(state)
+                print(f"✓ {len(harvester.records)} results checkpointed")
+            if finished:
+                break
+
+        return future.result(), last_report_id(gmp, state["task_id"])
+
+
+def run_pipeline(alive_hosts):
+    hosts = sorted(alive_hosts)
+    state = load_state()
+    completed = state.get("completed", [])
+    if state.get("hosts") != hosts or len(completed) == len(STAGES):
+        state = {"hosts": hosts, "completed": []}
+    else:
+        print(f"Resuming after stage '{completed[-1]}'" if completed else "Resuming")
+
+    def done(stage):
+        return stage in state["completed"]
+
+    def checkpoint(stage, **values):
+        state.update(values)
+        state["completed"].append(stage)
+        save_state(state)
+        print(f"✓ Checkpoint: {stage}")
+
+    with gmp_session() as gmp:
+        if not done("target"):
+            checkpoint("target", target_id=get_or_create_target(gmp, ",".join(hosts)))
+
+        if not done("config"):
+            config_id, _ = get_scan_config_id(gmp)
+            checkpoint("config", config_id=config_id)
+
+        if done("task") and task_status(gmp, state["task_id"]) is None:
+            print("Checkpointed task no longer exists, recreating it")
+            state["completed"] = ["target", "config"]
+
+        if not done("task"):
+            checkpoint("task", task_id=create_task(
+                gmp, state["target_id"], state["config_id"]
+            ))
+
+        if not done("start"):
+            # Reattach if a previous run started the task before crashing
+            if task_status(gmp, state["task_id"]) == "New":
+                report_id = start_scan(gmp, state["task_id"])
+            else:
+                report_id = last_report_id(gmp, state["task_id"])
+            if not report_id:
+                raise SystemExit("✗ Could not start the scan task")
+            checkpoint("start", report_id=report_id)
+
+    if not done("monitor"):
+        status, report_id = monitor(state)
+        if status != "Done":
+            save_state(state)
+            raise SystemExit(f"✗ Scan {status} - rerun to resume it")
+        checkpoint("monitor", status=status, report_id=report_id)
+
+    if not done("results"):
+        with gmp_session() as gmp:
+            harvester = ResultHarvester(gmp, state["task_id"])
+            harvester.records = state["results"]
+            harvester.seen = {r["id"] for r in harvester.records}
+            harvester.watermark = state.get("watermark")
+            harvester.pull()
+        build_json(state["report_id"], records=state["results"])
+        checkpoint("results", watermark=harvester.watermark)
+
+    return state
+
+
+def main():
+    if len(sys.argv) > 1:
+        alive_hosts = sys.argv[1:]
+    else:
+        alive_hosts = latest_alive_hosts()
+    if not alive_hosts:
+        latest_nmap_file = get_latest_nmap_file(RESULTS_DIR)
+        if not latest_nmap_file:
+            print("No Nmap scan files found.")
+            exit(1)
+        alive_hosts = extract_alive_hosts(latest_nmap_file)
+
+    print(f"Target hosts: {alive_hosts}\n")
+    state = run_pipeline(alive_hosts)
+
+    print("\n=== PIPELINE COMPLETE ===")
+    print(f"Task ID: {state['task_id']}")
+    print(f"Report ID: {state['report_id']}")
+    print(f"Findings: {len(state['results'])}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+import sys
+from pathlib import Path
+
+# Shared modules (config, logger, gmp_pool) live one level up
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from gvm.connections import UnixSocketConnection  # noqa: E402
+from config import OPENVAS_NMAP_PORT_LIST  # noqa: E402
+from gmp_cache import catalog_cache  # noqa: E402
+from gmp_pool import get_pool  # noqa: E402
+from results_store import results_store  # noqa: E402
+from target_index import forget_all, services_port_list  # noqa: E402
+from task_poller import shared_poller  # noqa: E402
+
+# GVM Credentials
+USERNAME = "admin"
+PASSWORD = "StrongPassword123"
+
+# GVMD Unix Socket (WSL / Ubuntu)
+GVM_SOCKET = "/run/gvmd/gvmd.sock"
+
+
+def gvm_pool():
+    """Process-wide pool of authenticated sessions on the gvmd socket."""
+    return get_pool(
+        "gvmd-unix",
+        lambda: UnixSocketConnection(path=GVM_SOCKET),
+        USERNAME,
+        PASSWORD,
+    )
+
+
+def gmp_session():
+    """Check out an authenticated Gmp from the shared pool."""
+    return gvm_pool().session()
+
+
+def task_poller():
+    """Shared poller that batches status checks for every tracked task."""
+    return shared_poller(gvm_pool())
+
+
+def cached_id(kind, loader):
+    """Return a catalogue ID (config, scanner, port list) from the TTL cache."""
+    return catalog_cache().get(f"{gvm_pool().name}:{kind}", loader)
+
+
+def nmap_port_list_id(gmp, hosts):
+    """Port list of just the ports Nmap last saw open on hosts, or None."""
+    if not OPENVAS_NMAP_PORT_LIST:
+        return None
+    return services_port_list(
+        gmp, gvm_pool().name, results_store().open_services(hosts)
+    )
+
+
+def invalidate_ids():
+    """Forget cached catalogue, target and port list IDs after a 404."""
+    catalog_cache().invalidate(f"{gvm_pool().name}:")
+    forget_all(gvm_pool().name)
@@ -0,0 +1,39 @@
+import json
+import os
+from pathlib import Path
+
+# Checkpoint shared by the step scripts and pipeline.py
+STATE_FILE = Path(__file__).resolve().parent / "pipeline_state.json"
+
+
+def load_state(path=STATE_FILE):
+    """Load the pipeline checkpoint, or an empty state if none exists."""
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_state(state, path=STATE_FILE):
+    """Atomically write the pipeline checkpoint."""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def update_state(path=STATE_FILE, **values):
+    """Merge values into the checkpoint on disk and return the new state."""
+    state = load_state(path)
+    state.update(values)
+    save_state(state, path)
+    return state
+
+
+def require(state, key, step):
+    """Return a checkpointed value or stop with a hint about which step sets it."""
+    value = state.get(key)
+    if not value:
+        raise SystemExit(f"✗ No {key} checkpointed yet - run {step} first")
+    return value
@@ -1,36 +1,42 @@
-from gvm.connections import UnixSocketConnection
-from gvm.protocols.gmp import Gmp
 from gvm.protocols.gmpv208.entities.targets import AliveTest
 from lxml import etree
 
-USERNAME = "admin"
-PASSWORD = "StrongPassword123"
-GVM_SOCKET = "/run/gvmd/gvmd.sock"
+from session import (
+    gmp_session,
+    gvm_pool,
+    cached_id,
+    invalidate_ids,
+    nmap_port_list_id,
+)
+from state import update_state
+from target_index import find_or_create_target
 
 alive_hosts = ["45.33.32.156"]
 
 
 def get_port_list_id(gmp):
+    return cached_id("port_list", lambda: _fetch_port_list_id(gmp))
+
+
+def _fetch_port_list_id(gmp):
     response = gmp.get_port_lists()
     tree = etree.fromstring(response.encode())
     return tree.xpath("//port_list/@id")[0]
 
 
 def get_or_create_target(gmp, hosts):
-    target_name = f"Target-{hosts.replace('.', '-')}"
-    
-    # Check existing targets
-    response = gmp.get_targets()
-    tree = etree.fromstring(response.encode())
+    # Only the ports Nmap found open; the first gvmd list if none are known
+    port_list_id = (
+        nmap_port_list_id(gmp, hosts.split(",")) or get_port_list_id(gmp)
+    )
+    return find_or_create_target(
+        gmp, gvm_pool().name, hosts.split(","), port_list_id,
+        lambda name: create_target(gmp, name, hosts, port_list_id)
+    )
 
-    for target in tree.xpath("//target"):
-        if target.find("name").text == target_name:
-            print(f"✓ Existing target found")
-            return target.get("id")
 
+def create_target(gmp, target_name, hosts, port_list_id):
     print("✓ Creating new target...")
-    port_list_id = get_port_list_id(gmp)
-
     response = gmp.create_target(
         name=target_name,
         hosts=hosts,                 # STRING, NOT LIST
@@ -39,17 +45,19 @@ def get_or_create_target(gmp, hosts):
     )
 
     tree = etree.fromstring(response.encode())
+    if tree.get("status") == "404":
+        invalidate_ids()
     return tree.get("id")
 
 
 def main():
     host_string = ",".join(alive_hosts)
 
-    connection = UnixSocketConnection(path=GVM_SOCKET)
-    with Gmp(connection=connection) as gmp:
-        gmp.authenticate(USERNAME, PASSWORD)
+    with gmp_session() as gmp:
         target_id = get_or_create_target(gmp, host_string)
 
+        update_state(hosts=alive_hosts, target_id=target_id)
+
         print("\n=== STEP-3 COMPLETE ===")
         print("Target ID:", target_id)
 
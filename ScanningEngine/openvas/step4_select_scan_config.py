@@ -1,13 +1,16 @@
-from gvm.connections import UnixSocketConnection
-from gvm.protocols.gmp import Gmp
 from lxml import etree
 
-USERNAME = "admin"
-PASSWORD = "StrongPassword123"
-GVM_SOCKET = "/run/gvmd/gvmd.sock"
+from session import gmp_session, cached_id
+from state import update_state
 
 
 def get_scan_config_id(gmp):
+    return tuple(
+        cached_id("config_full_and_fast", lambda: _fetch_scan_config_id(gmp))
+    )
+
+
+def _fetch_scan_config_id(gmp):
     response = gmp.get_scan_configs()
     tree = etree.fromstring(response.encode("utf-8"))
 
@@ -29,12 +32,9 @@ def get_scan_config_id(gmp):
 
 
 def main():
-    connection = UnixSocketConnection(path=GVM_SOCKET)
-
-    with Gmp(connection=connection) as gmp:
-        gmp.authenticate(USERNAME, PASSWORD)
-
+    with gmp_session() as gmp:
         config_id, config_name = get_scan_config_id(gmp)
+        update_state(config_id=config_id)
 
         print("\n✓ Scan Configuration Selected")
         print(f"Name: {config_name}")
@@ -1,19 +1,15 @@
-from gvm.connections import UnixSocketConnection
-from gvm.protocols.gmp import Gmp
 from lxml import etree
 import time
 
-# ===== CONFIG =====
-USERNAME = "admin"
-PASSWORD = "StrongPassword123"
-GVM_SOCKET = "/run/gvmd/gvmd.sock"
-
-# From previous steps
-TARGET_ID = "b0a2e9a6-a9ca-4a54-8bc6-f1d85b8c874d"
-CONFIG_ID = "daba56c8-73ec-11df-a475-002264764cea"
+from session import gmp_session, cached_id, invalidate_ids
+from state import load_state, update_state, require
 
 
 def get_scanner_id(gmp):
+    return cached_id("scanner", lambda: _fetch_scanner_id(gmp))
+
+
+def _fetch_scanner_id(gmp):
     response = gmp.get_scanners()
     tree = etree.fromstring(response.encode())
 
@@ -24,36 +20,45 @@ def get_scanner_id(gmp):
     raise RuntimeError("OpenVAS scanner not found")
 
 
-def create_task():
-    connection = UnixSocketConnection(path=GVM_SOCKET)
+def create_task(gmp, target_id, config_id):
+    scanner_id = get_scanner_id(gmp)
 
-    with Gmp(connection=connection) as gmp:
-        gmp.authenticate(USERNAME, PASSWORD)
+    task_name = f"Auto-Scan-{int(time.time())}"
+
+    response = gmp.create_task(
+        name=task_name,
+        config_id=config_id,
+        target_id=target_id,
+        scanner_id=scanner_id,
+    )
+
+    tree = etree.fromstring(response.encode())
+    status = tree.get("status")
 
-        scanner_id = get_scanner_id(gmp)
+    if status in ["201", "200"]:
+        task_id = tree.get("id")
+        print("✓ Scan task created successfully")
+        print(f"Task Name: {task_name}")
+        print(f"Task ID: {task_id}")
+        return task_id
+    else:
+        if status == "404":
+            invalidate_ids()
+        raise RuntimeError(tree.get("status_text"))
 
-        task_name = f"Auto-Scan-{int(time.time())}"
 
-        response = gmp.create_task(
-            name=task_name,
-            config_id=CONFIG_ID,
-            target_id=TARGET_ID,
-            scanner_id=scanner_id,
-        )
+def main():
+    # Target and config come from the step 3/4 checkpoint
+    state = load_state()
+    target_id = require(state, "target_id", "step3_create_target.py")
+    config_id = require(state, "config_id", "step4_select_scan_config.py")
 
-        tree = etree.fromstring(response.encode())
-        status = tree.get("status")
+    with gmp_session() as gmp:
+        task_id = create_task(gmp, target_id, config_id)
 
-        if status in ["201", "200"]:
-            task_id = tree.get("id")
-            print("✓ Scan task created successfully")
-            print(f"Task Name: {task_name}")
-            print(f"Task ID: {task_id}")
-            print("\n=== STEP-5 COMPLETE ===")
-            return task_id
-        else:
-            raise RuntimeError(tree.get("status_text"))
+    update_state(task_id=task_id)
+    print("\n=== STEP-5 COMPLETE ===")
 
 
 if __name__ == "__main__":
-    create_task()
+    main()
@@ -1,33 +1,33 @@
-from gvm.connections import UnixSocketConnection
-from gvm.protocols.gmp import Gmp
+from lxml import etree
 
-# Credentials
-USERNAME = "admin"
-PASSWORD = "StrongPassword123"
+from session import gmp_session
+from state import load_state, update_state, require
 
-# Socket
-GVM_SOCKET = "/run/gvmd/gvmd.sock"
 
-# Task ID from Step-5
-TASK_ID = "63dae6a6-c756-4b8f-9384-0043fd2e4d80"
+def start_scan(gmp, task_id):
+    print("Starting scan task...")
+    response = gmp.start_task(task_id)
+    tree = etree.fromstring(response.encode())
 
-def start_scan():
-    connection = UnixSocketConnection(path=GVM_SOCKET)
+    if tree.get("status") == "202":
+        report_id = tree.findtext("report_id")
+        print("✓ Scan started successfully")
+        return report_id
+    else:
+        print("✗ Failed to start scan")
+        print(response)
+        return None
 
-    with Gmp(connection=connection) as gmp:
-        print("Authenticating with GVM...")
-        gmp.authenticate(USERNAME, PASSWORD)
-        print("✓ Authentication successful")
 
-        print("Starting scan task...")
-        response = gmp.start_task(TASK_ID)
+def main():
+    task_id = require(load_state(), "task_id", "step5_create_task.py")
 
-        if 'status="202"' in response:
-            print("✓ Scan started successfully")
-        else:
-            print("✗ Failed to start scan")
-            print(response)
+    with gmp_session() as gmp:
+        report_id = start_scan(gmp, task_id)
+
+    if report_id:
+        update_state(report_id=report_id)
 
 if __name__ == "__main__":
-    start_scan()
+    main()
     print("\n=== STEP-6 COMPLETE ===")
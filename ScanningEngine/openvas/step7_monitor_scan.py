@@ -1,46 +1,42 @@
-from gvm.connections import UnixSocketConnection
-from gvm.protocols.gmp import Gmp
 from lxml import etree
-import time
 
-USERNAME = "admin"
-PASSWORD = "StrongPassword123"
-SOCKET_PATH = "/run/gvmd/gvmd.sock"
+from session import gmp_session, task_poller
+from state import load_state, update_state, require
 
-TASK_ID = "63dae6a6-c756-4b8f-9384-0043fd2e4d80"
 
+def show_progress(task_id, status, progress):
+    print(f"Status: {status:12} | Progress: {progress}%")
 
-def monitor_scan():
-    connection = UnixSocketConnection(path=SOCKET_PATH)
 
-    with Gmp(connection=connection) as gmp:
-        print("Authenticating with GVM...")
-        gmp.authenticate(USERNAME, PASSWORD)
-        print("✓ Authentication successful\n")
+def last_report_id(gmp, task_id):
+    response = gmp.get_task(task_id)
+    tree = etree.fromstring(response.encode())
 
-        print("Monitoring scan progress...\n")
+    report = tree.find(".//task//report")
+    return report.get("id") if report is not None else None
 
-        while True:
-            response = gmp.get_task(TASK_ID)
-            tree = etree.fromstring(response.encode())
 
-            task = tree.find(".//task")
-            status = task.findtext("status")
-            progress = task.findtext("progress")
+def monitor_scan(task_id, on_progress=show_progress):
+    print("Monitoring scan progress...\n")
 
-            print(f"Status: {status:12} | Progress: {progress}%")
+    # Status arrives from the shared batched poller as soon as it changes
+    status = task_poller().track(task_id, on_progress).result()
 
-            if status in ["Done", "Stopped", "Interrupted"]:
-                report = task.find(".//report")
-                report_id = report.get("id") if report is not None else None
+    with gmp_session() as gmp:
+        report_id = last_report_id(gmp, task_id)
 
-                print("\n=== STEP-7 COMPLETE ===")
-                print(f"Final Status: {status}")
-                print(f"Report ID: {report_id}")
-                return report_id
+    return status, report_id
 
-            time.sleep(5)
+
+def main():
+    task_id = require(load_state(), "task_id", "step5_create_task.py")
+    status, report_id = monitor_scan(task_id)
+    update_state(status=status, report_id=report_id)
+
+    print("\n=== STEP-7 COMPLETE ===")
+    print(f"Final Status: {status}")
+    print(f"Report ID: {report_id}")
 
 
 if __name__ == "__main__":
-    monitor_scan()
+    main()
@@ -1,56 +1,31 @@
-from gvm.connections import UnixSocketConnection
-from gvm.protocols.gmp import Gmp
-from lxml import etree
+from session import gmp_session
+from report_reader import iter_report_results, empty_distribution
+from state import load_state, require
 
-GVM_SOCKET = "/run/gvmd/gvmd.sock"
-USERNAME = "admin"
-PASSWORD = "StrongPassword123"
-
-# PUT YOUR REPORT ID HERE
-REPORT_ID = "609f4621-185e-44e4-8868-d951ba73da9e"
-
-
-def fetch_results():
-    connection = UnixSocketConnection(path=GVM_SOCKET)
-
-    with Gmp(connection=connection) as gmp:
-        print("Authenticating with GVM...")
-        gmp.authenticate(USERNAME, PASSWORD)
-        print("✓ Authentication successful\n")
 
+def fetch_results(report_id):
+    with gmp_session() as gmp:
         print("Fetching report results...")
-        response = gmp.get_report(
-            REPORT_ID,
-            details=True,
-            ignore_pagination=True
-        )
-
-        tree = etree.fromstring(response.encode())
-
-        results = tree.xpath("//result")
 
-        severity_map = {
-            "High": 0,
-            "Medium": 0,
-            "Low": 0,
-            "Log": 0
-        }
+        severity_map = empty_distribution()
 
-        for r in results:
-            threat = r.findtext("threat")
-            if threat in severity_map:
-                severity_map[threat] += 1
+        # Page through results; only one page is held in memory at a time
+        total = 0
+        for r in iter_report_results(gmp, report_id):
+            total += 1
+            severity_map[r["severity_level"]] += 1
 
         print("\n📊 Vulnerability Summary")
         print("========================")
-        print(f"Total Findings: {len(results)}")
-        print(f"High:   {severity_map['High']}")
-        print(f"Medium: {severity_map['Medium']}")
-        print(f"Low:    {severity_map['Low']}")
-        print(f"Info:   {severity_map['Log']}")
+        print(f"Total Findings: {total}")
+        print(f"Critical: {severity_map['critical']}")
+        print(f"High:     {severity_map['high']}")
+        print(f"Medium:   {severity_map['medium']}")
+        print(f"Low:      {severity_map['low']}")
+        print(f"Info:     {severity_map['info']}")
 
         print("\n=== STEP-8 COMPLETE ===")
 
 
 if __name__ == "__main__":
-    fetch_results()
+    fetch_results(require(load_state(), "report_id", "step7_monitor_scan.py"))
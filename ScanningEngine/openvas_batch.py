@@ -0,0 +1,134 @@
+from concurrent.futures import FIRST_COMPLETED, wait
+
+from config import (
+    OPENVAS_BATCH_SIZE,
+    OPENVAS_MAX_CONCURRENT_TASKS,
+    OPENVAS_NMAP_PORT_LIST,
+)
+from logger import ScanLogger
+from nmap_scanner import open_services
+from openvas_scanner import merge_results
+
+
+def split_batches(hosts, batch_size):
+    return [
+        hosts[i:i + batch_size]
+        for i in range(0, len(hosts), batch_size)
+    ]
+
+
+class OpenVASBatchRunner:
+    def __init__(self, openvas, batch_size=OPENVAS_BATCH_SIZE,
+                 max_concurrent=OPENVAS_MAX_CONCURRENT_TASKS):
+        self.openvas = openvas
+        self.batch_size = batch_size
+        self.max_concurrent = max_concurrent
+        self.log = ScanLogger('openvas-batch')
+        self.config_id = None
+        self.scanner_id = None
+        self.running = {}
+        self.reports = []
+        self.failed = []
+        self.submitted = 0
+
+    def run(self, hosts, scan_name, nmap_results=None):
+        batches = split_batches(hosts, self.batch_size)
+        self.log.info(
+            f'Scanning {len(hosts)} hosts in {len(batches)} batches, '
+            f'up to {self.max_concurrent} tasks at once'
+        )
+
+        if not self.prepare():
+            return None
+
+        for batch in batches:
+            services = None
+            if nmap_results and OPENVAS_NMAP_PORT_LIST:
+                services = open_services(nmap_results, batch)
+            self.wait_for_slot()
+            self.submit(scan_name, batch, services)
+
+        return self.finish()
+
+    def prepare(self):
+        self.config_id = self.openvas.get_config_id()
+        self.scanner_id = self.openvas.get_scanner_id()
+        return bool(self.config_id and self.scanner_id)
+
+    def submit(self, scan_name, hosts, services=None):
+        index = self.submitted
+        self.submitted += 1
+        task_id = self._start_batch(
+            f'{scan_name}_b{index}', hosts, self.config_id, self.scanner_id,
+            services
+        )
+        if not task_id:
+            self.failed.append({'batch': index, 'hosts': hosts})
+            return None
+
+        future = self.openvas.poller.track(task_id)
+        self.running[future] = (task_id, index, hosts)
+        return task_id
+
+    def wait_for_slot(self):
+        while len(self.running) >= self.max_concurrent:
+            self.reap()
+
+    def reap(self, timeout=None):
+        if not self.running:
+            return 0
+        done, _ = wait(self.running, timeout=timeout,
+                       return_when=FIRST_COMPLETED)
+        for future in done:
+            self._collect(future, *self.running.pop(future))
+        return len(done)
+
+    def finish(self):
+        while self.running:
+            self.reap()
+
+        merged = merge_results(self.reports)
+        merged['failed_batches'] = self.failed
+        self.log.info(
+            f'Batched scan completed: {len(self.reports)} of {self.submitted} '
+            f'batches, {merged["total_vulnerabilities"]} vulnerabilities'
+        )
+        return merged
+
+    def _collect(self, future, task_id, index, hosts):
+        try:
+            status = future.result()
+        except Exception as e:
+            self.log.error(f'Status check for batch {index} failed: {str(e)}')
+            self.failed.append({'batch': index, 'hosts': hosts})
+            return
+
+        if status == 'Done':
+            results = self.openvas.get_results(task_id)
+            if results:
+                self.reports.append(results)
+                self.log.info(
+                    f'Batch {index} done with '
+                    f'{results["total_vulnerabilities"]} vulnerabilities'
+                )
+            else:
+                self.failed.append({'batch': index, 'hosts': hosts})
+        else:
+            self.log.error(f'Batch {index} {status}')
+            self.failed.append({'batch': index, 'hosts': hosts})
+
+    def _start_batch(self, name, hosts, config_id, scanner_id, services=None):
+        target_id = self.openvas.get_or_create_target(hosts, services=services)
+        if not target_id:
+            return None
+
+        task_id = self.openvas.create_task(
+            name, target_id, config_id, scanner_id,
+            hosts=hosts, services=services
+        )
+        if not task_id:
+            return None
+
+        if not self.openvas.start_task(task_id):
+            return None
+        return task_id
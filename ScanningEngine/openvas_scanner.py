@@ -1,25 +1,59 @@
 import json
-import time
+from concurrent.futures import wait
 from datetime import datetime
 
 from gvm.connections import TLSConnection
-from gvm.protocols.gmp import Gmp
+from gvm.transforms import EtreeCheckCommandTransform
 
 from config import (
     OPENVAS_HOST,
     OPENVAS_PORT,
     OPENVAS_USERNAME,
     OPENVAS_PASSWORD,
-    SCAN_STATUS_CHECK_INTERVAL,
     RESULTS_DIR,
+    OPENVAS_MIN_QOD,
+    OPENVAS_HARVEST_INTERVAL,
+    OPENVAS_COMPACT_RESULTS,
 )
+from columnar_store import ColumnarStore
+from compact_results import CompactResults, iter_vulnerabilities
+from gmp_cache import catalog_cache, is_not_found
+from gmp_pool import get_pool
 from logger import ScanLogger
+from ndjson_io import NdjsonWriter, is_ndjson, iter_findings, write_results
+from report_reader import (
+    iter_report_results,
+    ResultHarvester,
+    empty_distribution,
+)
+from results_store import results_store
+from target_index import (
+    find_or_create_target,
+    forget_target,
+    forget_port_list,
+    port_range,
+    services_port_list,
+)
+from task_poller import shared_poller
+
+
+def openvas_pool():
+    return get_pool(
+        'openvas-tls',
+        lambda: TLSConnection(hostname=OPENVAS_HOST, port=OPENVAS_PORT),
+        OPENVAS_USERNAME,
+        OPENVAS_PASSWORD,
+        transform=EtreeCheckCommandTransform()
+    )
 
 
 class OpenVASScanner:
-    def __init__(self):
+    def __init__(self, pool=None):
         self.log = ScanLogger('openvas')
-        self.connection = None
+        self.pool = pool or openvas_pool()
+        self.catalog = catalog_cache()
+        self.poller = shared_poller(self.pool)
+        self.session = None
         self.gmp = None
 
     def connect(self):
@@ -27,16 +61,8 @@ class OpenVASScanner:
             self.log.info(
                 f'Connecting to OpenVAS at {OPENVAS_HOST}:{OPENVAS_PORT}'
             )
-            self.connection = TLSConnection(
-                hostname=OPENVAS_HOST,
-                port=OPENVAS_PORT
-            )
-            self.gmp = Gmp(connection=self.connection)
-            self.gmp.connect()
-            self.gmp.authenticate(
-                OPENVAS_USERNAME,
-                OPENVAS_PASSWORD
-            )
+            self.session = self.pool.checkout()
+            self.gmp = self.session.gmp
             version = self.gmp.get_version().xpath(
                 'version/text()'
             )[0]
@@ -45,18 +71,25 @@ class OpenVASScanner:
 
         except Exception as e:
             self.log.error(f'Connection failed: {str(e)}')
+            if self.session:
+                self.pool.checkin(self.session, broken=True)
+                self.session = None
+                self.gmp = None
             return False
 
     def disconnect(self):
-        if self.connection:
-            self.connection.disconnect()
-            self.log.info('Disconnected from OpenVAS')
+        if self.session:
+            self.pool.checkin(self.session, broken=not self.session.alive())
+            self.session = None
+            self.gmp = None
+            self.log.info('Released OpenVAS session')
 
-    def create_target(self, name, hosts):
+    def create_target(self, name, hosts, port_list_id=None):
         try:
             response = self.gmp.create_target(
                 name=name,
-                hosts=[hosts]
+                hosts=hosts if isinstance(hosts, list) else [hosts],
+                port_list_id=port_list_id
             )
             target_id = response.xpath('@id')[0]
             self.log.info(f'Target created with ID {target_id}')
@@ -66,7 +99,55 @@ class OpenVASScanner:
             self.log.error(f'Target creation failed: {str(e)}')
             return None
 
+    def get_or_create_target(self, hosts, port_list_id=None, services=None):
+        hosts = hosts if isinstance(hosts, list) else [hosts]
+        from_services = port_list_id is None and bool(services)
+        if from_services:
+            port_list_id = self.get_or_create_port_list(services)
+        try:
+            target_id = self._find_or_create_target(hosts, port_list_id)
+            if target_id is None and from_services and port_list_id:
+                # The indexed port list may have been deleted in gvmd; drop
+                # it and retry once with a freshly looked-up list
+                forget_port_list(self.pool.name, port_list_id)
+                port_list_id = self.get_or_create_port_list(services)
+                target_id = self._find_or_create_target(hosts, port_list_id)
+            if target_id is None:
+                return None
+            self.log.info(f'Using target {target_id} for {len(hosts)} hosts')
+            return target_id
+
+        except Exception as e:
+            self.log.error(f'Target lookup failed: {str(e)}')
+            return None
+
+    def _find_or_create_target(self, hosts, port_list_id):
+        return find_or_create_target(
+            self.gmp, self.pool.name, hosts, port_list_id,
+            lambda name: self.create_target(name, hosts, port_list_id)
+        )
+
+    def get_or_create_port_list(self, services):
+        try:
+            port_list_id = services_port_list(
+                self.gmp, self.pool.name, services
+            )
+            if port_list_id:
+                self.log.info(
+                    f'Using port list {port_list_id}: {port_range(services)}'
+                )
+            return port_list_id
+
+        except Exception as e:
+            self.log.error(f'Port list lookup failed: {str(e)}')
+            return None
+
     def get_config_id(self):
+        return self.catalog.get(
+            f'{self.pool.name}:config', self._fetch_config_id
+        )
+
+    def _fetch_config_id(self):
         try:
             response = self.gmp.get_scan_configs()
             for config in response.xpath('config'):
@@ -82,6 +163,11 @@ class OpenVASScanner:
             return None
 
     def get_scanner_id(self):
+        return self.catalog.get(
+            f'{self.pool.name}:scanner', self._fetch_scanner_id
+        )
+
+    def _fetch_scanner_id(self):
         try:
             response = self.gmp.get_scanners()
             for scanner in response.xpath('scanner'):
@@ -96,7 +182,8 @@ class OpenVASScanner:
             self.log.error(f'Get scanner failed: {str(e)}')
             return None
 
-    def create_task(self, name, target_id, config_id, scanner_id):
+    def create_task(self, name, target_id, config_id, scanner_id, hosts=None,
+                    services=None, retry=True):
         try:
             response = self.gmp.create_task(
                 name=name,
@@ -109,6 +196,24 @@ class OpenVASScanner:
             return task_id
 
         except Exception as e:
+            if retry and is_not_found(e):
+                self.log.warning(
+                    f'Catalogue ID rejected ({str(e)}), refreshing cache'
+                )
+                self.catalog.invalidate(f'{self.pool.name}:')
+                forget_target(self.pool.name, target_id)
+                if hosts is not None:
+                    # The rejected ID may be the target's; resolve it again
+                    # rather than resending the same one
+                    target_id = self.get_or_create_target(
+                        hosts, services=services
+                    )
+                    if target_id is None:
+                        return None
+                return self.create_task(
+                    name, target_id, self.get_config_id(),
+                    self.get_scanner_id(), retry=False
+                )
             self.log.error(f'Task creation failed: {str(e)}')
             return None
 
@@ -123,35 +228,69 @@ class OpenVASScanner:
             self.log.error(f'Task start failed: {str(e)}')
             return None
 
+    def get_task_status(self, task_id):
+        response = self.gmp.get_task(task_id)
+        status = response.xpath(
+            'task/status/text()'
+        )[0]
+        progress = int(
+            response.xpath('task/progress/text()')[0]
+        )
+        return status, progress
+
     def wait_for_completion(self, task_id):
-        self.log.info('Waiting for scan to complete')
+        # Per-poll progress comes from the shared poller, rate-limited
+        log = self.log.bind(task=task_id)
+        log.info('Waiting for scan to complete')
+        try:
+            status = self.poller.track(task_id).result()
+        except Exception as e:
+            log.error(f'Status check failed: {str(e)}')
+            return False
+
+        if status == 'Done':
+            log.info('Scan completed')
+            return True
+        log.error(f'Scan {status}')
+        return False
+
+    def wait_and_harvest(self, task_id, on_results=None,
+                         interval=OPENVAS_HARVEST_INTERVAL):
+        self.log.info('Waiting for scan to complete, harvesting early results')
+        harvester = ResultHarvester(self.gmp, task_id)
+        future = self.poller.track(task_id)
+
         while True:
+            done, _ = wait([future], timeout=interval)
             try:
-                response = self.gmp.get_task(task_id)
-                status = response.xpath(
-                    'task/status/text()'
-                )[0]
-                progress = int(
-                    response.xpath('task/progress/text()')[0]
-                )
+                new = harvester.pull()
+            except Exception as e:
+                self.log.error(f'Result harvest failed: {str(e)}')
+                new = []
+            if new:
                 self.log.info(
-                    f'Status: {status} | Progress: {progress}%'
+                    f'Harvested {len(new)} new results '
+                    f'({len(harvester.records)} so far)'
                 )
+                if on_results:
+                    on_results(new)
+            if done:
+                break
 
-                if status == 'Done':
-                    self.log.info('Scan completed')
-                    return True
-                elif status in ['Stopped', 'Interrupted']:
-                    self.log.error(f'Scan {status}')
-                    return False
-
-                time.sleep(SCAN_STATUS_CHECK_INTERVAL)
+        try:
+            status = future.result()
+        except Exception as e:
+            self.log.error(f'Status check failed: {str(e)}')
+            return None
 
-            except Exception as e:
-                self.log.error(f'Status check failed: {str(e)}')
-                return False
+        if status != 'Done':
+            self.log.error(f'Scan {status}')
+            return None
+        self.log.info('Scan completed')
+        return self.get_results(task_id, harvester=harvester)
 
-    def get_results(self, task_id):
+    def get_results(self, task_id, harvester=None,
+                    compact=OPENVAS_COMPACT_RESULTS):
         try:
             self.log.info('Retrieving scan results')
 
@@ -159,79 +298,129 @@ class OpenVASScanner:
             report_id = response.xpath(
                 'task/last_report/report/@id'
             )[0]
-            report = self.gmp.get_report(
-                report_id,
-                details=True
-            )
-
-            vulnerabilities = []
-            severity_counts = {
-                'critical': 0,
-                'high': 0,
-                'medium': 0,
-                'low': 0,
-                'info': 0,
-            }
 
-            for result in report.xpath('report/results/result'):
-                severity = float(
-                    result.xpath('severity/text()')[0]
+            if harvester:
+                # Only results newer than the watermark are fetched now
+                tail = harvester.pull()
+                self.log.info(f'Reconciled {len(tail)} late results')
+                records = sorted(
+                    harvester.records,
+                    key=lambda x: x['severity'],
+                    reverse=True
                 )
-
-                if severity >= 9.0:
-                    sev_level = 'critical'
-                elif severity >= 7.0:
-                    sev_level = 'high'
-                elif severity >= 4.0:
-                    sev_level = 'medium'
-                elif severity > 0:
-                    sev_level = 'low'
-                else:
-                    sev_level = 'info'
-
-                severity_counts[sev_level] += 1
-
-                vuln = {
-                    'name': result.xpath('name/text()')[0],
-                    'severity': severity,
-                    'severity_level': sev_level,
-                    'host': result.xpath('host/text()')[0],
-                    'port': result.xpath('port/text()')[0],
-                    'description': (
-                        result.xpath('description/text()')[0]
-                        if result.xpath('description/text()')
-                        else ''
-                    ),
-                }
-                vulnerabilities.append(vuln)
-
-            vulnerabilities.sort(
-                key=lambda x: x['severity'],
-                reverse=True
-            )
+            else:
+                # Pages arrive sorted by severity, highest first
+                records = self.iter_results(report_id)
+
+            if compact:
+                findings = CompactResults().extend(records)
+                severity_counts = findings.severity_distribution()
+                total = len(findings)
+                body = {'compact': findings.to_dict()}
+            else:
+                severity_counts = empty_distribution()
+                vulnerabilities = list(records)
+                for vuln in vulnerabilities:
+                    severity_counts[vuln['severity_level']] += 1
+                total = len(vulnerabilities)
+                body = {'vulnerabilities': vulnerabilities}
 
             results = {
                 'timestamp': datetime.now().isoformat(),
                 'task_id': task_id,
                 'report_id': report_id,
-                'total_vulnerabilities': len(vulnerabilities),
+                'total_vulnerabilities': total,
                 'severity_distribution': severity_counts,
-                'vulnerabilities': vulnerabilities,
+                **body,
             }
 
-            self.log.info(
-                f'Retrieved {len(vulnerabilities)} vulnerabilities'
-            )
+            self.log.info(f'Retrieved {total} vulnerabilities')
             return results
 
         except Exception as e:
             self.log.error(f'Get results failed: {str(e)}')
             return None
 
+    def iter_results(self, report_id, min_severity=None,
+                     min_qod=OPENVAS_MIN_QOD):
+        return iter_report_results(
+            self.gmp, report_id,
+            min_severity=min_severity,
+            min_qod=min_qod
+        )
+
     def save(self, results, filename):
         filepath = RESULTS_DIR / filename
-        with open(filepath, 'w') as f:
-            json.dump(results, f, indent=2)
+        if is_ndjson(filepath):
+            write_results(filepath, 'openvas', results)
+        else:
+            with open(filepath, 'w') as f:
+                json.dump(results, f, indent=2)
         self.log.info(f'Results saved to {filepath}')
+        results_store().save_openvas(results, filepath)
+        # Columnar copy for cross-report aggregation
+        ColumnarStore().add(results)
+        return filepath
+
+    def save_stream(self, task_id, filename):
+        # Findings go from the paged report straight to disk
+        filepath = RESULTS_DIR / filename
+        try:
+            report_id = self.gmp.get_task(task_id).xpath(
+                'task/last_report/report/@id'
+            )[0]
+            header = {
+                'timestamp': datetime.now().isoformat(),
+                'task_id': task_id,
+                'report_id': report_id,
+            }
+            severity_counts = empty_distribution()
+            with NdjsonWriter(filepath, 'openvas', **header) as writer:
+                for record in self.iter_results(report_id):
+                    severity_counts[record['severity_level']] += 1
+                    writer.write_finding(record)
+                writer.close(
+                    total_vulnerabilities=writer.count,
+                    severity_distribution=severity_counts
+                )
+        except Exception as e:
+            self.log.error(f'Stream results failed: {str(e)}')
+            return None
+
+        self.log.info(f'Results streamed to {filepath} ({writer.count} findings)')
+        results_store().import_file(filepath)
+        ColumnarStore().add(header, findings=iter_findings(filepath))
         return filepath
 
+
+def merge_results(results_list):
+    vulnerabilities = []
+    task_ids = []
+    report_ids = []
+    severity_counts = empty_distribution()
+
+    # Inputs may themselves be merged results (batches, distributed shards)
+    for results in results_list:
+        if 'task_ids' in results:
+            task_ids.extend(results['task_ids'])
+            report_ids.extend(results['report_ids'])
+        else:
+            task_ids.append(results['task_id'])
+            report_ids.append(results['report_id'])
+        vulnerabilities.extend(iter_vulnerabilities(results))
+        for level, count in results['severity_distribution'].items():
+            severity_counts[level] += count
+
+    vulnerabilities.sort(
+        key=lambda x: x['severity'],
+        reverse=True
+    )
+
+    return {
+        'timestamp': datetime.now().isoformat(),
+        'task_ids': task_ids,
+        'report_ids': report_ids,
+        'total_vulnerabilities': len(vulnerabilities),
+        'severity_distribution': severity_counts,
+        'vulnerabilities': vulnerabilities,
+    }
@@ -0,0 +1,159 @@
+import io
+from bisect import bisect_right
+from datetime import datetime, timedelta, timezone
+
+from lxml import etree
+
+from config import OPENVAS_REPORT_PAGE_SIZE, OPENVAS_MIN_QOD
+
+
+SEVERITY_LEVELS = ('info', 'low', 'medium', 'high', 'critical')
+
+# Lower bounds of medium, high and critical; any score above 0 is at least low
+SEVERITY_EDGES = (4.0, 7.0, 9.0)
+
+
+def severity_code(severity):
+    if severity <= 0:
+        return 0
+    return bisect_right(SEVERITY_EDGES, severity) + 1
+
+
+def severity_level(severity):
+    return SEVERITY_LEVELS[severity_code(severity)]
+
+
+def empty_distribution():
+    return {level: 0 for level in reversed(SEVERITY_LEVELS)}
+
+
+def result_record(result):
+    severity = float(result.findtext('severity') or 0)
+    nvt = result.find('nvt')
+    return {
+        'id': result.get('id'),
+        'name': result.findtext('name') or '',
+        'severity': severity,
+        'severity_level': severity_level(severity),
+        'threat': result.findtext('threat'),
+        'host': (result.findtext('host') or '').strip(),
+        'port': result.findtext('port') or '',
+        'nvt_oid': nvt.get('oid') if nvt is not None else None,
+        'cves': [
+            ref.get('id') for ref in result.iterfind('nvt/refs/ref')
+            if ref.get('type') == 'cve'
+        ],
+        'created': result.findtext('creation_time'),
+        'description': result.findtext('description') or '',
+    }
+
+
+# <result> also appears nested under <detection>; only direct children of
+# a report's <results> block or of a get_results response are findings
+FINDING_PARENTS = ('results', 'get_results_response')
+
+
+def iter_result_elements(response):
+    if isinstance(response, (str, bytes)):
+        data = response.encode() if isinstance(response, str) else response
+        for _, elem in etree.iterparse(
+                io.BytesIO(data), events=('end',), tag='result'):
+            if elem.getparent().tag not in FINDING_PARENTS:
+                continue
+            yield result_record(elem)
+            elem.clear()
+            while elem.getprevious() is not None:
+                del elem.getparent()[0]
+    else:
+        for elem in response.iter('result'):
+            if elem.getparent().tag in FINDING_PARENTS:
+                yield result_record(elem)
+
+
+def result_filter(min_severity=None, min_qod=OPENVAS_MIN_QOD, extra=''):
+    terms = [f'min_qod={min_qod}', 'apply_overrides=0', 'sort-reverse=severity']
+    if min_severity is not None:
+        # Scores have one decimal and the filter has no >=
+        terms.append(f'severity>{min_severity - 0.1:.1f}')
+    if extra:
+        terms.append(extra)
+    return ' '.join(terms)
+
+
+def iter_pages(fetch, base_filter, page_size=OPENVAS_REPORT_PAGE_SIZE):
+    first = 1
+    while True:
+        response = fetch(f'{base_filter} first={first} rows={page_size}')
+        count = 0
+        for record in iter_result_elements(response):
+            count += 1
+            yield record
+        if count < page_size:
+            return
+        first += page_size
+
+
+def iter_report_results(gmp, report_id, page_size=OPENVAS_REPORT_PAGE_SIZE,
+                        min_severity=None, min_qod=OPENVAS_MIN_QOD):
+    return iter_pages(
+        lambda filter_string: gmp.get_report(
+            report_id,
+            filter_string=filter_string,
+            details=True,
+            ignore_pagination=False
+        ),
+        result_filter(min_severity, min_qod),
+        page_size
+    )
+
+
+def iter_task_results(gmp, task_id, since=None,
+                      page_size=OPENVAS_REPORT_PAGE_SIZE,
+                      min_qod=OPENVAS_MIN_QOD):
+    extra = 'sort=created'
+    if since:
+        # One second of overlap: the filter is strict and second-granular,
+        # callers dedupe on result ID
+        start = datetime.fromisoformat(since) - timedelta(seconds=1)
+        stamp = start.strftime('%Y-%m-%dT%H:%M:%S')
+        if start.tzinfo:
+            stamp = start.astimezone(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+        extra = f'created>{stamp} {extra}'
+    return iter_pages(
+        lambda filter_string: gmp.get_results(
+            task_id=task_id,
+            filter_string=filter_string,
+            details=True
+        ),
+        f'min_qod={min_qod} apply_overrides=0 {extra}',
+        page_size
+    )
+
+
+class ResultHarvester:
+    def __init__(self, gmp, task_id, min_qod=OPENVAS_MIN_QOD):
+        self.gmp = gmp
+        self.task_id = task_id
+        self.min_qod = min_qod
+        self.watermark = None
+        self.seen = set()
+        self.records = []
+
+    def _accept(self, record):
+        if record['id'] in self.seen:
+            return False
+        self.seen.add(record['id'])
+        self.records.append(record)
+        return True
+
+    def pull(self):
+        new = []
+        for record in iter_task_results(
+                self.gmp, self.task_id, since=self.watermark,
+                min_qod=self.min_qod):
+            if self._accept(record):
+                new.append(record)
+            created = record['created']
+            if created and (self.watermark is None or created > self.watermark):
+                self.watermark = created
+        return new
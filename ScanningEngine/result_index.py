@@ -0,0 +1,276 @@
+import json
+import mmap
+import os
+import re
+import sys
+
+from ndjson_io import is_ndjson
+
+INDEX_VERSION = 1
+WHITESPACE = re.compile(rb'[ \t\n\r]*')
+STRUCTURE = re.compile(rb'[{}\[\]"]')
+STRING_BODY = re.compile(rb'[^"\\]*(?:\\.[^"\\]*)*"', re.DOTALL)
+SCALAR_END = re.compile(rb'[,}\] \t\n\r]')
+WINDOW = 1 << 20
+
+
+def index_path(path):
+    # Not a RESULT_SUFFIXES name, so result-file listings never pick it up
+    return f'{path}.idx'
+
+
+def _file_stamp(path):
+    stat = os.stat(path)
+    return {'size': stat.st_size, 'mtime': stat.st_mtime}
+
+
+def _index_ndjson(path):
+    hosts = {}
+    findings = {}
+    offset = 0
+    with open(path, 'rb') as f:
+        for line in f:
+            length = len(line.rstrip(b'\r\n'))
+            if length:
+                record = json.loads(line)
+                if record['type'] == 'host':
+                    hosts[record['ip']] = [offset, length, record.get('state')]
+                elif record['type'] == 'finding':
+                    findings.setdefault(record['host'], []).append([offset, length])
+            offset += len(line)
+    return hosts, findings
+
+
+def _skip(buf, pos, expected=None):
+    pos = WHITESPACE.match(buf, pos).end()
+    if expected is not None:
+        if buf[pos:pos + 1] != expected:
+            raise ValueError(f'Expected {expected!r} at offset {pos}')
+        pos = WHITESPACE.match(buf, pos + 1).end()
+    return pos
+
+
+def _next(buf, pos, close):
+    # Past the separator after a member; pos ends on the next member or close
+    pos = _skip(buf, pos)
+    return _skip(buf, pos, b',') if buf[pos:pos + 1] != close else pos
+
+
+def _value_end(buf, pos):
+    # End offset of the JSON value at pos, found by jumping between
+    # brackets and quotes rather than decoding it
+    first = buf[pos:pos + 1]
+    if first == b'"':
+        return STRING_BODY.match(buf, pos + 1).end()
+    if first not in (b'{', b'['):
+        match = SCALAR_END.search(buf, pos)
+        return match.start() if match else len(buf)
+
+    depth = 0
+    while True:
+        match = STRUCTURE.search(buf, pos)
+        if match is None:
+            raise ValueError(f'Unterminated value at offset {pos}')
+        if match.group() == b'"':
+            pos = STRING_BODY.match(buf, match.end()).end()
+            continue
+        pos = match.end()
+        if match.group() in (b'{', b'['):
+            depth += 1
+        else:
+            depth -= 1
+            if depth == 0:
+                return pos
+
+
+class _Window:
+    # A sliding latin-1 view of the mapped file: latin-1 maps bytes to
+    # characters one to one, so raw_decode offsets are file offsets. Only
+    # ASCII fields (ips, states) are taken from records decoded this way
+    def __init__(self, buf):
+        self.buf = buf
+        self.start = 0
+        self.text = ''
+        self.decode = json.JSONDecoder().raw_decode
+
+    def decode_at(self, pos):
+        if pos >= len(self.buf):
+            raise ValueError(f'Unexpected end of document at offset {pos}')
+        while True:
+            offset = pos - self.start
+            inside = 0 <= offset < len(self.text)
+            if inside:
+                try:
+                    value, end = self.decode(self.text, offset)
+                    return value, self.start + end
+                except ValueError:
+                    if self.start + len(self.text) >= len(self.buf):
+                        raise
+            # The value runs past the window: reload from pos, growing the
+            # window when one value is larger than it
+            size = 2 * len(self.text) if inside and offset == 0 else WINDOW
+            self.start = pos
+            self.text = self.buf[pos:pos + max(size, WINDOW)].decode('latin-1')
+
+
+def _index_json(path):
+    # Walks the mapped file; only one host or finding record is decoded at
+    # a time, so memory stays flat however large the document is
+    with open(path, 'rb') as f, \
+            mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+        window = _Window(buf)
+        hosts = {}
+        findings = {}
+
+        pos = _skip(buf, 0, b'{')
+        while buf[pos:pos + 1] != b'}':
+            key, pos = window.decode_at(pos)
+            pos = _skip(buf, pos, b':')
+
+            if key == 'hosts' and buf[pos:pos + 1] == b'{':
+                pos = _skip(buf, pos, b'{')
+                while buf[pos:pos + 1] != b'}':
+                    ip, pos = window.decode_at(pos)
+                    start = _skip(buf, pos, b':')
+                    host, pos = window.decode_at(start)
+                    hosts[ip] = [start, pos - start, host.get('state')]
+                    pos = _next(buf, pos, b'}')
+                pos += 1
+            elif key == 'vulnerabilities' and buf[pos:pos + 1] == b'[':
+                pos = _skip(buf, pos, b'[')
+                while buf[pos:pos + 1] != b']':
+                    record, end = window.decode_at(pos)
+                    findings.setdefault(record['host'], []).append(
+                        [pos, end - pos]
+                    )
+                    pos = _next(buf, end, b']')
+                pos += 1
+            else:
+                pos = _value_end(buf, pos)
+
+            pos = _next(buf, pos, b'}')
+        return hosts, findings
+
+
+def build_index(path, persist=True):
+    if str(path).endswith('.gz'):
+        raise ValueError(f'{path} is compressed and cannot be indexed')
+
+    stamp = _file_stamp(path)
+    hosts, findings = (
+        _index_ndjson(path) if is_ndjson(path) else _index_json(path)
+    )
+    index = {
+        'version': INDEX_VERSION,
+        'format': 'ndjson' if is_ndjson(path) else 'json',
+        'source': stamp,
+        'hosts': hosts,
+        'findings': findings,
+    }
+    if persist:
+        # The sidecar is only a cache; a read-only results directory just
+        # means the next reader indexes again
+        tmp_path = f'{index_path(path)}.tmp'
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump(index, f)
+            os.replace(tmp_path, index_path(path))
+        except OSError:
+            pass
+    return index
+
+
+def load_index(path, persist=True):
+    # Rebuilt whenever the result file changed since it was indexed
+    try:
+        with open(index_path(path)) as f:
+            index = json.load(f)
+        if (index.get('version') == INDEX_VERSION
+                and index.get('source') == _file_stamp(path)):
+            return index
+    except (OSError, ValueError):
+        pass
+    return build_index(path, persist)
+
+
+class ResultReader:
+    def __init__(self, path):
+        self.path = path
+        self.index = load_index(path)
+        self._ndjson = self.index['format'] == 'ndjson'
+        self._file = open(path, 'rb')
+        size = os.fstat(self._file.fileno()).st_size
+        self._map = (
+            mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            if size else None
+        )
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def _decode(self, offset, length):
+        record = json.loads(self._map[offset:offset + length])
+        if self._ndjson:
+            record.pop('type', None)
+        return record
+
+    def hosts(self):
+        return list(self.index['hosts'])
+
+    def alive_hosts(self):
+        return [
+            ip for ip, (_, _, state) in self.index['hosts'].items()
+            if state == 'up'
+        ]
+
+    def host(self, ip):
+        entry = self.index['hosts'].get(ip)
+        if entry is None:
+            return None
+        record = self._decode(entry[0], entry[1])
+        if self._ndjson:
+            record.pop('ip', None)
+        return record
+
+    def findings(self, ip):
+        return [
+            self._decode(offset, length)
+            for offset, length in self.index['findings'].get(ip, [])
+        ]
+
+
+def alive_hosts(path, persist=True):
+    return [
+        ip for ip, (_, _, state) in load_index(path, persist)['hosts'].items()
+        if state == 'up'
+    ]
+
+
+def main():
+    if len(sys.argv) < 2:
+        print('Usage: python result_index.py <result file> [host ...]')
+        sys.exit(1)
+
+    path, hosts = sys.argv[1], sys.argv[2:]
+    with ResultReader(path) as reader:
+        if not hosts:
+            print(json.dumps(reader.alive_hosts()))
+            return
+        for ip in hosts:
+            print(json.dumps({
+                'host': ip,
+                'record': reader.host(ip),
+                'findings': reader.findings(ip),
+            }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
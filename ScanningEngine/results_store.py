@@ -0,0 +1,354 @@
+import json
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+from compact_results import iter_vulnerabilities
+from config import RESULTS_DB
+from logger import ScanLogger
+from ndjson_io import is_ndjson, read_header, iter_hosts, iter_findings
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS scans (
+    id INTEGER PRIMARY KEY,
+    kind TEXT NOT NULL,
+    target TEXT,
+    timestamp TEXT NOT NULL,
+    file TEXT,
+    task_id TEXT,
+    report_id TEXT,
+    meta TEXT
+);
+CREATE TABLE IF NOT EXISTS hosts (
+    scan_id INTEGER NOT NULL REFERENCES scans(id) ON DELETE CASCADE,
+    ip TEXT NOT NULL,
+    hostname TEXT,
+    state TEXT,
+    scanned_at TEXT,
+    cached INTEGER,
+    PRIMARY KEY (scan_id, ip)
+);
+CREATE TABLE IF NOT EXISTS services (
+    scan_id INTEGER NOT NULL REFERENCES scans(id) ON DELETE CASCADE,
+    ip TEXT NOT NULL,
+    port INTEGER NOT NULL,
+    protocol TEXT NOT NULL,
+    state TEXT,
+    service TEXT,
+    product TEXT,
+    version TEXT
+);
+CREATE TABLE IF NOT EXISTS findings (
+    scan_id INTEGER NOT NULL REFERENCES scans(id) ON DELETE CASCADE,
+    result_id TEXT,
+    ip TEXT NOT NULL,
+    port TEXT,
+    nvt_oid TEXT,
+    name TEXT,
+    severity REAL NOT NULL,
+    severity_level TEXT NOT NULL,
+    cves TEXT,
+    description TEXT
+);
+CREATE INDEX IF NOT EXISTS scans_kind_target ON scans (kind, target, id);
+CREATE INDEX IF NOT EXISTS hosts_ip ON hosts (ip, scan_id);
+CREATE INDEX IF NOT EXISTS services_scan_ip ON services (scan_id, ip);
+CREATE INDEX IF NOT EXISTS services_port ON services (port, protocol, state);
+CREATE INDEX IF NOT EXISTS findings_scan ON findings (scan_id, severity);
+CREATE INDEX IF NOT EXISTS findings_ip ON findings (ip, scan_id);
+CREATE INDEX IF NOT EXISTS findings_nvt ON findings (nvt_oid);
+'''
+
+# Hosts per executemany when storing streamed nmap results
+INSERT_BATCH = 1000
+
+# Everything get_results()/scan() put next to the records themselves
+NMAP_META_SKIP = ('timestamp', 'target', 'hosts')
+OPENVAS_META_SKIP = (
+    'timestamp', 'task_id', 'report_id', 'vulnerabilities', 'compact'
+)
+
+
+class ResultsStore:
+    def __init__(self, path=RESULTS_DB):
+        self.path = path
+        self.log = ScanLogger('results-store')
+        self._local = threading.local()
+        with self.transaction() as db:
+            db.executescript(SCHEMA)
+
+    def connection(self):
+        # sqlite3 connections are per thread; WAL lets readers run alongside
+        # the writer
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=30)
+            db.row_factory = sqlite3.Row
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            db.execute('PRAGMA foreign_keys=ON')
+            self._local.db = db
+        return db
+
+    @contextmanager
+    def transaction(self):
+        db = self.connection()
+        with db:
+            yield db
+
+    def close(self):
+        db = getattr(self._local, 'db', None)
+        if db is not None:
+            db.close()
+            self._local.db = None
+
+    def _insert_scan(self, db, kind, results, filepath, skip):
+        meta = {k: v for k, v in results.items() if k not in skip}
+        return db.execute(
+            'INSERT INTO scans (kind, target, timestamp, file, task_id, '
+            'report_id, meta) VALUES (?, ?, ?, ?, ?, ?, ?)',
+            (
+                kind,
+                results.get('target'),
+                results['timestamp'],
+                str(filepath) if filepath else None,
+                results.get('task_id'),
+                results.get('report_id'),
+                json.dumps(meta),
+            )
+        ).lastrowid
+
+    def save_nmap(self, results, filepath=None, hosts=None):
+        # hosts may be any (ip, host_data) iterable, e.g. a streamed file
+        if hosts is None:
+            hosts = results['hosts'].items()
+        try:
+            with self.transaction() as db:
+                scan_id = self._insert_scan(
+                    db, 'nmap', results, filepath, NMAP_META_SKIP
+                )
+                count = 0
+                host_rows = []
+                service_rows = []
+                for ip, host in hosts:
+                    count += 1
+                    # Incremental scans need each host's own scan time back
+                    cached = host.get('cached')
+                    host_rows.append((
+                        scan_id, ip, host.get('hostname'), host.get('state'),
+                        host.get('scanned_at'),
+                        None if cached is None else int(cached)
+                    ))
+                    service_rows.extend(
+                        (
+                            scan_id, ip, svc['port'], svc['protocol'],
+                            svc.get('state'), svc.get('service'),
+                            svc.get('product'), svc.get('version')
+                        )
+                        for svc in host.get('services', [])
+                    )
+                    if len(host_rows) >= INSERT_BATCH:
+                        self._insert_hosts(db, host_rows, service_rows)
+                        host_rows, service_rows = [], []
+                self._insert_hosts(db, host_rows, service_rows)
+            self.log.info(f'Stored nmap scan {scan_id} ({count} hosts)')
+            return scan_id
+        except Exception as e:
+            self.log.error(f'Store nmap results failed: {str(e)}')
+            return None
+
+    def _insert_hosts(self, db, host_rows, service_rows):
+        db.executemany(
+            'INSERT INTO hosts (scan_id, ip, hostname, state, scanned_at, '
+            'cached) VALUES (?, ?, ?, ?, ?, ?)',
+            host_rows
+        )
+        db.executemany(
+            'INSERT INTO services VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+            service_rows
+        )
+
+    def save_openvas(self, results, filepath=None, findings=None):
+        if findings is None:
+            findings = iter_vulnerabilities(results)
+        try:
+            with self.transaction() as db:
+                scan_id = self._insert_scan(
+                    db, 'openvas', results, filepath, OPENVAS_META_SKIP
+                )
+                if 'report_ids' in results:
+                    db.execute(
+                        'UPDATE scans SET report_id = ? WHERE id = ?',
+                        (','.join(results['report_ids']), scan_id)
+                    )
+                db.executemany(
+                    'INSERT INTO findings VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                    (
+                        (
+                            scan_id, v.get('id'), v['host'], v['port'],
+                            v.get('nvt_oid'), v['name'], v['severity'],
+                            v['severity_level'], json.dumps(v.get('cves', [])),
+                            v['description']
+                        )
+                        for v in findings
+                    )
+                )
+            self.log.info(f'Stored openvas scan {scan_id}')
+            return scan_id
+        except Exception as e:
+            self.log.error(f'Store openvas results failed: {str(e)}')
+            return None
+
+    def latest_scan(self, kind, target=None):
+        if target is None:
+            return self.connection().execute(
+                'SELECT * FROM scans WHERE kind = ? ORDER BY id DESC LIMIT 1',
+                (kind,)
+            ).fetchone()
+        return self.connection().execute(
+            'SELECT * FROM scans WHERE kind = ? AND target = ? '
+            'ORDER BY id DESC LIMIT 1',
+            (kind, target)
+        ).fetchone()
+
+    def latest_alive_hosts(self, target=None):
+        scan = self.latest_scan('nmap', target)
+        if scan is None:
+            return []
+        return [
+            row['ip'] for row in self.connection().execute(
+                "SELECT ip FROM hosts WHERE scan_id = ? AND state = 'up'",
+                (scan['id'],)
+            )
+        ]
+
+    def hosts_with_port(self, port, protocol='tcp', state='open'):
+        # Judged by each host's most recent nmap observation
+        return [
+            row['ip'] for row in self.connection().execute(
+                'SELECT s.ip FROM services s '
+                'JOIN (SELECT ip, MAX(scan_id) AS scan_id FROM hosts '
+                '      GROUP BY ip) latest '
+                'ON s.ip = latest.ip AND s.scan_id = latest.scan_id '
+                'WHERE s.port = ? AND s.protocol = ? AND s.state = ? '
+                'ORDER BY s.ip',
+                (port, protocol, state)
+            )
+        ]
+
+    def open_services(self, hosts):
+        # Open ports from each host's most recent nmap observation, one query
+        # per chunk of hosts to stay under SQLite's variable limit
+        hosts = list(hosts)
+        services = []
+        db = self.connection()
+        for i in range(0, len(hosts), INSERT_BATCH):
+            chunk = hosts[i:i + INSERT_BATCH]
+            marks = ','.join('?' * len(chunk))
+            services.extend(
+                {'port': row['port'], 'protocol': row['protocol'],
+                 'state': row['state']}
+                for row in db.execute(
+                    'SELECT s.port, s.protocol, s.state FROM services s '
+                    'JOIN (SELECT ip, MAX(scan_id) AS scan_id FROM hosts '
+                    f'      WHERE ip IN ({marks}) GROUP BY ip) latest '
+                    'ON s.ip = latest.ip AND s.scan_id = latest.scan_id '
+                    "WHERE s.state = 'open'",
+                    chunk
+                )
+            )
+        return services
+
+    def host_findings(self, ip, min_severity=None):
+        scan = self.connection().execute(
+            'SELECT MAX(scan_id) AS scan_id FROM findings WHERE ip = ?', (ip,)
+        ).fetchone()
+        if scan['scan_id'] is None:
+            return []
+        rows = self.connection().execute(
+            'SELECT * FROM findings WHERE scan_id = ? AND ip = ? '
+            'AND severity >= ? ORDER BY severity DESC',
+            (scan['scan_id'], ip, min_severity or 0)
+        )
+        return [self._finding(row) for row in rows]
+
+    def load_nmap(self, scan_id):
+        db = self.connection()
+        scan = db.execute(
+            "SELECT * FROM scans WHERE id = ? AND kind = 'nmap'", (scan_id,)
+        ).fetchone()
+        if scan is None:
+            return None
+
+        results = {'timestamp': scan['timestamp'], 'target': scan['target']}
+        results.update(json.loads(scan['meta'] or '{}'))
+        results['hosts'] = {}
+        for row in db.execute(
+                'SELECT * FROM hosts WHERE scan_id = ?', (scan_id,)):
+            host = {
+                'hostname': row['hostname'],
+                'state': row['state'],
+                'services': [],
+            }
+            if row['scanned_at'] is not None:
+                host['scanned_at'] = row['scanned_at']
+            if row['cached'] is not None:
+                host['cached'] = bool(row['cached'])
+            results['hosts'][row['ip']] = host
+        for row in db.execute(
+                'SELECT * FROM services WHERE scan_id = ? ORDER BY rowid',
+                (scan_id,)):
+            results['hosts'][row['ip']]['services'].append({
+                'port': row['port'],
+                'protocol': row['protocol'],
+                'state': row['state'],
+                'service': row['service'],
+                'product': row['product'],
+                'version': row['version'],
+            })
+        return results
+
+    def latest_nmap(self, target=None):
+        scan = self.latest_scan('nmap', target)
+        return self.load_nmap(scan['id']) if scan else None
+
+    def import_file(self, filepath):
+        try:
+            header = read_header(filepath)
+        except (OSError, ValueError) as e:
+            self.log.warning(f'Skipping unreadable {filepath}: {str(e)}')
+            return None
+        if not is_ndjson(filepath):
+            if 'hosts' in header:
+                return self.save_nmap(header, filepath)
+            return self.save_openvas(header, filepath)
+
+        # NDJSON records go straight from the file into the insert
+        if header.pop('kind', None) == 'nmap':
+            return self.save_nmap(header, filepath, iter_hosts(filepath))
+        return self.save_openvas(header, filepath, iter_findings(filepath))
+
+    def _finding(self, row):
+        return {
+            'id': row['result_id'],
+            'name': row['name'],
+            'severity': row['severity'],
+            'severity_level': row['severity_level'],
+            'host': row['ip'],
+            'port': row['port'],
+            'nvt_oid': row['nvt_oid'],
+            'cves': json.loads(row['cves'] or '[]'),
+            'description': row['description'],
+        }
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def results_store():
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = ResultsStore()
+        return _store
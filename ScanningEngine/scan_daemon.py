@@ -0,0 +1,298 @@
+import argparse
+import json
+import signal
+import threading
+from concurrent.futures import wait
+from datetime import datetime
+
+from config import (
+    DAEMON_NMAP_WORKERS,
+    DAEMON_OPENVAS_WORKERS,
+    DAEMON_POLL_INTERVAL,
+    OPENVAS_NMAP_PORT_LIST,
+    RESULTS_FORMAT,
+)
+from job_queue import JobQueue
+from logger import ScanLogger
+from ndjson_io import load_results
+from nmap_scanner import NmapScanner, open_services
+from openvas_scanner import OpenVASScanner, openvas_pool
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class DaemonStopping(Exception):
+    pass
+
+
+class ScanDaemon:
+    def __init__(self, queue=None, nmap_workers=DAEMON_NMAP_WORKERS,
+                 openvas_workers=DAEMON_OPENVAS_WORKERS,
+                 poll_interval=DAEMON_POLL_INTERVAL):
+        self.queue = queue or JobQueue()
+        self.nmap_workers = nmap_workers
+        self.openvas_workers = openvas_workers
+        self.poll_interval = poll_interval
+        self.pool = openvas_pool()
+        self.log = ScanLogger('daemon', 'scan_daemon.log')
+        self._stop = threading.Event()
+
+    def run(self):
+        requeued = self.queue.requeue_running()
+        if requeued:
+            self.log.warning(f'Requeued {requeued} jobs from a previous run')
+
+        # Each stage has its own bounded pool, so a long OpenVAS task never
+        # holds up discovery on the next target
+        threads = [
+            threading.Thread(
+                target=self._worker, args=(stage, handler, f'{stage}-{i}'),
+                name=f'{stage}-{i}', daemon=True
+            )
+            for stage, handler, count in (
+                ('nmap', self._run_nmap, self.nmap_workers),
+                ('openvas', self._run_openvas, self.openvas_workers),
+            )
+            for i in range(count)
+        ]
+        for thread in threads:
+            thread.start()
+        self.log.info(
+            f'Daemon started with {self.nmap_workers} nmap and '
+            f'{self.openvas_workers} openvas workers'
+        )
+
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, lambda *_: self.stop())
+        while not self._stop.is_set():
+            self._stop.wait(1)
+
+        for thread in threads:
+            thread.join()
+        self.pool.close()
+        self.log.info('Daemon stopped')
+
+    def stop(self):
+        self.log.info(
+            'Stopping; nmap jobs finish, OpenVAS jobs resume on restart'
+        )
+        self._stop.set()
+
+    def _worker(self, stage, handler, name):
+        while not self._stop.is_set():
+            try:
+                job = self.queue.claim(stage, name)
+            except Exception as e:
+                self.log.error(f'Job claim failed: {str(e)}')
+                job = None
+            if job is None:
+                self._stop.wait(self.poll_interval)
+                continue
+
+            self.log.info(f'[{name}] job {job["id"]} {stage} on {job["target"]}')
+            try:
+                handler(job)
+            except DaemonStopping:
+                # Left running; requeue_running hands it back on restart and
+                # the saved task_id reattaches to the OpenVAS task
+                self.log.info(
+                    f'[{name}] job {job["id"]} left for the next daemon run'
+                )
+            except JobCancelled:
+                self._finish(name, job, self.queue.mark_cancelled, job['id'])
+                self.log.info(f'[{name}] job {job["id"]} cancelled')
+            except Exception as e:
+                self._finish(name, job, self.queue.fail, job['id'], str(e))
+                self.log.error(f'[{name}] job {job["id"]} failed: {str(e)}')
+
+    def _finish(self, name, job, record, *args):
+        # A locked database must not take the worker thread down with it
+        try:
+            record(*args)
+        except Exception as e:
+            self.log.error(
+                f'[{name}] recording job {job["id"]} outcome failed: {str(e)}'
+            )
+
+    def _check_cancel(self, job):
+        if self.queue.cancel_requested(job['id']):
+            raise JobCancelled()
+
+    def _filename(self, prefix, job):
+        stamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        return f'{prefix}_{stamp}_job{job["id"]}.{RESULTS_FORMAT}'
+
+    def _run_nmap(self, job):
+        # python-nmap keeps per-scan state on the PortScanner; one per job
+        nmap = NmapScanner()
+        target = job['target']
+        if job['options'].get('incremental'):
+            results = nmap.scan_incremental(target, nmap.latest_results(target))
+        else:
+            results = nmap.scan(target)
+        if not results:
+            raise RuntimeError('NMAP scan failed')
+        self._check_cancel(job)
+
+        filepath = nmap.save(results, self._filename('nmap', job))
+        alive = [
+            ip for ip, host in results['hosts'].items() if host['state'] == 'up'
+        ]
+        summary = {'nmap_file': str(filepath), 'alive_hosts': len(alive)}
+        if job['options'].get('nmap_only') or not alive:
+            self.queue.complete(job['id'], **summary)
+        else:
+            self.queue.advance(job['id'], 'openvas', **summary)
+
+    def _run_openvas(self, job):
+        nmap_results = load_results(job['result']['nmap_file'])
+        alive = [
+            ip for ip, host in nmap_results['hosts'].items()
+            if host['state'] == 'up'
+        ]
+        openvas = OpenVASScanner(self.pool)
+
+        # A restarted job reattaches to the task it already started
+        task_id = job['result'].get('task_id')
+        if not task_id:
+            task_id = self._start_openvas(openvas, job, alive, nmap_results)
+            self.queue.update(job['id'], task_id=task_id)
+
+        # No session is held while waiting; the shared poller needs them
+        future = openvas.poller.track(task_id)
+        while True:
+            done, _ = wait([future], timeout=self.poll_interval)
+            if done:
+                break
+            if self.queue.cancel_requested(job['id']):
+                self._stop_task(openvas, task_id)
+                openvas.poller.untrack(task_id)
+                raise JobCancelled()
+            if self._stop.is_set():
+                # The task keeps running in gvmd; only our wait ends here
+                openvas.poller.untrack(task_id)
+                raise DaemonStopping()
+
+        status = future.result()
+        if status != 'Done':
+            raise RuntimeError(f'OpenVAS task {status}')
+
+        if not openvas.connect():
+            raise RuntimeError('OpenVAS connection failed')
+        try:
+            results = openvas.get_results(task_id)
+            if not results:
+                raise RuntimeError('Get results failed')
+            filepath = openvas.save(results, self._filename('openvas', job))
+        finally:
+            openvas.disconnect()
+
+        self.queue.complete(
+            job['id'],
+            openvas_file=str(filepath),
+            total_vulnerabilities=results['total_vulnerabilities'],
+            severity_distribution=results['severity_distribution']
+        )
+
+    def _start_openvas(self, openvas, job, alive, nmap_results):
+        if not openvas.connect():
+            raise RuntimeError('OpenVAS connection failed')
+        try:
+            services = None
+            if OPENVAS_NMAP_PORT_LIST:
+                services = open_services(nmap_results, alive)
+            target_id = openvas.get_or_create_target(alive, services=services)
+            config_id = openvas.get_config_id()
+            scanner_id = openvas.get_scanner_id()
+            if not (target_id and config_id and scanner_id):
+                raise RuntimeError('OpenVAS target or catalogue lookup failed')
+
+            task_id = openvas.create_task(
+                f'job{job["id"]}_{datetime.now().strftime("%Y%m%d_%H%M%S")}',
+                target_id, config_id, scanner_id,
+                hosts=alive, services=services
+            )
+            if not task_id or not openvas.start_task(task_id):
+                raise RuntimeError('OpenVAS task start failed')
+            return task_id
+        finally:
+            openvas.disconnect()
+
+    def _stop_task(self, openvas, task_id):
+        try:
+            with self.pool.session() as gmp:
+                gmp.stop_task(task_id)
+        except Exception as e:
+            self.log.error(f'Stop task {task_id} failed: {str(e)}')
+
+
+def print_job(job):
+    print(
+        f'{job["id"]:>5}  {job["status"]:<9}  {job["stage"]:<7}  '
+        f'p{job["priority"]:<3}  {job["target"]}'
+        + (f'  ({job["error"]})' if job['error'] else '')
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Queued scan daemon')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    daemon = commands.add_parser('daemon', help='run the worker pools')
+    daemon.add_argument('--nmap-workers', type=int, default=DAEMON_NMAP_WORKERS)
+    daemon.add_argument(
+        '--openvas-workers', type=int, default=DAEMON_OPENVAS_WORKERS
+    )
+
+    submit = commands.add_parser('submit', help='queue targets')
+    submit.add_argument('targets', nargs='+')
+    submit.add_argument('--priority', type=int, default=0)
+    submit.add_argument('--incremental', action='store_true')
+    submit.add_argument('--nmap-only', action='store_true')
+
+    cancel = commands.add_parser('cancel', help='cancel jobs')
+    cancel.add_argument('job_ids', type=int, nargs='+')
+
+    status = commands.add_parser('status', help='show jobs')
+    status.add_argument('job_id', type=int, nargs='?')
+    status.add_argument('--state', dest='status')
+    status.add_argument('--limit', type=int, default=50)
+
+    args = parser.parse_args()
+    queue = JobQueue()
+
+    if args.command == 'daemon':
+        ScanDaemon(queue, args.nmap_workers, args.openvas_workers).run()
+
+    elif args.command == 'submit':
+        for target in args.targets:
+            job_id = queue.submit(
+                target, args.priority,
+                incremental=args.incremental, nmap_only=args.nmap_only
+            )
+            print(f'Queued job {job_id}: {target}')
+
+    elif args.command == 'cancel':
+        for job_id in args.job_ids:
+            if queue.cancel(job_id):
+                print(f'Cancelled job {job_id}')
+            else:
+                print(f'Job {job_id} not found or already finished')
+
+    elif args.command == 'status':
+        if args.job_id is not None:
+            job = queue.get(args.job_id)
+            if job is None:
+                print(f'Job {args.job_id} not found')
+                return
+            print(json.dumps(job, indent=2))
+            return
+        for job in reversed(queue.jobs(args.status, args.limit)):
+            print_job(job)
+        print(', '.join(f'{k}={v}' for k, v in sorted(queue.counts().items())))
+
+
+if __name__ == '__main__':
+    main()
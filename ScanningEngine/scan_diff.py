@@ -0,0 +1,181 @@
+import hashlib
+import json
+import sys
+from collections import Counter
+from pathlib import Path
+
+from config import RESULTS_DIR
+from ndjson_io import is_ndjson, is_result_file, iter_hosts, iter_findings
+
+SERVICE_FIELDS = ('service', 'product', 'version')
+
+
+def record_key(*parts):
+    # 16-byte digests keep the per-record dict entries small on big scans
+    return hashlib.blake2b(
+        '\x1f'.join(str(p) for p in parts).encode(), digest_size=16
+    ).digest()
+
+
+def service_key(host, service):
+    return record_key(host, service['protocol'], service['port'])
+
+
+def finding_key(finding):
+    return record_key(
+        finding['host'], finding['port'],
+        finding.get('nvt_oid') or finding['name']
+    )
+
+
+def _service_change(change, host, service, **extra):
+    return {
+        'change': change,
+        'host': host,
+        'protocol': service['protocol'],
+        'port': service['port'],
+        **{field: service.get(field) for field in SERVICE_FIELDS},
+        **extra,
+    }
+
+
+def _is_open(service):
+    return service.get('state') == 'open'
+
+
+def diff_nmap(old_hosts, new_hosts):
+    # old_hosts/new_hosts are (ip, host_data) iterables; only the old side
+    # is held in memory, the new side is compared as it streams past
+    old_states = {}
+    old_services = {}
+    for ip, host in old_hosts:
+        old_states[ip] = host.get('state')
+        for service in host.get('services', []):
+            old_services[service_key(ip, service)] = (ip, service)
+
+    seen = set()
+    for ip, host in new_hosts:
+        seen.add(ip)
+        state = host.get('state')
+        if ip not in old_states:
+            yield {'change': 'host_added', 'host': ip, 'state': state}
+        elif old_states[ip] != state:
+            yield {
+                'change': 'host_state_changed', 'host': ip,
+                'old_state': old_states[ip], 'state': state,
+            }
+
+        for service in host.get('services', []):
+            old = old_services.pop(service_key(ip, service), None)
+            if old is None:
+                if _is_open(service):
+                    yield _service_change('port_opened', ip, service)
+                continue
+
+            old_service = old[1]
+            if _is_open(service) and not _is_open(old_service):
+                yield _service_change('port_opened', ip, service)
+            elif _is_open(old_service) and not _is_open(service):
+                yield _service_change(
+                    'port_closed', ip, old_service, state=service.get('state')
+                )
+            elif _is_open(service):
+                changed = {
+                    field: {'old': old_service.get(field), 'new': service.get(field)}
+                    for field in SERVICE_FIELDS
+                    if old_service.get(field) != service.get(field)
+                }
+                if changed:
+                    yield _service_change(
+                        'service_changed', ip, service, fields=changed
+                    )
+
+    for ip, state in old_states.items():
+        if ip not in seen:
+            yield {'change': 'host_removed', 'host': ip, 'old_state': state}
+
+    # Ports missing from a host that is still there; a removed host's ports
+    # are covered by its host_removed record
+    for ip, service in old_services.values():
+        if ip in seen and _is_open(service):
+            yield _service_change('port_closed', ip, service, state=None)
+
+
+def diff_openvas(old_findings, new_findings):
+    old = {finding_key(f): f for f in old_findings}
+
+    for finding in new_findings:
+        previous = old.pop(finding_key(finding), None)
+        if previous is None:
+            yield {'change': 'finding_new', **finding}
+        elif previous['severity'] != finding['severity']:
+            yield {
+                'change': 'finding_severity_changed',
+                'old_severity': previous['severity'],
+                **finding,
+            }
+
+    for finding in old.values():
+        yield {'change': 'finding_fixed', **finding}
+
+
+def file_kind(path):
+    name = Path(path).name
+    if name.startswith('nmap_'):
+        return 'nmap'
+    if name.startswith('openvas_'):
+        return 'openvas'
+    if is_ndjson(path):
+        with open(path, 'rb') as f:
+            header = f.readline()
+        if b'"kind":"nmap"' in header:
+            return 'nmap'
+    return 'openvas'
+
+
+def diff_files(old_path, new_path):
+    kind = file_kind(new_path)
+    if kind == 'nmap':
+        return diff_nmap(iter_hosts(old_path), iter_hosts(new_path))
+    return diff_openvas(iter_findings(old_path), iter_findings(new_path))
+
+
+def latest_pair(prefix):
+    files = sorted(
+        f for f in RESULTS_DIR.glob(f'{prefix}_*') if is_result_file(f)
+    )
+    if len(files) < 2:
+        return None
+    return files[-2], files[-1]
+
+
+def main():
+    args = sys.argv[1:]
+    if len(args) == 2 and args[0] == '--latest':
+        pair = latest_pair(args[1])
+        if not pair:
+            print(f'Need two {args[1]} result files to compare', file=sys.stderr)
+            sys.exit(1)
+    elif len(args) == 2:
+        pair = args
+    else:
+        print('Usage: python scan_diff.py OLD NEW | --latest nmap|openvas',
+              file=sys.stderr)
+        sys.exit(1)
+
+    counts = Counter()
+    try:
+        for change in diff_files(*pair):
+            counts[change['change']] += 1
+            print(json.dumps(change))
+    except (OSError, ValueError) as e:
+        print(f'✗ Cannot compare {pair[0]} and {pair[1]}: {e}', file=sys.stderr)
+        sys.exit(1)
+
+    print(f'{pair[0]} -> {pair[1]}', file=sys.stderr)
+    for change, count in sorted(counts.items()):
+        print(f'  {change}: {count}', file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
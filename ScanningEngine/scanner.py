@@ -1,8 +1,22 @@
+import queue
+import threading
+import time
 from datetime import datetime
 
+from config import (
+    NMAP_PROFILE,
+    OPENVAS_BATCH_SIZE,
+    OPENVAS_NMAP_PORT_LIST,
+    PIPELINE_BATCH_WINDOW,
+    PIPELINE_NMAP_HOSTGROUP,
+    PIPELINE_QUEUE_SIZE,
+    RESULTS_FORMAT,
+)
 from logger import ScanLogger
-from nmap_scanner import NmapScanner
+from nmap_scanner import NmapScanner, open_services
+from openvas_batch import OpenVASBatchRunner
 from openvas_scanner import OpenVASScanner
+from targets import TargetSet
 
 
 class ScanningEngine:
@@ -11,14 +25,19 @@ class ScanningEngine:
         self.nmap = NmapScanner()
         self.openvas = OpenVASScanner()
 
-    def run(self, target):
-        self.log.info(f'Starting scan on {target}')
+    def run(self, target, incremental=False, batched=False, harvest=False):
+        self.log.info(f'Starting scan on {target}', target=target)
 
-        nmap_results = self.nmap.scan(target)
+        if incremental:
+            nmap_results = self.nmap.scan_incremental(
+                target, self.nmap.latest_results(target)
+            )
+        else:
+            nmap_results = self.nmap.scan(target)
         if nmap_results:
             self.nmap.save(
                 nmap_results,
-                f'nmap_{datetime.now().strftime("%Y%m%d_%H%M%S")}.json'
+                f'nmap_{datetime.now().strftime("%Y%m%d_%H%M%S")}.{RESULTS_FORMAT}'
             )
 
         if not self.openvas.connect():
@@ -26,7 +45,22 @@ class ScanningEngine:
 
         try:
             scan_name = f'scan_{datetime.now().strftime("%Y%m%d_%H%M%S")}'
-            target_id = self.openvas.create_target(scan_name, target)
+            use_port_list = bool(nmap_results) and OPENVAS_NMAP_PORT_LIST
+            if batched and nmap_results:
+                alive_hosts = [
+                    ip for ip, host in nmap_results['hosts'].items()
+                    if host['state'] == 'up'
+                ]
+                self._report(OpenVASBatchRunner(self.openvas).run(
+                    alive_hosts, scan_name,
+                    nmap_results if use_port_list else None
+                ))
+                return
+
+            services = open_services(nmap_results) if use_port_list else None
+            target_id = self.openvas.get_or_create_target(
+                target, services=services
+            )
             if not target_id:
                 return
 
@@ -39,7 +73,8 @@ class ScanningEngine:
                 return
 
             task_id = self.openvas.create_task(
-                scan_name, target_id, config_id, scanner_id
+                scan_name, target_id, config_id, scanner_id,
+                hosts=target, services=services
             )
             if not task_id:
                 return
@@ -48,23 +83,122 @@ class ScanningEngine:
             if not report_id:
                 return
 
+            if harvest:
+                self._report(self.openvas.wait_and_harvest(task_id))
+                return
+
             if not self.openvas.wait_for_completion(task_id):
                 return
 
-            openvas_results = self.openvas.get_results(task_id)
-            if openvas_results:
-                self.openvas.save(
-                    openvas_results,
-                    f'openvas_{datetime.now().strftime("%Y%m%d_%H%M%S")}.json'
-                )
-                print(
-                    f'\nScan Complete: '
-                    f'{openvas_results["total_vulnerabilities"]} vulnerabilities found'
-                )
+            self._report(self.openvas.get_results(task_id))
 
         finally:
             self.openvas.disconnect()
 
+    def run_pipelined(self, target, batch_size=OPENVAS_BATCH_SIZE,
+                      window=PIPELINE_BATCH_WINDOW):
+        # Nmap feeds live hosts into a bounded queue while OpenVAS tasks are
+        # started on micro-batches of them, so the two stages overlap
+        self.log.info(f'Starting pipelined scan on {target}', target=target)
+        if not self.openvas.connect():
+            return
+
+        try:
+            runner = OpenVASBatchRunner(self.openvas, batch_size)
+            if not runner.prepare():
+                return
+
+            hosts = queue.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+            producer = threading.Thread(
+                target=self._discover, args=(target, hosts),
+                name='pipeline-nmap', daemon=True
+            )
+            producer.start()
+
+            scan_name = f'scan_{datetime.now().strftime("%Y%m%d_%H%M%S")}'
+            batch = {}
+            deadline = None
+            finished = False
+            while not finished:
+                timeout = window
+                if deadline is not None:
+                    timeout = max(0, deadline - time.monotonic())
+                try:
+                    item = hosts.get(timeout=timeout)
+                    if item is None:
+                        finished = True
+                    else:
+                        batch[item[0]] = item[1]
+                        if deadline is None:
+                            deadline = time.monotonic() + window
+                except queue.Empty:
+                    pass
+
+                if batch and (finished or len(batch) >= batch_size
+                              or time.monotonic() >= deadline):
+                    self._submit_batch(runner, scan_name, batch)
+                    batch = {}
+                    deadline = None
+                runner.reap(timeout=0)
+
+            producer.join()
+            if not runner.submitted:
+                self.log.info('No live hosts found; nothing to scan')
+                return
+            self._report(runner.finish())
+
+        finally:
+            self.openvas.disconnect()
+
+    def _discover(self, target, hosts):
+        # Smaller host groups let nmap report hosts as soon as they finish
+        arguments = f'{NMAP_PROFILE} --max-hostgroup {PIPELINE_NMAP_HOSTGROUP}'
+        results = {
+            'timestamp': datetime.now().isoformat(),
+            'target': target,
+            'command': f'nmap {arguments} {target}',
+            'hosts': {}
+        }
+        try:
+            for host, host_data in self.nmap.scan_stream(target, arguments):
+                results['hosts'][host] = host_data
+                if host_data['state'] == 'up':
+                    hosts.put((host, host_data))
+            self.nmap.save(
+                results,
+                f'nmap_{datetime.now().strftime("%Y%m%d_%H%M%S")}.{RESULTS_FORMAT}'
+            )
+        except Exception as e:
+            # The partial scan is not saved; hosts already queued still get
+            # their OpenVAS batches
+            self.log.error(
+                f'Pipelined discovery failed after {len(results["hosts"])} '
+                f'hosts, nmap results not saved: {str(e)}'
+            )
+        finally:
+            hosts.put(None)
+
+    def _submit_batch(self, runner, scan_name, batch):
+        services = None
+        if OPENVAS_NMAP_PORT_LIST:
+            services = open_services({'hosts': batch})
+        self.log.info(f'Starting OpenVAS batch of {len(batch)} hosts')
+        # Collecting finished batches here blocks the queue, and so nmap,
+        # only when every task slot is busy
+        runner.wait_for_slot()
+        runner.submit(scan_name, list(batch), services)
+
+    def _report(self, openvas_results):
+        if openvas_results:
+            self.openvas.save(
+                openvas_results,
+                f'openvas_{datetime.now().strftime("%Y%m%d_%H%M%S")}.{RESULTS_FORMAT}'
+            )
+            print(
+                f'\nScan Complete: '
+                f'{openvas_results["total_vulnerabilities"]} vulnerabilities found'
+            )
+
 
 def main():
     print('1. scanme.nmap.org\n2. 127.0.0.1\n3. Custom target')
@@ -75,13 +209,26 @@ def main():
     elif choice == '2':
         target = '127.0.0.1'
     elif choice == '3':
-        target = input('Enter target: ').strip()
+        target = input('Enter target (IPs, CIDRs, ranges, hostnames or @file): ').strip()
         if input('Have permission? (yes/no): ').lower() != 'yes':
             return
     else:
         return
+    exclude = input('Exclude (same forms, blank for none): ').strip()
 
-    ScanningEngine().run(target)
+    targets = TargetSet(target, exclude)
+    if not targets:
+        print('No valid targets')
+        return
+    if target.startswith('@') or exclude:
+        # nmap and OpenVAS get the merged ranges, not the file name or the
+        # addresses that were excluded
+        target = str(targets)
+
+    if input('Overlap Nmap and OpenVAS? (yes/no): ').lower() == 'yes':
+        ScanningEngine().run_pipelined(target)
+    else:
+        ScanningEngine().run(target)
 
 
 if __name__ == '__main__':
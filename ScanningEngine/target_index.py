@@ -0,0 +1,113 @@
+import hashlib
+import threading
+
+from config import CACHE_DIR, GMP_TARGET_INDEX_TTL
+from gmp_cache import CatalogCache
+from gmp_pool import as_tree
+
+
+def target_key(hosts, port_list_id=None):
+    canonical = ','.join(sorted(set(hosts))) + '|' + (port_list_id or '')
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+def target_name(key):
+    return f'Target-{key[:16]}'
+
+
+def port_range(services):
+    # gvmd range syntax with consecutive ports folded: T:20-23,80,U:53
+    parts = []
+    for protocol, prefix in (('tcp', 'T'), ('udp', 'U')):
+        ports = sorted({
+            int(s['port']) for s in services
+            if s['protocol'] == protocol and s.get('state', 'open') == 'open'
+        })
+        runs = []
+        for port in ports:
+            if runs and port == runs[-1][1] + 1:
+                runs[-1][1] = port
+            else:
+                runs.append([port, port])
+        if runs:
+            parts.append(prefix + ':' + ','.join(
+                f'{first}-{last}' if last > first else str(first)
+                for first, last in runs
+            ))
+    return ','.join(parts)
+
+
+def port_list_name(key):
+    return f'PortList-{key[:16]}'
+
+
+def _find_or_create(index_key, name, fetch, xpath, create):
+    def lookup():
+        # Server-side exact-name filter: one row back regardless of count
+        tree = as_tree(fetch(filter_string=f'name="{name}" rows=1'))
+        ids = tree.xpath(xpath)
+        if ids:
+            return ids[0]
+        return create(name)
+
+    return target_index().get(index_key, lookup)
+
+
+def find_or_create_target(gmp, namespace, hosts, port_list_id, create):
+    key = target_key(hosts, port_list_id)
+    return _find_or_create(
+        f'{namespace}:{key}', target_name(key),
+        gmp.get_targets, 'target/@id', create
+    )
+
+
+def find_or_create_port_list(gmp, namespace, ports, create):
+    # Identical port sets share one gvmd port list
+    key = hashlib.sha256(ports.encode()).hexdigest()
+    return _find_or_create(
+        f'{namespace}:port_list:{key}', port_list_name(key),
+        gmp.get_port_lists, 'port_list/@id', create
+    )
+
+
+def services_port_list(gmp, namespace, services):
+    # One gvmd port list per distinct set of open ports; None if none known
+    ports = port_range(services)
+    if not ports:
+        return None
+
+    def create(name):
+        tree = as_tree(gmp.create_port_list(name=name, port_range=ports))
+        if tree.get('status') not in ('200', '201'):
+            raise RuntimeError(
+                f'Port list creation failed: {tree.get("status_text")}'
+            )
+        return tree.get('id')
+
+    return find_or_create_port_list(gmp, namespace, ports, create)
+
+
+def forget_target(namespace, target_id):
+    target_index().invalidate(f'{namespace}:', value=target_id)
+
+
+def forget_port_list(namespace, port_list_id):
+    target_index().invalidate(f'{namespace}:port_list:', value=port_list_id)
+
+
+def forget_all(namespace):
+    target_index().invalidate(f'{namespace}:')
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def target_index():
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = CatalogCache(
+                CACHE_DIR / 'target_index.json', ttl=GMP_TARGET_INDEX_TTL
+            )
+        return _index
@@ -0,0 +1,340 @@
+import ipaddress
+import itertools
+import random
+import re
+import socket
+import threading
+import time
+from bisect import bisect_right
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from config import DNS_CACHE_TTL, DNS_WORKERS
+from logger import ScanLogger
+
+ADDRESS = {4: ipaddress.IPv4Address, 6: ipaddress.IPv6Address}
+HOSTNAME = re.compile(
+    r'^(?=.{1,253}\.?$)[a-z0-9](?:[a-z0-9-]{0,61}[a-z0-9])?'
+    r'(?:\.[a-z0-9](?:[a-z0-9-]{0,61}[a-z0-9])?)*\.?$',
+    re.IGNORECASE
+)
+# Digits, dots and ranges only: a malformed address, never a hostname
+NUMERIC = re.compile(r'^[\d.*-]+$')
+
+_dns_cache = {}
+_dns_lock = threading.Lock()
+
+
+def _lookup(name):
+    # nmap scans IPv4 unless run with -6, so names resolve to A records
+    try:
+        infos = socket.getaddrinfo(name, None, socket.AF_INET, socket.SOCK_STREAM)
+    except (socket.gaierror, UnicodeError):
+        return ()
+    return tuple(sorted({info[4][0] for info in infos}))
+
+
+def resolve(names, ttl=DNS_CACHE_TTL, workers=DNS_WORKERS):
+    now = time.monotonic()
+    resolved = {}
+    with _dns_lock:
+        for name in names:
+            cached = _dns_cache.get(name)
+            if cached and cached[0] > now:
+                resolved[name] = cached[1]
+
+    missing = [name for name in dict.fromkeys(names) if name not in resolved]
+    if missing:
+        with ThreadPoolExecutor(max_workers=min(workers, len(missing))) as pool:
+            answers = dict(zip(missing, pool.map(_lookup, missing)))
+        with _dns_lock:
+            for name, addresses in answers.items():
+                _dns_cache[name] = (now + ttl, addresses)
+        resolved.update(answers)
+    return resolved
+
+
+def iter_tokens(targets):
+    if isinstance(targets, (str, Path)):
+        targets = [targets]
+    for entry in targets:
+        if isinstance(entry, Path):
+            entry = f'@{entry}'
+        for token in str(entry).replace(',', ' ').split():
+            if token.startswith('@'):
+                yield from iter_file_tokens(token[1:])
+            else:
+                yield token
+
+
+def iter_file_tokens(path):
+    with open(path) as f:
+        for line in f:
+            yield from line.split('#', 1)[0].replace(',', ' ').split()
+
+
+def parse_octets(token):
+    # nmap's per-octet notation: 10.0.0-3.1, 192.168.*.1-20
+    parts = token.split('.')
+    if len(parts) != 4:
+        return None
+    octets = []
+    for part in parts:
+        if part == '*':
+            octets.append((0, 255))
+            continue
+        low, sep, high = part.partition('-')
+        if not low.isdigit() or (sep and not high.isdigit()):
+            return None
+        low, high = int(low), int(high) if sep else int(low)
+        if high > 255 or low > high:
+            return None
+        octets.append((low, high))
+
+    # Octets after the last partial one run 0-255, so every combination of
+    # the ones before it is a single interval
+    k = 3
+    while k > 0 and octets[k] == (0, 255):
+        k -= 1
+    shift = 8 * (3 - k)
+    spans = []
+    choices = [range(lo, hi + 1) for lo, hi in octets[:k]]
+    for prefix in itertools.product(*choices):
+        base = 0
+        for value in prefix:
+            base = base << 8 | value
+        low, high = octets[k]
+        spans.append((
+            4,
+            (base << 8 | low) << shift,
+            ((base << 8 | high) << shift) | ((1 << shift) - 1)
+        ))
+    return spans
+
+
+def parse_token(token):
+    # A list of (version, first, last) for addresses, None for a hostname
+    if '/' in token:
+        network = ipaddress.ip_network(token, strict=False)
+        return [(
+            network.version,
+            int(network.network_address),
+            int(network.broadcast_address)
+        )]
+
+    start, sep, end = token.partition('-')
+    try:
+        first = ipaddress.ip_address(start)
+    except ValueError:
+        spans = parse_octets(token)
+        if spans is not None:
+            return spans
+        if NUMERIC.match(token) or not HOSTNAME.match(token):
+            raise ValueError(f'Not an address, network or hostname: {token}')
+        return None
+
+    if not sep:
+        return [(first.version, int(first), int(first))]
+    if end.isdigit() and first.version == 4:
+        # nmap-style last-octet range: 10.0.0.1-50
+        last = ipaddress.IPv4Address(int(first) & ~0xff | int(end))
+    else:
+        last = ipaddress.ip_address(end)
+    if last.version != first.version or last < first:
+        raise ValueError(f'Bad address range: {token}')
+    return [(first.version, int(first), int(last))]
+
+
+def nmap_family(arguments, hosts):
+    # One nmap run scans one address family; IPv6 targets need -6
+    if any(':' in host for host in hosts) and '-6' not in arguments.split():
+        return f'{arguments} -6'
+    return arguments
+
+
+def merge_ranges(ranges):
+    merged = []
+    for first, last in sorted(ranges):
+        if merged and first <= merged[-1][1] + 1:
+            if last > merged[-1][1]:
+                merged[-1][1] = last
+        else:
+            merged.append([first, last])
+    return [(first, last) for first, last in merged]
+
+
+def subtract_ranges(ranges, excluded):
+    # Both sides sorted and merged, so one linear sweep covers them
+    remaining = []
+    j = 0
+    for first, last in ranges:
+        while j < len(excluded) and excluded[j][1] < first:
+            j += 1
+        k = j
+        while k < len(excluded) and excluded[k][0] <= last:
+            if excluded[k][0] > first:
+                remaining.append((first, excluded[k][0] - 1))
+            first = max(first, excluded[k][1] + 1)
+            if first > last:
+                break
+            k += 1
+        if first <= last:
+            remaining.append((first, last))
+    return remaining
+
+
+def range_networks(version, first, last):
+    return [
+        str(net.network_address) if net.num_addresses == 1 else str(net)
+        for net in ipaddress.summarize_address_range(
+            ADDRESS[version](first), ADDRESS[version](last)
+        )
+    ]
+
+
+class TargetSet:
+    def __init__(self, targets=(), exclude=(), resolve_names=True):
+        self.log = ScanLogger('targets')
+        self.names = {}
+        self.unresolved = []
+        self.invalid = []
+        ranges = self._parse(targets, resolve_names)
+        if exclude:
+            excluded = TargetSet(exclude, resolve_names=resolve_names)._ranges
+            ranges = {
+                version: subtract_ranges(spans, excluded.get(version, []))
+                for version, spans in ranges.items()
+            }
+        self._set_ranges(ranges)
+
+    @classmethod
+    def from_ranges(cls, ranges):
+        targets = cls.__new__(cls)
+        targets.log = ScanLogger('targets')
+        targets.names = {}
+        targets.unresolved = []
+        targets.invalid = []
+        targets._set_ranges(ranges)
+        return targets
+
+    def _parse(self, targets, resolve_names):
+        spans = {4: [], 6: []}
+        names = []
+        for token in iter_tokens(targets):
+            try:
+                parsed = parse_token(token)
+            except ValueError as e:
+                self.invalid.append(token)
+                self.log.warning(f'Skipping target {token}: {str(e)}')
+                continue
+            if parsed is None:
+                names.append(token.lower().rstrip('.'))
+                continue
+            for version, first, last in parsed:
+                spans[version].append((first, last))
+
+        if names and resolve_names:
+            for name, addresses in resolve(names).items():
+                if not addresses:
+                    self.unresolved.append(name)
+                    self.log.warning(f'Could not resolve {name}')
+                    continue
+                self.names[name] = list(addresses)
+                for address in addresses:
+                    value = int(ipaddress.IPv4Address(address))
+                    spans[4].append((value, value))
+        elif names:
+            self.unresolved.extend(dict.fromkeys(names))
+
+        return {version: merge_ranges(r) for version, r in spans.items()}
+
+    def _set_ranges(self, ranges):
+        self._ranges = {v: list(r) for v, r in ranges.items() if r}
+        # Cumulative offsets let sample() and __contains__ bisect instead
+        # of walking the addresses
+        self._flat = [
+            (version, first, last)
+            for version in sorted(self._ranges)
+            for first, last in self._ranges[version]
+        ]
+        self._offsets = []
+        total = 0
+        for _, first, last in self._flat:
+            self._offsets.append(total)
+            total += last - first + 1
+        self.size = total
+
+    def __bool__(self):
+        return self.size > 0
+
+    def __iter__(self):
+        for version, first, last in self._flat:
+            for value in range(first, last + 1):
+                yield str(ADDRESS[version](value))
+
+    def __contains__(self, address):
+        try:
+            address = ipaddress.ip_address(address)
+        except ValueError:
+            return str(address).lower().rstrip('.') in self.names
+        spans = self._ranges.get(address.version, [])
+        i = bisect_right(spans, (int(address), float('inf'))) - 1
+        return i >= 0 and spans[i][0] <= int(address) <= spans[i][1]
+
+    def __str__(self):
+        return ' '.join(self.networks())
+
+    def ranges(self):
+        return [
+            (ADDRESS[version](first), ADDRESS[version](last))
+            for version, first, last in self._flat
+        ]
+
+    def networks(self):
+        return [
+            network
+            for version, first, last in self._flat
+            for network in range_networks(version, first, last)
+        ]
+
+    def address(self, index):
+        if not 0 <= index < self.size:
+            raise IndexError(index)
+        i = bisect_right(self._offsets, index) - 1
+        version, first, _ = self._flat[i]
+        return str(ADDRESS[version](first + index - self._offsets[i]))
+
+    def sample(self, count):
+        # randrange copes with IPv6-sized sets; random.sample(range()) needs
+        # a length that fits in a C ssize_t
+        if count >= self.size:
+            picked = list(range(self.size))
+            random.shuffle(picked)
+        else:
+            picked = set()
+            while len(picked) < count:
+                picked.add(random.randrange(self.size))
+        return [self.address(i) for i in picked]
+
+    def split(self, size):
+        # Consecutive pieces of at most `size` addresses; a piece never mixes
+        # IPv4 and IPv6 since one nmap run cannot scan both
+        piece = {}
+        count = 0
+        for version, first, last in self._flat:
+            if piece and version not in piece:
+                yield TargetSet.from_ranges(piece)
+                piece, count = {}, 0
+            while first <= last:
+                take = min(last - first + 1, size - count)
+                piece.setdefault(version, []).append((first, first + take - 1))
+                count += take
+                first += take
+                if count == size:
+                    yield TargetSet.from_ranges(piece)
+                    piece, count = {}, 0
+        if piece:
+            yield TargetSet.from_ranges(piece)
+
+    def shards(self, count):
+        return list(self.split(max(1, -(-self.size // max(1, count)))))
@@ -0,0 +1,191 @@
+import threading
+import time
+from concurrent.futures import Future
+
+from config import (
+    TASK_POLL_MIN_INTERVAL,
+    TASK_POLL_MAX_INTERVAL,
+    TASK_POLL_MAX_FAILURES,
+)
+from gmp_pool import as_tree
+from logger import ScanLogger
+
+TERMINAL_STATUSES = ('Done', 'Stopped', 'Interrupted')
+
+
+class TrackedTask:
+    def __init__(self, task_id, min_interval):
+        self.task_id = task_id
+        self.future = Future()
+        self.callbacks = []
+        self.status = None
+        self.progress = 0
+        self.rate = None
+        self.interval = min_interval
+        self.next_poll = 0.0
+        self.failures = 0
+        self._last = None
+
+    def update(self, status, progress, now, min_interval, max_interval):
+        if self._last is not None:
+            last_progress, last_time = self._last
+            if progress > last_progress and now > last_time:
+                rate = (progress - last_progress) / (now - last_time)
+                self.rate = rate if self.rate is None else (self.rate + rate) / 2
+        self._last = (progress, now)
+        self.status = status
+        self.progress = progress
+
+        if self.rate:
+            # Poll a few times over the remaining estimate, tighter near the end
+            eta = (100 - progress) / self.rate
+            self.interval = eta / 4
+        else:
+            self.interval *= 1.5
+        self.interval = min(max(self.interval, min_interval), max_interval)
+        self.next_poll = now + self.interval
+
+    def eta(self):
+        if not self.rate:
+            return None
+        return (100 - self.progress) / self.rate
+
+
+class TaskPoller:
+    def __init__(self, session, min_interval=TASK_POLL_MIN_INTERVAL,
+                 max_interval=TASK_POLL_MAX_INTERVAL,
+                 max_failures=TASK_POLL_MAX_FAILURES):
+        self.session = session
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.max_failures = max_failures
+        self.log = ScanLogger('task-poller')
+        self._tasks = {}
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def track(self, task_id, callback=None):
+        with self._cond:
+            tracked = self._tasks.get(task_id)
+            if tracked is None:
+                tracked = TrackedTask(task_id, self.min_interval)
+                self._tasks[task_id] = tracked
+            if callback:
+                tracked.callbacks.append(callback)
+            tracked.next_poll = 0.0
+
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name='task-poller', daemon=True
+                )
+                self._thread.start()
+            self._cond.notify()
+        return tracked.future
+
+    def untrack(self, task_id):
+        with self._cond:
+            tracked = self._tasks.pop(task_id, None)
+        self.log.forget(task_id)
+        if tracked:
+            tracked.future.cancel()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if not self._tasks:
+                    self._thread = None
+                    return
+
+                now = time.monotonic()
+                wake = min(t.next_poll for t in self._tasks.values())
+                if wake > now:
+                    self._cond.wait(wake - now)
+                    continue
+                due = [t for t in self._tasks.values() if t.next_poll <= now]
+
+            self._poll(due)
+
+    def _poll(self, due):
+        # One filtered get_tasks for every task that is due this tick
+        task_filter = ' or '.join(f'uuid={t.task_id}' for t in due)
+        try:
+            with self.session() as gmp:
+                tree = as_tree(gmp.get_tasks(
+                    filter_string=f'{task_filter} rows={len(due)}'
+                ))
+        except Exception as e:
+            self.log.error(f'Task status poll failed: {str(e)}')
+            # gvmd down or refusing us: give up on a task after enough
+            # failures in a row instead of leaving its waiters blocked
+            retry_at = time.monotonic() + self.max_interval
+            for tracked in due:
+                tracked.failures += 1
+                if tracked.failures >= self.max_failures:
+                    self._finish(tracked, error=RuntimeError(
+                        f'Task {tracked.task_id} status unavailable after '
+                        f'{tracked.failures} failed polls: {str(e)}'
+                    ))
+                else:
+                    tracked.next_poll = retry_at
+            return
+
+        statuses = {}
+        for task in tree.iterfind('task'):
+            progress = int(task.findtext('progress') or 0)
+            statuses[task.get('id')] = (task.findtext('status'), max(progress, 0))
+
+        now = time.monotonic()
+        for tracked in due:
+            if tracked.task_id not in statuses:
+                self._finish(tracked, error=RuntimeError(
+                    f'Task {tracked.task_id} not found'
+                ))
+                continue
+
+            tracked.failures = 0
+            status, progress = statuses[tracked.task_id]
+            if status == 'Done':
+                progress = 100
+            changed = status != tracked.status
+            tracked.update(
+                status, progress, now, self.min_interval, self.max_interval
+            )
+            eta = tracked.eta()
+            # Status changes always show; plain progress is rate-limited
+            self.log.progress(
+                tracked.task_id,
+                f'Task {tracked.task_id}: {status} | Progress: {progress}%'
+                + (f' | ETA {int(eta)}s' if eta is not None else ''),
+                force=changed, task=tracked.task_id
+            )
+
+            for callback in tracked.callbacks:
+                try:
+                    callback(tracked.task_id, status, progress)
+                except Exception as e:
+                    self.log.error(f'Poller callback failed: {str(e)}')
+
+            if status in TERMINAL_STATUSES:
+                self._finish(tracked, status=status)
+
+    def _finish(self, tracked, status=None, error=None):
+        with self._cond:
+            self._tasks.pop(tracked.task_id, None)
+        self.log.forget(tracked.task_id)
+        if tracked.future.done():
+            return
+        if error is not None:
+            tracked.future.set_exception(error)
+        else:
+            tracked.future.set_result(status)
+
+
+_pollers = {}
+_pollers_lock = threading.Lock()
+
+
+def shared_poller(pool):
+    with _pollers_lock:
+        if pool.name not in _pollers:
+            _pollers[pool.name] = TaskPoller(pool.session)
+        return _pollers[pool.name]
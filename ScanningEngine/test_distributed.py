@@ -0,0 +1,109 @@
+import threading
+import time
+
+import distributed
+from distributed import Coordinator, CoordinatorClient, Worker, serve
+from targets import TargetSet
+
+
+def start(coordinator):
+    server, _ = serve('127.0.0.1', 0, coordinator, token='secret')
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    host, port = server.server_address[:2]
+    return server, f'http://{host}:{port}'
+
+
+def wait_for(predicate, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.02)
+    return False
+
+
+def test_two_workers_cover_every_shard(monkeypatch):
+    scanned_by = {}
+
+    def fake_run_nmap(hosts, arguments):
+        # Slow enough that both workers hold a lease at some point
+        time.sleep(0.05)
+        for ip in TargetSet(hosts):
+            scanned_by[ip] = threading.current_thread().name
+            yield ip, {'state': 'up', 'services': []}
+
+    monkeypatch.setattr(distributed, 'run_nmap', fake_run_nmap)
+    coordinator = Coordinator(save=False)
+    server, url = start(coordinator)
+    try:
+        job_id = CoordinatorClient(url, token='secret').submit(
+            '10.0.0.0/28', shard_size=2
+        )
+        threads = [
+            threading.Thread(
+                target=Worker(url, name, token='secret', idle_wait=0.05).run,
+                kwargs={'once': True}, name=name
+            )
+            for name in ('w1', 'w2')
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(10)
+
+        status = CoordinatorClient(url, token='secret').status(job_id)
+        assert status['finished']
+        assert status['shards'] == {'done': 8}
+        assert sorted(status['results']['hosts']) == sorted(
+            TargetSet('10.0.0.0/28')
+        )
+        assert set(scanned_by.values()) == {'w1', 'w2'}
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_bad_token_is_rejected():
+    server, url = start(Coordinator(save=False))
+    try:
+        status, _ = CoordinatorClient(url, token='wrong').request(
+            'POST', '/lease', {'worker': 'w'}
+        )
+        assert status == 403
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_merge_runs_outside_the_lock(monkeypatch):
+    coordinator = Coordinator(save=False)
+    merging = threading.Event()
+    release = threading.Event()
+    merge = coordinator.merge
+
+    def slow_merge(job, done, failed):
+        merging.set()
+        release.wait(10)
+        return merge(job, done, failed)
+
+    monkeypatch.setattr(coordinator, 'merge', slow_merge)
+    first = coordinator.submit('10.0.0.1')
+    second = coordinator.submit('10.0.0.2')
+    lease = coordinator.lease('w1')
+    finisher = threading.Thread(
+        target=coordinator.complete,
+        args=(lease['lease_id'], {'hosts': {'10.0.0.1': {'state': 'up'}}})
+    )
+    finisher.start()
+    try:
+        assert merging.wait(10)
+        # Leases and heartbeats keep working while the first job merges
+        other = coordinator.lease('w2')
+        assert other['job_id'] == second
+        assert coordinator.heartbeat(other['lease_id'])
+        assert not coordinator.status(first)['finished']
+    finally:
+        release.set()
+        finisher.join(10)
+    assert wait_for(lambda: coordinator.status(first)['finished'])
@@ -0,0 +1,47 @@
+import pytest
+
+from ndjson_io import (
+    NdjsonWriter,
+    TruncatedResults,
+    iter_hosts,
+    load_results,
+    read_header,
+)
+from results_store import ResultsStore
+
+
+def write_nmap(path, finish=True):
+    writer = NdjsonWriter(
+        path, 'nmap', timestamp='2026-01-01T00:00:00', target='10.0.0.1'
+    )
+    writer.write_host('10.0.0.1', {'state': 'up', 'services': []})
+    if finish:
+        writer.close()
+    else:
+        writer._file.close()
+
+
+def test_truncated_file_is_rejected(tmp_path):
+    path = tmp_path / 'nmap_1.ndjson'
+    write_nmap(path, finish=False)
+    with pytest.raises(TruncatedResults):
+        list(iter_hosts(path))
+    with pytest.raises(TruncatedResults):
+        load_results(path)
+
+    store = ResultsStore(tmp_path / 'results.db')
+    assert store.import_file(path) is None
+    assert store.latest_scan('nmap') is None
+
+
+def test_import_uses_header_kind(tmp_path):
+    path = tmp_path / 'nmap_1.ndjson'
+    write_nmap(path)
+    assert read_header(path)['kind'] == 'nmap'
+    assert load_results(path)['hosts'] == {
+        '10.0.0.1': {'state': 'up', 'services': []}
+    }
+
+    store = ResultsStore(tmp_path / 'results.db')
+    assert store.import_file(path) is not None
+    assert store.latest_alive_hosts() == ['10.0.0.1']
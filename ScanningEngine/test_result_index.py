@@ -0,0 +1,30 @@
+import json
+import sys
+from pathlib import Path
+
+import scan_diff
+from result_index import build_index, index_path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent / 'openvas'))
+
+from extract_hosts import get_latest_nmap_file  # noqa: E402
+
+
+def write_scan(path, hosts):
+    with open(path, 'w') as f:
+        json.dump({'target': '10.0.0.0/30', 'hosts': hosts}, f)
+
+
+def test_sidecar_is_not_a_result_file(tmp_path, monkeypatch):
+    old = tmp_path / 'nmap_20260101_000000.json'
+    new = tmp_path / 'nmap_20260102_000000.json'
+    write_scan(old, {'10.0.0.1': {'state': 'up'}})
+    write_scan(new, {'10.0.0.1': {'state': 'up'}, '10.0.0.2': {'state': 'up'}})
+    build_index(old)
+    build_index(new)
+    assert Path(index_path(new)).exists()
+
+    assert get_latest_nmap_file(str(tmp_path)) == str(new)
+
+    monkeypatch.setattr(scan_diff, 'RESULTS_DIR', tmp_path)
+    assert scan_diff.latest_pair('nmap') == (old, new)
@@ -0,0 +1,129 @@
+import ipaddress
+
+import pytest
+
+import targets
+from targets import (
+    TargetSet,
+    merge_ranges,
+    nmap_family,
+    parse_octets,
+    subtract_ranges,
+)
+
+
+def addresses(spec, exclude=()):
+    return set(TargetSet(spec, exclude, resolve_names=False))
+
+
+def brute_subtract(ranges, excluded):
+    values = {v for first, last in ranges for v in range(first, last + 1)}
+    values -= {v for first, last in excluded for v in range(first, last + 1)}
+    return values
+
+
+def test_merge_ranges_joins_overlapping_and_adjacent():
+    assert merge_ranges([(5, 9), (1, 3), (4, 4), (20, 30), (25, 26)]) == [
+        (1, 9), (20, 30)
+    ]
+
+
+@pytest.mark.parametrize('ranges, excluded', [
+    ([(0, 100)], [(10, 20), (30, 40)]),
+    ([(0, 100)], [(0, 100)]),
+    ([(0, 10), (20, 30)], [(5, 25)]),
+    ([(0, 10), (20, 30), (40, 50)], [(8, 9), (10, 22), (29, 41)]),
+    ([(10, 20)], [(0, 5), (25, 30)]),
+    ([(0, 5), (7, 9)], []),
+])
+def test_subtract_ranges_matches_set_difference(ranges, excluded):
+    remaining = subtract_ranges(ranges, excluded)
+    assert {
+        v for first, last in remaining for v in range(first, last + 1)
+    } == brute_subtract(ranges, excluded)
+    assert remaining == merge_ranges(remaining)
+
+
+def test_parse_forms():
+    assert addresses('10.0.0.1-3') == {'10.0.0.1', '10.0.0.2', '10.0.0.3'}
+    assert addresses('10.0.0.254-10.0.1.1') == {
+        '10.0.0.254', '10.0.0.255', '10.0.1.0', '10.0.1.1'
+    }
+    assert addresses('10.0.0.0/30, 10.0.0.2') == {
+        '10.0.0.0', '10.0.0.1', '10.0.0.2', '10.0.0.3'
+    }
+
+
+def test_octet_ranges_and_wildcards():
+    assert addresses('10.0.0-3.1') == {f'10.0.{i}.1' for i in range(4)}
+    assert TargetSet('10.0.0.*').networks() == ['10.0.0.0/24']
+    assert TargetSet('10.*.*.*').networks() == ['10.0.0.0/8']
+    assert len(parse_octets('10.1-2.*.5-6')) == 2 * 256
+    assert parse_octets('10.0.0.300') is None
+
+
+def test_invalid_and_unresolved_tokens():
+    t = TargetSet('10.0.0.300 bad_host!! example.invalid', resolve_names=False)
+    assert t.size == 0
+    assert t.invalid == ['10.0.0.300', 'bad_host!!']
+    assert t.unresolved == ['example.invalid']
+
+
+def test_exclusions():
+    t = TargetSet('10.0.0.0/24', exclude='10.0.0.0/25 10.0.0.200-255')
+    assert t.networks() == ['10.0.0.128/26', '10.0.0.192/29']
+    assert '10.0.0.130' in t
+    assert '10.0.0.10' not in t
+
+
+def test_hostnames_resolve_once_through_cache(monkeypatch):
+    calls = []
+
+    def lookup(name):
+        calls.append(name)
+        return ('192.0.2.10',)
+
+    monkeypatch.setattr(targets, '_lookup', lookup)
+    monkeypatch.setattr(targets, '_dns_cache', {})
+    t = TargetSet('host.test HOST.test. 192.0.2.10')
+    TargetSet('host.test')
+    assert list(t) == ['192.0.2.10']
+    assert t.names == {'host.test': ['192.0.2.10']}
+    assert calls == ['host.test']
+
+
+def test_split_covers_every_address_once():
+    t = TargetSet('10.0.0.0/26 10.0.1.5-9 2001:db8::/126')
+    pieces = list(t.split(16))
+    assert sum(p.size for p in pieces) == t.size
+    assert all(p.size <= 16 for p in pieces)
+    assert set().union(*(set(p) for p in pieces)) == set(t)
+    # IPv4 and IPv6 never share a piece
+    for piece in pieces:
+        versions = {
+            ipaddress.ip_network(n, strict=False).version
+            for n in piece.networks()
+        }
+        assert len(versions) == 1
+
+
+def test_shards_count():
+    assert len(TargetSet('10.0.0.0/24').shards(4)) == 4
+    assert len(TargetSet('10.0.0.1').shards(4)) == 1
+
+
+def test_address_and_sample_on_huge_sets():
+    t = TargetSet('2001:db8::/64')
+    assert t.address(t.size - 1) == '2001:db8::ffff:ffff:ffff:ffff'
+    sample = t.sample(8)
+    assert len(set(sample)) == 8
+    assert all(a in t for a in sample)
+    assert sorted(TargetSet('10.0.0.0/30').sample(10)) == [
+        '10.0.0.0', '10.0.0.1', '10.0.0.2', '10.0.0.3'
+    ]
+
+
+def test_nmap_family():
+    assert nmap_family('-sV', ['10.0.0.0/24']) == '-sV'
+    assert nmap_family('-sV', ['2001:db8::/126']) == '-sV -6'
+    assert nmap_family('-sV -6', ['2001:db8::1']) == '-sV -6'